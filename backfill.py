@@ -0,0 +1,157 @@
+import argparse
+import concurrent.futures
+import datetime
+import threading
+import time
+
+import race_store
+import scraper
+from scraper import fetch_html, get_session, make_soup, parse_race_data, parse_odds_3t, parse_odds_2t, parse_result
+
+# ==========================================
+# 📥 過去レース一括取り込み (再開可能)
+# ==========================================
+#   python backfill.py --from 20250101 --to 20251231
+#   python backfill.py --from 20250101 --to 20250131 --venues 8,10,21 --rate 3 --fetchers 6
+#
+# 取得はスレッド (同時接続数 & 秒間リクエスト数で制限)、HTML解析はプロセスプール、
+# 書き込みは race_store へまとめて行う。ingest_log に記録済みのレースは再取得しない。
+
+PAGES = ("racelist", "beforeinfo", "raceresult", "odds3t", "odds2tf")
+
+class RateLimiter:
+    """全スレッド共通の秒間リクエスト数制限 (一定間隔で払い出す)"""
+    def __init__(self, rate_per_sec):
+        self.interval = 1.0 / rate_per_sec if rate_per_sec > 0 else 0.0
+        self.next_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval: return
+        with self.lock:
+            now = time.monotonic()
+            at = max(self.next_at, now)
+            self.next_at = at + self.interval
+        if at > now: time.sleep(at - now)
+
+def date_range(date_from, date_to):
+    d = datetime.datetime.strptime(date_from, "%Y%m%d").date()
+    end = datetime.datetime.strptime(date_to, "%Y%m%d").date()
+    while d <= end:
+        yield d.strftime("%Y%m%d")
+        d += datetime.timedelta(days=1)
+
+# ------------------------------------------
+# 解析 (プロセスプール側)
+# ------------------------------------------
+def parse_pages(date_str, jcd, rno, pages):
+    """取得済みHTML (bytes) から1レース分のレコードを作る"""
+    soups = {k: make_soup(v) if v else None for k, v in pages.items()}
+    rec = {'date': date_str, 'jcd': jcd, 'rno': rno, 'status': "OK"}
+    rec['raw'] = parse_race_data(soups.get('beforeinfo'), soups.get('racelist'), jcd, rno, date_str)
+    if soups.get('raceresult'): rec['result'] = parse_result(soups['raceresult'])
+    if soups.get('odds3t'): rec['odds_3t'] = parse_odds_3t(soups['odds3t'])
+    if soups.get('odds2tf'): rec['odds_2t'] = parse_odds_2t(soups['odds2tf'])
+    return rec
+
+# ------------------------------------------
+# 取得 (スレッド側)
+# ------------------------------------------
+_TLS = threading.local()
+
+def _session():
+    if getattr(_TLS, "sess", None) is None:
+        _TLS.sess = get_session()
+    return _TLS.sess
+
+def fetch_race(limiter, date_str, jcd, rno, retries=2):
+    """1レース分のページを取得: ('OK', pages) / ('NO_RACE', None) / ('ERROR', None)"""
+    pages = {}
+    for page in PAGES:
+        url = f"{scraper.BASE_URL}/{page}?rno={rno}&jcd={jcd:02d}&hd={date_str}"
+        for attempt in range(retries + 1):
+            limiter.wait()
+            body, status = fetch_html(_session(), url)
+            if status == "OK" or status == "NO_RACE": break
+            time.sleep(1.0 * (attempt + 1))
+        if page == "racelist" and status == "NO_RACE":
+            return "NO_RACE", None
+        # 取得失敗 (NO_RACE 以外) はどのページでも記録しない。結果・オッズが欠けたまま
+        # 取り込み済みにすると再開時に取り直されないため
+        if status not in ("OK", "NO_RACE"):
+            return "ERROR", None
+        pages[page] = body
+    return "OK", pages
+
+def ingest_venue_day(limiter, parse_pool, date_str, jcd, done):
+    """1会場1日分 (最大12R) を取り込む。1Rが開催なしならその日は残りも開催なしとみなす"""
+    records = []
+    for rno in range(1, 13):
+        if (date_str, jcd, rno) in done: continue
+        status, pages = fetch_race(limiter, date_str, jcd, rno)
+        if status == "NO_RACE" and rno == 1:
+            records.extend({'date': date_str, 'jcd': jcd, 'rno': r, 'status': "NO_RACE"} for r in range(1, 13)
+                           if (date_str, jcd, r) not in done)
+            break
+        if status == "ERROR": continue # 記録しない = 次回再取得
+        if status == "NO_RACE":
+            records.append({'date': date_str, 'jcd': jcd, 'rno': rno, 'status': "NO_RACE"})
+            continue
+        records.append(parse_pool.submit(parse_pages, date_str, jcd, rno, pages).result())
+    return records
+
+def run_backfill(date_from, date_to, venues, fetchers=4, rate=2.0, parsers=None, batch=200, store=None):
+    conn = race_store.connect(store)
+    done = race_store.done_keys(conn, date_from, date_to)
+    tasks = [(d, j) for d in date_range(date_from, date_to) for j in venues
+             if any((d, j, r) not in done for r in range(1, 13))]
+    print(f"📥 取り込み開始: {date_from}〜{date_to} / {len(venues)}場 / 対象 {len(tasks)} 会場日 (済: {len(done)}R)")
+
+    limiter = RateLimiter(rate)
+    buf, total_ok, total_none = [], 0, 0
+    t0 = time.time()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=parsers) as parse_pool, \
+         concurrent.futures.ThreadPoolExecutor(max_workers=fetchers) as fetch_pool:
+        futs = {fetch_pool.submit(ingest_venue_day, limiter, parse_pool, d, j, done): (d, j) for d, j in tasks}
+        try:
+            for n, fut in enumerate(concurrent.futures.as_completed(futs), start=1):
+                d, j = futs[fut]
+                try:
+                    recs = fut.result()
+                except Exception as e:
+                    print(f"⚠️ 取り込みエラー {d} {j}場: {e}")
+                    continue
+                buf.extend(recs)
+                total_ok += sum(1 for r in recs if r['status'] == "OK")
+                total_none += sum(1 for r in recs if r['status'] != "OK")
+                if len(buf) >= batch:
+                    race_store.save_batch(conn, buf); buf = []
+                if n % 20 == 0 or n == len(futs):
+                    el = time.time() - t0
+                    print(f"  ... {n}/{len(futs)} 会場日 | 取得 {total_ok}R / 開催なし {total_none}R | {total_ok / el if el else 0:.2f} R/s")
+        except KeyboardInterrupt:
+            print("⏸️ 中断: 取得済み分を保存して終了します (次回はここから再開)")
+            for f in futs: f.cancel()
+        finally:
+            # 中断時も完了済みの会場日は必ず書き込む
+            if buf: race_store.save_batch(conn, buf)
+            conn.close()
+    print(f"✅ 取り込み完了: {total_ok}R 保存 ({time.time() - t0:.1f}秒)")
+
+def main():
+    ap = argparse.ArgumentParser(description="過去レースの一括取り込み")
+    ap.add_argument("--from", dest="date_from", required=True, help="開始日 YYYYMMDD")
+    ap.add_argument("--to", dest="date_to", required=True, help="終了日 YYYYMMDD")
+    ap.add_argument("--venues", default="", help="会場 (例: 8,10,21。省略時は全24場)")
+    ap.add_argument("--fetchers", type=int, default=4, help="同時取得スレッド数")
+    ap.add_argument("--rate", type=float, default=2.0, help="秒間リクエスト上限 (全体)")
+    ap.add_argument("--parsers", type=int, default=None, help="解析プロセス数 (省略時はCPU数)")
+    ap.add_argument("--batch", type=int, default=200, help="何レースごとに書き込むか")
+    ap.add_argument("--store", default=None, help=f"保存先 (省略時は {race_store.STORE_FILE})")
+    args = ap.parse_args()
+
+    venues = [int(v) for v in args.venues.split(",") if v.strip()] or list(range(1, 25))
+    run_backfill(args.date_from, args.date_to, venues, args.fetchers, args.rate, args.parsers, args.batch, args.store)
+
+if __name__ == "__main__":
+    main()
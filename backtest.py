@@ -0,0 +1,286 @@
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+
+from predict_boat import PERMS_3T, PERMS_2T, COMBOS_3T, COMBOS_2T, CONF_THRESH_3T
+
+# ==========================================
+# 🧮 戦略バックテスト (会場別 EV 閾値の探索)
+# ==========================================
+#   python backtest.py --data races.npz                 # 3T/2T 両方をグリッド探索
+#   python backtest.py --data races.npz --type 3t --min-races 200 --json bt.json
+#   python backtest.py --store race_store.db --from 20250101 --to 20251231   # backfill.py の取り込み結果から
+#   python backtest.py --synthetic 20000                # 合成データで動作確認
+#
+# 入力 (.npz, R = レース数):
+#   jcd (R,) / conf_3t (R,)                  会場・3T自信度 (max p1)
+#   prob_3t (R,120) / prob_2t (R,30)         組み合わせ確率 (predict_boat.COMBOS_* の順)
+#   odds_3t (R,120) / odds_2t (R,30)         締切前オッズ (0 = 取得なし)
+#   result_3t (R,) / result_2t (R,)          的中組み合わせの添字 (-1 = 不成立・不明)
+#   payout_3t (R,) / payout_2t (R,)          100円あたり払戻金
+#
+# (MIN_PROB, ODDS_CAP) ごとに EV を1度だけ計算して降順ソートしておくと、
+# 「EV>=閾値 の上位 MAX_BETS 点」は常にソート済み配列の先頭 n 点になる。
+# よって閾値・点数の全組み合わせを累積和の参照だけで評価できる。
+
+BET_UNIT = 100
+PLACE_NAMES = {i: n for i, n in enumerate(["","桐生","戸田","江戸川","平和島","多摩川","浜名湖","蒲郡","常滑","津","三国","びわこ","住之江","尼崎","鳴門","丸亀","児島","宮島","徳山","下関","若松","芦屋","福岡","唐津","大村"])}
+
+GRID_3T = {
+    'min_prob': [0.005, 0.01, 0.02, 0.03],
+    'odds_cap': [30.0, 50.0, 80.0, 120.0],
+    'ev_thresh': [1.0, 1.2, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 5.0],
+    'max_bets': [1, 2, 3, 5, 8],
+}
+GRID_2T = {
+    'min_prob': [0.005, 0.01, 0.02, 0.05],
+    'odds_cap': [30.0, 50.0, 100.0],
+    'ev_thresh': [1.0, 1.2, 1.5, 2.0, 2.5, 3.0, 4.0],
+    'max_bets': [1, 2, 3, 5],
+}
+
+def load_dataset(path):
+    with np.load(path) as z:
+        return {k: z[k] for k in z.files}
+
+def save_dataset(path, data):
+    np.savez_compressed(path, **data)
+
+def dataset_from_store(store_path=None, date_from=None, date_to=None, venues=None):
+    """race_store のレースに現行モデルの確率を付けてデータセットにする"""
+    import race_store
+    from predict_boat import load_models, predict_probs
+    load_models()
+    idx3 = {c: i for i, c in enumerate(COMBOS_3T)}
+    idx2 = {c: i for i, c in enumerate(COMBOS_2T)}
+    cols = {k: [] for k in ('jcd', 'conf_3t', 'prob_3t', 'prob_2t', 'odds_3t', 'odds_2t',
+                            'result_3t', 'result_2t', 'payout_3t', 'payout_2t')}
+    conn = race_store.connect(store_path)
+    for rec in race_store.iter_races(conn, date_from, date_to, venues, with_odds=True):
+        res = rec['result']
+        if not res: continue
+        probs = predict_probs(rec['raw'])
+        if probs is None: continue
+        p3, conf, p2 = probs
+        o3, o2 = rec.get('odds_3t') or {}, rec.get('odds_2t') or {}
+        cols['jcd'].append(rec['jcd'])
+        cols['conf_3t'].append(conf)
+        cols['prob_3t'].append(p3 if p3 is not None else np.zeros(120))
+        cols['prob_2t'].append(p2 if p2 is not None else np.zeros(30))
+        cols['odds_3t'].append([o3.get(c, 0.0) for c in COMBOS_3T])
+        cols['odds_2t'].append([o2.get(c, 0.0) for c in COMBOS_2T])
+        cols['result_3t'].append(idx3.get(res.get('combo_3t'), -1))
+        cols['result_2t'].append(idx2.get(res.get('combo_2t'), -1))
+        cols['payout_3t'].append(res.get('payout_3t') or 0)
+        cols['payout_2t'].append(res.get('payout_2t') or 0)
+    conn.close()
+    out = {k: np.asarray(v) for k, v in cols.items()}
+    for k, width in (('prob_3t', 120), ('prob_2t', 30), ('odds_3t', 120), ('odds_2t', 30)):
+        out[k] = out[k].reshape(-1, width).astype(np.float64)
+    return out
+
+# ------------------------------------------
+# 評価 (1会場 × 1 (min_prob, odds_cap) で閾値・点数を一括)
+# ------------------------------------------
+def evaluate_block(prob, odds, result, payout, eligible, min_prob, odds_cap, ev_threshs, max_bets_list):
+    """戻り値: (len(ev_threshs), len(max_bets_list), 4) = [賭けたレース数, 購入点数, 的中レース数, 払戻合計]"""
+    R, C = prob.shape
+    out = np.zeros((len(ev_threshs), len(max_bets_list), 4), dtype=np.float64)
+    if R == 0: return out
+
+    ev = prob * np.minimum(odds, odds_cap)
+    ok = (prob >= min_prob) & (odds > 0) & eligible[:, None]
+    ev = np.where(ok, ev, -np.inf)
+
+    order = np.argsort(-ev, axis=1, kind='stable')
+    ev_sorted = np.take_along_axis(ev, order, axis=1)
+    hit_sorted = (order == result[:, None]) & (result[:, None] >= 0)
+    # 各レースで先頭 n 点買ったときの払戻 (的中は1レース1点なので累積和でよい)
+    ret_cum = np.concatenate([np.zeros((R, 1)), np.cumsum(hit_sorted * payout[:, None], axis=1)], axis=1)
+    hit_cum = np.concatenate([np.zeros((R, 1), dtype=bool), np.cumsum(hit_sorted, axis=1) > 0], axis=1)
+    rows = np.arange(R)
+
+    for a, th in enumerate(ev_threshs):
+        n_pass = (ev_sorted >= th).sum(axis=1)
+        for b, k in enumerate(max_bets_list):
+            n = np.minimum(n_pass, k)
+            out[a, b, 0] = np.count_nonzero(n)
+            out[a, b, 1] = n.sum()
+            out[a, b, 2] = np.count_nonzero(hit_cum[rows, n])
+            out[a, b, 3] = ret_cum[rows, n].sum()
+    return out
+
+# ------------------------------------------
+# プロセスプール
+# ------------------------------------------
+_DATA = None
+
+def _init_worker(path):
+    global _DATA
+    _DATA = load_dataset(path)
+
+def _run_task(task):
+    bet_type, jcd, min_prob, odds_cap, conf_thresh, ev_threshs, max_bets_list = task
+    d = _DATA
+    sel = d['jcd'] == jcd
+    if bet_type == '3t':
+        eligible = d['conf_3t'][sel] >= conf_thresh
+    else:
+        eligible = np.ones(int(sel.sum()), dtype=bool)
+    res = evaluate_block(
+        d[f'prob_{bet_type}'][sel], d[f'odds_{bet_type}'][sel], d[f'result_{bet_type}'][sel],
+        d[f'payout_{bet_type}'][sel].astype(np.float64), eligible,
+        min_prob, odds_cap, ev_threshs, max_bets_list,
+    )
+    return task, int(sel.sum()), res
+
+def run_grid(data_path, bet_types, grids, venues, workers=None, conf_thresh_3t=0.0):
+    """全会場 × パラメータグリッドを評価して行のリストを返す"""
+    tasks = []
+    for bt in bet_types:
+        g = grids[bt]
+        conf = conf_thresh_3t if bt == '3t' else 0.0
+        for jcd in venues:
+            for mp, cap in itertools.product(g['min_prob'], g['odds_cap']):
+                tasks.append((bt, jcd, mp, cap, conf, g['ev_thresh'], g['max_bets']))
+
+    rows = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data_path,)) as ex:
+        for task, n_races, res in ex.map(_run_task, tasks, chunksize=max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 4))):
+            bt, jcd, mp, cap, _, ths, ks = task
+            for a, th in enumerate(ths):
+                for b, k in enumerate(ks):
+                    races_bet, n_bets, races_hit, ret = res[a, b]
+                    stake = n_bets * BET_UNIT
+                    rows.append({
+                        'type': bt, 'jcd': int(jcd), 'min_prob': mp, 'odds_cap': cap,
+                        'ev_thresh': th, 'max_bets': k, 'races': n_races,
+                        'races_bet': int(races_bet), 'bets': int(n_bets), 'races_hit': int(races_hit),
+                        'stake': int(stake), 'return': int(ret),
+                        'profit': int(ret - stake),
+                        'roi': (ret / stake) if stake else 0.0,
+                        'hit_rate': (races_hit / races_bet) if races_bet else 0.0,
+                    })
+    return rows
+
+def best_by_venue(rows, min_races_bet):
+    """会場・券種ごとに ROI 最大 (十分なレース数があるもの) を選ぶ"""
+    best = {}
+    for r in rows:
+        if r['races_bet'] < min_races_bet: continue
+        key = (r['type'], r['jcd'])
+        cur = best.get(key)
+        if cur is None or (r['roi'], r['profit']) > (cur['roi'], cur['profit']):
+            best[key] = r
+    return best
+
+def print_tables(best, venues):
+    for bt in ('3t', '2t'):
+        if not any(k[0] == bt for k in best): continue
+        print(f"\n===== {bt.upper()} 会場別ベスト =====")
+        print(f"{'会場':<6}{'EV':>6}{'確率':>7}{'CAP':>7}{'点':>4}{'R数':>7}{'的中率':>8}{'ROI':>8}{'収支':>10}")
+        for jcd in venues:
+            r = best.get((bt, jcd))
+            name = PLACE_NAMES.get(jcd, str(jcd))
+            if not r:
+                print(f"{name:<6}{'(見送り: 条件を満たす設定なし)':>20}")
+                continue
+            print(f"{name:<6}{r['ev_thresh']:>6.1f}{r['min_prob']*100:>6.1f}%{r['odds_cap']:>7.0f}{r['max_bets']:>4}"
+                  f"{r['races_bet']:>7}{r['hit_rate']*100:>7.1f}%{r['roi']*100:>7.1f}%{r['profit']:>+10,}")
+
+def strategy_snippet(best, bet_type, venues, min_roi=1.0):
+    """STRATEGY_3T/2T に貼れる形の辞書 (ROI が min_roi 未満の会場は 99.9 = 見送り)"""
+    out = {}
+    for jcd in venues:
+        r = best.get((bet_type, jcd))
+        out[jcd] = {'ev_thresh': r['ev_thresh'] if r and r['roi'] >= min_roi else 99.9}
+    return out
+
+# ------------------------------------------
+# 合成データ (動作確認用)
+# ------------------------------------------
+def synthetic_dataset(n, seed=0):
+    rng = np.random.default_rng(seed)
+    idx3, idx2 = np.array(PERMS_3T), np.array(PERMS_2T)
+    strength = rng.normal(0, 1, (n, 6)); strength[:, 0] += 1.0
+    w = np.exp(strength); w /= w.sum(axis=1, keepdims=True)
+
+    def harville3(w):
+        a, b, c = w[:, idx3[:, 0]], w[:, idx3[:, 1]], w[:, idx3[:, 2]]
+        return a * b / (1 - a) * c / (1 - a - b)
+    def harville2(w):
+        a, b = w[:, idx2[:, 0]], w[:, idx2[:, 1]]
+        return a * b / (1 - a)
+
+    true3 = harville3(w)
+    # モデルは真の強さをノイズ付きで推定、市場は控除率25%で別のノイズ
+    wm = np.exp(strength + rng.normal(0, 0.3, (n, 6))); wm /= wm.sum(axis=1, keepdims=True)
+    wo = np.exp(strength + rng.normal(0, 0.4, (n, 6))); wo /= wo.sum(axis=1, keepdims=True)
+    odds3 = np.round(0.75 / harville3(wo), 1)
+    odds2 = np.round(0.75 / harville2(wo), 1)
+    res3 = np.array([rng.choice(120, p=p / p.sum()) for p in true3])
+    res2 = np.array([PERMS_2T.index(tuple(idx3[r][:2])) for r in res3])
+    rows = np.arange(n)
+    return {
+        'jcd': rng.integers(1, 25, n),
+        'conf_3t': wm.max(axis=1),
+        'prob_3t': harville3(wm), 'prob_2t': harville2(wm),
+        'odds_3t': odds3, 'odds_2t': odds2,
+        'result_3t': res3, 'result_2t': res2,
+        'payout_3t': (odds3[rows, res3] * 100).astype(np.int64),
+        'payout_2t': (odds2[rows, res2] * 100).astype(np.int64),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="会場別 EV 閾値のバックテスト")
+    ap.add_argument("--data", default="", help="入力データセット (.npz)")
+    ap.add_argument("--store", default="", help="race_store.db から作る (--data の代わり)")
+    ap.add_argument("--from", dest="date_from", default=None, help="--store の開始日 YYYYMMDD")
+    ap.add_argument("--to", dest="date_to", default=None, help="--store の終了日 YYYYMMDD")
+    ap.add_argument("--synthetic", type=int, default=0, help="合成データのレース数 (--data の代わり)")
+    ap.add_argument("--type", choices=["3t", "2t", "both"], default="both")
+    ap.add_argument("--venues", default="", help="対象会場 (例: 8,10,21。省略時は全24場)")
+    ap.add_argument("--workers", type=int, default=None, help="プロセス数 (省略時はCPU数)")
+    ap.add_argument("--min-races", type=int, default=100, help="ベスト選定に必要な最低購入レース数")
+    ap.add_argument("--json", default="", help="全グリッドの結果を JSON で保存")
+    args = ap.parse_args()
+
+    data_path = args.data
+    if args.synthetic:
+        data_path = os.path.abspath(f"backtest_synthetic_{args.synthetic}.npz")
+        save_dataset(data_path, synthetic_dataset(args.synthetic))
+        print(f"🧪 合成データを作成: {data_path}")
+    venues = [int(v) for v in args.venues.split(",") if v.strip()] or list(range(1, 25))
+    if args.store:
+        data_path = os.path.abspath("backtest_store.npz")
+        data = dataset_from_store(args.store, args.date_from, args.date_to, venues)
+        save_dataset(data_path, data)
+        print(f"🗄️ ストアから {len(data['jcd']):,} レースを読み込み: {data_path}")
+    if not data_path:
+        ap.error("--data / --store / --synthetic のいずれかを指定してください")
+
+    bet_types = ['3t', '2t'] if args.type == "both" else [args.type]
+
+    t0 = time.perf_counter()
+    rows = run_grid(data_path, bet_types, {'3t': GRID_3T, '2t': GRID_2T}, venues, args.workers, CONF_THRESH_3T)
+    print(f"⏱️ {len(rows):,} 通りを {time.perf_counter() - t0:.2f} 秒で評価")
+
+    best = best_by_venue(rows, args.min_races)
+    print_tables(best, venues)
+    for bt in bet_types:
+        print(f"\n# STRATEGY_{bt.upper()} 候補 (ROI100%未満は見送り)")
+        for jcd, v in strategy_snippet(best, bt, venues).items():
+            print(f"    {jcd}: {v},")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"rows": rows, "best": [dict(r) for r in best.values()]}, f, ensure_ascii=False)
+        print(f"💾 結果を保存しました: {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import mock_boatrace
+from http_archive import ReplayResponse
+
+# ==========================================
+# ⏱️ ベンチマーク (scrape → predict → EV → DB)
+# ==========================================
+#   python benchmark.py                          # 計測して bench_result.json に保存
+#   python benchmark.py --save-baseline          # bench_baseline.json を更新
+#   python benchmark.py --compare bench_baseline.json   # 基準と比較 (劣化があれば exit 1)
+#   python benchmark.py --capture-fixtures       # 本物のページを取得して bench_fixtures/ に保存
+#   python benchmark.py --capture-fixtures --archive http_archive.jsonl   # 記録モードのアーカイブから
+#   python benchmark.py --regen-fixtures         # bench_fixtures/mock/ (代替サーバーの HTML) を作り直す
+#
+# HTML は bench_fixtures/ の固定ファイル、レースは合成データ、モデルは同梱の
+# boatrace_model_2t.txt を使うので、ネットワークなしで毎回同じ入力になる。
+# 解析の計測は本物のページ (大きく入れ子も深い) で行う。bench_fixtures/ に無いページだけ
+# bench_fixtures/mock/ で代用し、結果の "fixtures" に "mock" と残す (比較は同じ種類どうしで)。
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(HERE, "bench_fixtures")
+MOCK_FIXTURE_DIR = os.path.join(FIXTURE_DIR, "mock")
+FIXTURE_INFO = os.path.join(FIXTURE_DIR, "fixtures.json")
+DEFAULT_OUT = os.path.join(HERE, "bench_result.json")
+DEFAULT_BASELINE = os.path.join(HERE, "bench_baseline.json")
+FIXTURE_PAGES = ("racelist", "beforeinfo", "odds3t", "odds2tf", "raceresult")
+FIXTURE_DATE, FIXTURE_JCD, FIXTURE_RNO = "20260207", 8, 5
+
+# ------------------------------------------
+# 入力データ
+# ------------------------------------------
+def capture_fixtures(archive=None, date_str=FIXTURE_DATE, jcd=FIXTURE_JCD, rno=FIXTURE_RNO):
+    """本物のページを bench_fixtures/ に保存する。archive を渡すと記録モードのアーカイブ
+    (各ページの最後の記録) から、なければ BOATRACE_BASE_URL から取得する"""
+    import scraper
+    import http_archive
+    query = f"?rno={rno}&jcd={jcd:02d}&hd={date_str}"
+    pages = {}
+    if archive:
+        arc = http_archive.Archive(archive)
+        for name in FIXTURE_PAGES:
+            url = next((u for u in arc.entries if u.endswith(f"/{name}{query}")), None)
+            res = arc.lookup(url, float("inf")) if url else None
+            if res is None or res.status_code != 200:
+                raise RuntimeError(f"アーカイブに {name}{query} の記録がありません: {archive}")
+            pages[name] = res.content
+    else:
+        sess = scraper.get_session()
+        for name in FIXTURE_PAGES:
+            body, status = scraper.fetch_html(sess, f"{scraper.BASE_URL}/{name}{query}")
+            if status != "OK":
+                raise RuntimeError(f"{name}{query} を取得できません: {status}")
+            pages[name] = body
+    # 全ページ揃ってから書く (一部だけ入れ替わった組を残さない)
+    for name, body in pages.items():
+        with open(os.path.join(FIXTURE_DIR, f"{name}.html"), "wb") as f:
+            f.write(body)
+    info = {'source': os.path.basename(archive) if archive else scraper.BASE_URL,
+            'date': date_str, 'jcd': jcd, 'rno': rno,
+            'captured_at': datetime.datetime.now().isoformat(timespec="seconds")}
+    with open(FIXTURE_INFO, "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    print(f"📝 本物のページを保存しました: {FIXTURE_DIR} ({', '.join(f'{n} {len(b):,}B' for n, b in pages.items())})")
+
+def regen_fixtures():
+    """代替サーバーと同じ生成器で固定HTML (本物のページが無いときの代用) を書き出す"""
+    import random
+    cfg = mock_boatrace.MockConfig(seed=1)
+    cfg.started_at = datetime.datetime(2026, 2, 7, 10, 0, tzinfo=mock_boatrace.JST)
+    race = mock_boatrace.synth_race(cfg, FIXTURE_DATE, FIXTURE_JCD, FIXTURE_RNO)
+    o2 = mock_boatrace.synth_odds_2t(cfg, race, random.Random(0))
+    o3 = mock_boatrace.synth_odds_3t(cfg, race, random.Random(0))
+    o2f = mock_boatrace.synth_odds_2f(cfg, race, random.Random(0))
+    o3f = mock_boatrace.synth_odds_3f(cfg, race, random.Random(0))
+    pages = {
+        "racelist": mock_boatrace.html_racelist(cfg, race),
+        "beforeinfo": mock_boatrace.html_beforeinfo(cfg, race),
+        "odds3t": mock_boatrace.html_odds3t(o3),
+        "odds2tf": mock_boatrace.html_odds2tf(o2, o2f),
+        "raceresult": mock_boatrace.html_raceresult(race, o2, o3, o2f, o3f),
+    }
+    os.makedirs(MOCK_FIXTURE_DIR, exist_ok=True)
+    for name, html in pages.items():
+        with open(os.path.join(MOCK_FIXTURE_DIR, f"{name}.html"), "w", encoding="utf-8") as f:
+            f.write(html)
+    print(f"📝 フィクスチャを書き出しました: {MOCK_FIXTURE_DIR}")
+
+class FixtureSession:
+    """URL のページ名に応じて bench_fixtures/ の HTML を返すセッション (無いページは mock/ で代用)"""
+    def __init__(self):
+        self.pages = {}
+        mocked = []
+        for name in FIXTURE_PAGES:
+            path = os.path.join(FIXTURE_DIR, f"{name}.html")
+            if not os.path.exists(path):
+                path = os.path.join(MOCK_FIXTURE_DIR, f"{name}.html")
+                mocked.append(name)
+            with open(path, "rb") as f:
+                self.pages[name] = f.read()
+        self.source = "mock" if len(mocked) == len(FIXTURE_PAGES) else "real" if not mocked else "mixed"
+        if mocked:
+            print(f"⚠️ 本物のページが無いため代替サーバーの HTML で計測します: {', '.join(mocked)} "
+                  "(python benchmark.py --capture-fixtures で取得)")
+
+    def get(self, url, headers=None, timeout=None):
+        page = url.split("?", 1)[0].rsplit("/", 1)[-1]
+        body = self.pages.get(page)
+        return ReplayResponse(200, body) if body else ReplayResponse(404, b"")
+
+def synth_raws(n, seed=0):
+    """predict_race 用の合成 raw 辞書を n 件作る"""
+    cfg = mock_boatrace.MockConfig(seed=seed)
+    raws = []
+    for idx in range(n):
+        jcd, rno = idx % 24 + 1, idx // 24 % 12 + 1
+        race = mock_boatrace.synth_race(cfg, FIXTURE_DATE, jcd, rno)
+        row = {'date': int(FIXTURE_DATE), 'jcd': jcd, 'rno': rno, 'wind': float(race['wind']), 'deadline_time': '12:00'}
+        for i, b in enumerate(race['boats'], start=1):
+            row[f'pid{i}'] = b['pid']; row[f'wr{i}'] = b['wr']; row[f'mo{i}'] = b['mo']
+            row[f'ex{i}'] = b['ex']; row[f'f{i}'] = b['f']; row[f'st{i}'] = b['st']
+        raws.append(row)
+    return raws
+
+# ------------------------------------------
+# 計測
+# ------------------------------------------
+def bench(fn, repeat, warmup=2):
+    """fn() を repeat 回実行し、1回あたりの秒数の統計を返す"""
+    for _ in range(warmup): fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return {
+        "n": repeat,
+        "mean": statistics.fmean(samples),
+        "median": statistics.median(samples),
+        "p95": samples[min(len(samples) - 1, int(0.95 * (len(samples) - 1) + 0.5))],
+        "min": samples[0],
+    }
+
+def run_suite(repeat, sess):
+    import scraper
+    import predict_boat
+    import main as bot
+
+    results = {}
+    d, j, r = FIXTURE_DATE, FIXTURE_JCD, FIXTURE_RNO
+    scraper.COALESCE_TTL = 0 # 同じページを繰り返し測るので、直近の取得結果は使い回さない
+
+    # --- スクレイピング (HTML解析のみ, 通信なし) ---
+    results["scrape_race_data"] = bench(lambda: scraper.scrape_race_data(sess, j, r, d), repeat)
+    results["get_odds_map"] = bench(lambda: scraper.get_odds_map(sess, j, r, d), repeat)
+    results["get_odds_2t"] = bench(lambda: scraper.get_odds_2t(sess, j, r, d), repeat)
+    results["scrape_result"] = bench(lambda: scraper.scrape_result(sess, j, r, d), repeat)
+
+    # --- 予測 ---
+    predict_boat.load_models()
+    raws = synth_raws(48)
+    it = iter(range(10 ** 9))
+    results["predict_race"] = bench(lambda: predict_boat.predict_race(raws[next(it) % len(raws)]), repeat)
+
+    # --- EVフィルタ ---
+    odds_3t = scraper.get_odds_map(sess, j, r, d)
+    odds_2t = scraper.get_odds_2t(sess, j, r, d)
+    candidates = []
+    for raw in raws:
+        candidates, _, _, _ = predict_boat.predict_race(dict(raw, jcd=j))
+        if candidates: break
+    results["filter_and_sort_bets"] = bench(
+        lambda: predict_boat.filter_and_sort_bets([dict(c) for c in candidates], odds_2t, odds_3t, j), repeat)
+
+    # --- DB (本番と同じスキーマ・SQL) ---
+    with tempfile.TemporaryDirectory() as tmp:
+        orig_db = bot.DB_FILE
+        bot.DB_FILE = os.path.join(tmp, "bench.db")
+        try:
+            bot.init_db()
+            results.update(_bench_sql(bot.DB_FILE, repeat))
+        finally:
+            bot.DB_FILE = orig_db
+    return results
+
+def _bench_sql(db_file, repeat):
+    import main as bot
+    out = {}
+    conn = sqlite3.connect(db_file)
+    # 過去分を積んでおく (集計クエリが空振りしないように)
+    hist = []
+    for n in range(5000):
+        day = f"202601{n % 28 + 1:02d}"
+        hist.append((f"{day}_{n % 24 + 1}_{n % 12 + 1}_1-2-{n}_3t", day, "常滑", n % 12 + 1, "1-2-3",
+                     "FINISHED", -100 if n % 7 else 900, 10.0, 2.0, 3.5, "", "3t" if n % 3 else "2t", 9.5, "bench"))
+    conn.executemany(bot.HISTORY_INSERT, hist)
+    conn.commit()
+
+    seq = iter(range(10 ** 9))
+    def insert_bet():
+        n = next(seq)
+        conn.execute(
+            bot.HISTORY_INSERT,
+            (f"{FIXTURE_DATE}_8_{n % 12 + 1}_{n}_3t", FIXTURE_DATE, "常滑", n % 12 + 1, f"x{n}", 'PENDING', 0, 12.3, 2.5, 3.1, "bench", "3t", 0.0, "bench")
+        )
+        conn.commit()
+    out["history_insert"] = bench(insert_bet, repeat)
+
+    settle_seq = iter(range(10 ** 9))
+    def settle_bet():
+        n = next(settle_seq)
+        conn.execute("SELECT * FROM history WHERE status='PENDING'").fetchall()
+        conn.execute("UPDATE history SET status='FINISHED', profit=?, result_odds=? WHERE race_id=?",
+                     (-100, 11.0, f"{FIXTURE_DATE}_8_{n % 12 + 1}_{n}_3t"))
+        conn.commit()
+        # report_worker と同じ集計
+        conn.execute("SELECT SUM(profit) FROM history WHERE date=? AND status='FINISHED'", (FIXTURE_DATE,)).fetchone()
+        conn.execute("SELECT SUM(profit) FROM history WHERE substr(date,1,6)=? AND status='FINISHED'", (FIXTURE_DATE[:6],)).fetchone()
+        for t in ("2t", "3t"):
+            conn.execute("SELECT COUNT(*) FROM history WHERE date=? AND ticket_type=? AND status='FINISHED' AND profit > 0", (FIXTURE_DATE, t)).fetchone()
+            conn.execute("SELECT COUNT(*) FROM history WHERE date=? AND ticket_type=? AND status='FINISHED'", (FIXTURE_DATE, t)).fetchone()
+    out["history_settle"] = bench(settle_bet, repeat, warmup=0)
+    conn.close()
+    return out
+
+# ------------------------------------------
+# 出力 & 比較
+# ------------------------------------------
+def build_report(results, fixtures):
+    return {
+        "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "fixtures": fixtures,
+        "results": results,
+    }
+
+def compare(current, baseline, threshold):
+    """median を基準と比較し、threshold (0.1=10%) を超えて遅くなった項目を返す"""
+    regressions = []
+    if current.get("fixtures") != baseline.get("fixtures"):
+        print(f"⚠️ フィクスチャの種類が基準と違います ({baseline.get('fixtures')} -> {current.get('fixtures')})。解析の比較は参考程度に")
+    print(f"{'bench':<24}{'base(ms)':>12}{'now(ms)':>12}{'ratio':>9}")
+    for name, cur in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            print(f"{name:<24}{'-':>12}{cur['median'] * 1e3:>12.3f}{'new':>9}")
+            continue
+        ratio = cur["median"] / base["median"] if base["median"] > 0 else float("inf")
+        mark = " ⚠️" if ratio > 1 + threshold else ""
+        print(f"{name:<24}{base['median'] * 1e3:>12.3f}{cur['median'] * 1e3:>12.3f}{ratio:>8.2f}x{mark}")
+        if ratio > 1 + threshold: regressions.append(name)
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser(description="ボートレースBot ベンチマーク")
+    ap.add_argument("--repeat", type=int, default=50, help="各ベンチの試行回数")
+    ap.add_argument("--out", default=DEFAULT_OUT, help="結果JSONの出力先")
+    ap.add_argument("--compare", default="", help="比較する基準JSON")
+    ap.add_argument("--threshold", type=float, default=0.10, help="劣化とみなす比率 (0.10=10%%)")
+    ap.add_argument("--save-baseline", action="store_true", help=f"結果を {os.path.basename(DEFAULT_BASELINE)} に保存")
+    ap.add_argument("--capture-fixtures", action="store_true", help="本物のページを bench_fixtures/ に保存して終了")
+    ap.add_argument("--archive", default=None, help="--capture-fixtures の取得元 (記録モードのアーカイブ)")
+    ap.add_argument("--date", default=FIXTURE_DATE, help="--capture-fixtures のレース日 YYYYMMDD")
+    ap.add_argument("--jcd", type=int, default=FIXTURE_JCD, help="--capture-fixtures の会場番号")
+    ap.add_argument("--rno", type=int, default=FIXTURE_RNO, help="--capture-fixtures のレース番号")
+    ap.add_argument("--regen-fixtures", action="store_true", help="bench_fixtures/mock/ を再生成して終了")
+    args = ap.parse_args()
+
+    if args.capture_fixtures:
+        capture_fixtures(args.archive, args.date, args.jcd, args.rno)
+        return
+    if args.regen_fixtures:
+        regen_fixtures()
+        return
+
+    sess = FixtureSession()
+    report = build_report(run_suite(args.repeat, sess), sess.source)
+    for name, r in report["results"].items():
+        print(f"⏱️ {name:<24} median={r['median'] * 1e3:9.3f}ms  p95={r['p95'] * 1e3:9.3f}ms")
+
+    out = DEFAULT_BASELINE if args.save_baseline else args.out
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 結果を保存しました: {out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"❌ 性能劣化: {', '.join(regressions)}")
+            sys.exit(1)
+        print("✅ 劣化なし")
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,42 @@
-import os
-from openai import OpenAI
+import time
 
-api_key = os.environ.get("GROQ_API_KEY")
-if not api_key:
-    print("No GROQ_API_KEY found")
-    exit()
+import llm_router
 
-client = OpenAI(
-    base_url="https://api.groq.com/openai/v1",
-    api_key=api_key,
-)
+# ==========================================
+# 🤖 解説用 LLM の疎通確認
+# ==========================================
+#   python check_models.py
+# 設定中のエンドポイント (GROQ_API_KEY + LLM_MODELS / LLM_ENDPOINTS) ごとに、
+# 提供されているモデル一覧と、短い問い合わせの応答時間を表示する。
 
-try:
-    models = client.models.list()
-    print("Available Models:")
-    for m in models:
-        print(m.id)
-except Exception as e:
-    print(f"Error: {e}")
+if not llm_router.OPENAI_AVAILABLE:
+    print("❌ 'openai' ライブラリが見つかりません。")
+    raise SystemExit(1)
+
+router = llm_router.get_router()
+if not router:
+    print("No API key found (GROQ_API_KEY / LLM_ENDPOINTS)")
+    raise SystemExit(1)
+
+listed = set()
+for ep in router.endpoints:
+    client = ep.client()
+    if client is None:
+        print(f"⚠️ {ep.name}: {ep.api_key_env} が未設定")
+        continue
+    if ep.base_url not in listed:
+        listed.add(ep.base_url)
+        try:
+            print(f"Available Models ({ep.base_url}):")
+            for m in client.models.list():
+                print(f"  {m.id}")
+        except Exception as e:
+            print(f"Error: {e}")
+    t0 = time.monotonic()
+    try:
+        client.chat.completions.create(messages=[{"role": "user", "content": "ping"}], model=ep.model,
+                                       max_tokens=1, timeout=llm_router.LLM_BUDGET_SEC)
+        print(f"✅ {ep.name}: {time.monotonic() - t0:.2f}秒")
+    except Exception as e:
+        kind, _ = llm_router.classify_error(e)
+        print(f"❌ {ep.name}: {kind} ({e})")
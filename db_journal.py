@@ -0,0 +1,228 @@
+import argparse
+import glob
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+# ==========================================
+# 🧾 race_data.db の差分保存 (ジャーナル)
+# ==========================================
+#   python db_journal.py flush                 # 未書き出しの変更を新しいセグメントにする
+#   python db_journal.py rebuild               # ベース + セグメントから DB を作り直す
+#   python db_journal.py snapshot              # 現在の DB を新しいベースにし、古いセグメントを消す
+#   python db_journal.py status
+#
+# 対象テーブルの INSERT/UPDATE/DELETE をトリガーで journal_log に記録し、flush のたびに
+# その分の行だけを gzip 圧縮の JSON Lines (セグメント) に書き出す。git に載せるのは
+# db_journal/ 以下だけなので、保存のコストはその回の変更量に比例する。
+#
+#   db_journal/base-<ns>.db.gz     ベース (DB 全体のコピー)
+#   db_journal/seg-<ns>.jsonl.gz   1行目: {"cols": {表: [列...]}, "schema": {表: CREATE文}}
+#                                  2行目以降: {"t": 表, "u": [行]} / {"t": 表, "d": [主キー]}
+
+# 対象テーブルと主キー
+TABLES = {
+    'history': ['race_id'],
+    'racer_stats': ['pid'],
+    'racer_settled': ['date', 'jcd', 'rno'],
+    'racer_pending': ['date', 'jcd', 'rno'],
+    'run_state': ['date', 'jcd', 'rno'],
+    'shadow_history': ['shadow', 'race_id'],
+}
+
+def journal_dir(db_path):
+    """セグメントの置き場所 (既定は DB と同じフォルダの db_journal/)"""
+    return os.environ.get("DB_JOURNAL_DIR") or os.path.join(os.path.dirname(os.path.abspath(db_path)), "db_journal")
+
+def _tables(conn):
+    return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+def _cols(conn, table):
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+# ------------------------------------------
+# 記録
+# ------------------------------------------
+def install(db_path):
+    """journal_log と各テーブルのトリガーを作る (既にあれば何もしない)"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    existing = _tables(conn)
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS journal_log (seq INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT, op TEXT, pk TEXT)")
+        for table, pk in TABLES.items():
+            if table not in existing: continue
+            for op, ev, ref in (("U", "INSERT", "NEW"), ("U", "UPDATE", "NEW"), ("D", "DELETE", "OLD")):
+                keys = ", ".join(f"{ref}.{c}" for c in pk)
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS journal_{table}_{ev.lower()} AFTER {ev} ON {table}
+                    BEGIN INSERT INTO journal_log (tbl, op, pk) VALUES ('{table}', '{op}', json_array({keys})); END
+                """)
+    conn.close()
+
+def _drop_triggers(conn):
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'journal_%'").fetchall():
+        conn.execute(f"DROP TRIGGER {name}")
+
+def flush(db_path, out_dir=None):
+    """journal_log の分をセグメントに書き出す。戻り値: (セグメントのパス or None, 行数)"""
+    out_dir = out_dir or journal_dir(db_path)
+    conn = sqlite3.connect(db_path, timeout=30)
+    if 'journal_log' not in _tables(conn):
+        conn.close()
+        return None, 0
+    log = conn.execute("SELECT seq, tbl, op, pk FROM journal_log ORDER BY seq").fetchall()
+    if not log:
+        conn.close()
+        return None, 0
+
+    # 同じ行の変更は最後の1回だけ書けばよい
+    last = {}
+    for seq, tbl, op, pk in log:
+        last.pop((tbl, pk), None)
+        last[(tbl, pk)] = op
+    cols = {t: _cols(conn, t) for t in {t for t, _ in last}}
+    schema = dict(conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type='table' AND name IN ({','.join('?' * len(cols))})", list(cols)))
+
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"seg-{time.time_ns()}.jsonl.gz")
+    n = 0
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+        f.write(json.dumps({'cols': cols, 'schema': schema}, ensure_ascii=False) + "\n")
+        for (tbl, pk), op in last.items():
+            keys = json.loads(pk)
+            if op == "U":
+                where = " AND ".join(f"{c}=?" for c in TABLES[tbl])
+                row = conn.execute(f"SELECT * FROM {tbl} WHERE {where}", keys).fetchone()
+                if row is None: op = "D" # その後消えている
+                else: f.write(json.dumps({'t': tbl, 'u': list(row)}, ensure_ascii=False) + "\n")
+            if op == "D":
+                f.write(json.dumps({'t': tbl, 'd': keys}, ensure_ascii=False) + "\n")
+            n += 1
+    os.replace(path + ".tmp", path)
+    # 書き出した分だけ消す (flush 中に増えた分は次回)
+    with conn:
+        conn.execute("DELETE FROM journal_log WHERE seq <= ?", (log[-1][0],))
+    conn.close()
+    return path, n
+
+# ------------------------------------------
+# 復元
+# ------------------------------------------
+def _stamp(path):
+    return int(os.path.basename(path).split("-")[1].split(".")[0])
+
+def _latest_base(src_dir):
+    bases = sorted(glob.glob(os.path.join(src_dir, "base-*.db.gz")), key=_stamp)
+    return bases[-1] if bases else None
+
+def _segments(src_dir, after=0):
+    return sorted((p for p in glob.glob(os.path.join(src_dir, "seg-*.jsonl.gz")) if _stamp(p) > after), key=_stamp)
+
+def has_journal(db_path):
+    d = journal_dir(db_path)
+    return bool(_latest_base(d) or _segments(d))
+
+def apply_segment(conn, path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        head = json.loads(f.readline())
+        existing = _tables(conn)
+        for table, sql in head['schema'].items():
+            if table not in existing:
+                conn.execute(sql)
+            else:
+                # ベースより後に列が増えている場合 (マイグレーション)
+                have = set(_cols(conn, table))
+                for c in head['cols'][table]:
+                    if c not in have: conn.execute(f"ALTER TABLE {table} ADD COLUMN {c}")
+        ins = {t: f"INSERT OR REPLACE INTO {t} ({', '.join(c)}) VALUES ({','.join('?' * len(c))})"
+               for t, c in head['cols'].items()}
+        n = 0
+        for line in f:
+            rec = json.loads(line)
+            t = rec['t']
+            if 'u' in rec:
+                conn.execute(ins[t], rec['u'])
+            else:
+                conn.execute(f"DELETE FROM {t} WHERE {' AND '.join(f'{c}=?' for c in TABLES[t])}", rec['d'])
+            n += 1
+    return n
+
+def rebuild(db_path, src_dir=None):
+    """最新のベースにその後のセグメントを順に当てて db_path を作り直す"""
+    src_dir = src_dir or journal_dir(db_path)
+    base = _latest_base(src_dir)
+    segs = _segments(src_dir, _stamp(base) if base else 0)
+    fd, tmp = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(os.path.abspath(db_path)))
+    os.close(fd)
+    if base:
+        with gzip.open(base, "rb") as src, open(tmp, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+    conn = sqlite3.connect(tmp)
+    n = 0
+    with conn:
+        _drop_triggers(conn)
+        for p in segs: n += apply_segment(conn, p)
+        if 'journal_log' in _tables(conn): conn.execute("DELETE FROM journal_log")
+    conn.close()
+    os.replace(tmp, db_path)
+    install(db_path)
+    print(f"✅ 再構築: {os.path.basename(base) if base else '(ベースなし)'} + {len(segs)}セグメント ({n:,}行) -> {db_path}")
+    return n
+
+def snapshot(db_path, out_dir=None):
+    """未書き出し分を flush してから DB 全体を新しいベースにし、それ以前のファイルを消す"""
+    out_dir = out_dir or journal_dir(db_path)
+    flush(db_path, out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = time.time_ns()
+    path = os.path.join(out_dir, f"base-{stamp}.db.gz")
+    src = sqlite3.connect(db_path, timeout=30)
+    fd, tmp = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    dst = sqlite3.connect(tmp)
+    src.backup(dst)
+    dst.close(); src.close()
+    with open(tmp, "rb") as f, gzip.open(path + ".tmp", "wb") as g:
+        shutil.copyfileobj(f, g)
+    os.remove(tmp)
+    os.replace(path + ".tmp", path)
+    old = [p for p in glob.glob(os.path.join(out_dir, "base-*.db.gz")) + glob.glob(os.path.join(out_dir, "seg-*.jsonl.gz"))
+           if _stamp(p) < stamp]
+    for p in old: os.remove(p)
+    print(f"📦 スナップショット: {path} ({os.path.getsize(path):,} bytes, 古いファイル {len(old)}個を削除)")
+    return path
+
+def main():
+    default_db = os.environ.get("RACE_DB") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "race_data.db")
+    ap = argparse.ArgumentParser(description="race_data.db の差分保存")
+    ap.add_argument("command", choices=["flush", "rebuild", "snapshot", "status"])
+    ap.add_argument("--db", default=default_db, help="対象の DB")
+    ap.add_argument("--dir", default=None, help="ジャーナルの置き場所 (省略時は DB と同じフォルダの db_journal/)")
+    args = ap.parse_args()
+
+    d = args.dir or journal_dir(args.db)
+    if args.command == "flush":
+        path, n = flush(args.db, d)
+        print(f"🧾 {n}行 -> {path}" if path else "🧾 変更なし")
+    elif args.command == "rebuild":
+        rebuild(args.db, d)
+    elif args.command == "snapshot":
+        snapshot(args.db, d)
+    else:
+        base = _latest_base(d)
+        segs = _segments(d, _stamp(base) if base else 0)
+        size = sum(os.path.getsize(p) for p in segs)
+        print(f"ベース: {base or 'なし'} / セグメント: {len(segs)}個 ({size:,} bytes)")
+        if os.path.exists(args.db):
+            conn = sqlite3.connect(args.db)
+            if 'journal_log' in _tables(conn):
+                print(f"未書き出しの変更: {conn.execute('SELECT COUNT(*) FROM journal_log').fetchone()[0]}件")
+            conn.close()
+
+if __name__ == "__main__":
+    main()
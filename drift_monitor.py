@@ -0,0 +1,165 @@
+import os
+import re
+import threading
+import collections
+import datetime
+
+import numpy as np
+
+import metrics
+import http_archive
+
+# ==========================================
+# 🩺 取得データの品質 / 特徴量ドリフトの監視
+# ==========================================
+# 1. スクレイピング: parse_race_data が正規表現に失敗して既定値 (st=0.20, ex=0.0 など) の
+#    ままにした項目を会場・項目別に数える。サイトのレイアウト変更で一斉に取れなくなるとここに出る。
+# 2. 特徴量: 推論に渡した各列を、モデルファイルの feature_infos に記録された学習時の範囲
+#    [min:max] を等分した固定ビンのヒストグラムにし、範囲外の割合を数える。
+#
+# どちらも直近 DRIFT_WINDOW レース分の割合がしきい値を超えたら drift_alert ゲージを 1 にして
+# 警告を出す (戻ったら 0)。1レースあたりの処理は数十個の値の集計だけ。
+#
+# メトリクス:
+#   scrape_races_total{jcd}                 解析したレース数
+#   scrape_defaulted_total{jcd,field}       既定値のままだった艇数
+#   scrape_default_rate{field}              直近の既定値率
+#   feature_value{model,feature[,jcd]}      特徴量のヒストグラム (学習時範囲の固定ビン)
+#   feature_out_of_range_total{model,feature,jcd}
+#   feature_out_of_range_rate{model,feature}
+#   drift_alert{kind,name} / drift_alerts_total{kind,name}
+
+DRIFT_MONITOR = os.environ.get("DRIFT_MONITOR", "1") != "0"
+DRIFT_WINDOW = int(os.environ.get("DRIFT_WINDOW", "24") or 24)  # 直近何レースで判定するか (1巡回で全会場分)
+DRIFT_BINS = 10
+SCRAPE_ALERT_RATE = float(os.environ.get("SCRAPE_ALERT_RATE", "0.5") or 0.5)
+DRIFT_ALERT_RATE = float(os.environ.get("DRIFT_ALERT_RATE", "0.2") or 0.2)
+EX_PUBLISH_MIN = 10 # 締切この分数前を過ぎても展示タイムが全艇無ければ取得失敗とみなす
+
+# アラートの対象 (f はフライング持ちの選手にしか表記が無いので数えるだけ)
+SCRAPE_FIELDS = ('pid', 'wr', 'mo', 'ex', 'st', 'deadline')
+JST = datetime.timezone(datetime.timedelta(hours=9), 'JST')
+
+_LOCK = threading.Lock()
+_WINDOWS = {}   # (kind, name) -> deque[(該当数, 全数)]
+_ALERTS = set() # 発報中の (kind, name)
+_RANGES = {}    # id(model) -> (model, {列名: (min, max)})
+
+def _window(kind, name, hit, total):
+    """直近の割合を更新して返す。しきい値をまたいだらアラートを切り替える"""
+    key = (kind, name)
+    with _LOCK:
+        w = _WINDOWS.get(key)
+        if w is None:
+            w = _WINDOWS[key] = collections.deque(maxlen=DRIFT_WINDOW)
+        w.append((hit, total))
+        n = sum(t for _, t in w)
+        rate = sum(h for h, _ in w) / n if n else 0.0
+        full = len(w) == w.maxlen
+        limit = SCRAPE_ALERT_RATE if kind == "scrape" else DRIFT_ALERT_RATE
+        changed = None
+        if full and rate > limit and key not in _ALERTS:
+            _ALERTS.add(key); changed = 1
+        elif rate <= limit and key in _ALERTS:
+            _ALERTS.discard(key); changed = 0
+    if changed is not None:
+        labels = {"kind": kind, "name": name}
+        metrics.set_gauge("drift_alert", changed, labels)
+        if changed:
+            metrics.inc("drift_alerts_total", labels)
+            print(f"🚨 [監視] {kind}/{name}: 直近{DRIFT_WINDOW}件の異常率 {rate:.0%} (しきい値 {limit:.0%})")
+        else:
+            print(f"✅ [監視] {kind}/{name}: 異常率 {rate:.0%} に回復")
+    return rate
+
+def alerts():
+    """発報中のアラート [(kind, name), ...]"""
+    with _LOCK:
+        return sorted(_ALERTS)
+
+# ------------------------------------------
+# 1. スクレイピングの既定値
+# ------------------------------------------
+def _minutes_to_deadline(date_str, deadline):
+    if not deadline: return None
+    # strptime はスレッド間でロックを取り合うので数値で組み立てる
+    h, m = deadline.split(":")
+    d = str(date_str)
+    at = datetime.datetime(int(d[:4]), int(d[4:6]), int(d[6:8]), int(h), int(m), tzinfo=JST)
+    return (at.timestamp() - http_archive.now()) / 60
+
+def record_parse(jcd, missing, date_str, deadline=None):
+    """parse_race_data 1回分を記録する。missing: {項目: 既定値のままだった艇数 (deadline は 0/1)}"""
+    if not DRIFT_MONITOR: return
+    metrics.inc("scrape_races_total", {"jcd": jcd})
+    for field, n in missing.items():
+        if n: metrics.inc("scrape_defaulted_total", {"jcd": jcd, "field": field}, n)
+    # 展示タイムは締切の少し前まで公開されないので、その前に全艇無いのは正常
+    left = _minutes_to_deadline(date_str, deadline)
+    ex_due = missing.get('ex', 0) < 6 or (left is not None and left <= EX_PUBLISH_MIN)
+    for field in SCRAPE_FIELDS:
+        if field == 'ex' and not ex_due: continue
+        total = 1 if field == 'deadline' else 6
+        rate = _window("scrape", field, missing.get(field, 0), total)
+        metrics.set_gauge("scrape_default_rate", round(rate, 4), {"field": field})
+
+# ------------------------------------------
+# 2. 特徴量の範囲 (モデルの feature_infos)
+# ------------------------------------------
+_RANGE_RE = re.compile(r"^\[(-?[\d.eE+-]+):(-?[\d.eE+-]+)\]$")
+
+def feature_ranges(model):
+    """モデルの学習時の数値列の範囲 {列名: (min, max)}。カテゴリ列・未使用列は含まない"""
+    hit = _RANGES.get(id(model))
+    if hit is not None and hit[0] is model: return hit[1]
+    booster = getattr(model, 'booster_', model)
+    ranges = {}
+    try:
+        # ヘッダ部分だけあればよいので木は1本分だけ書き出す
+        names, infos = None, None
+        for line in booster.model_to_string(num_iteration=1).splitlines():
+            if line.startswith("feature_names="): names = line.split("=", 1)[1].split(" ")
+            elif line.startswith("feature_infos="): infos = line.split("=", 1)[1].split(" ")
+            elif line.startswith("Tree="): break
+        for name, info in zip(names or [], infos or []):
+            m = _RANGE_RE.match(info)
+            if m: ranges[name] = (float(m.group(1)), float(m.group(2)))
+    except Exception as e:
+        print(f"⚠️ [監視] feature_infos を読めません: {e}")
+    _RANGES[id(model)] = (model, ranges)
+    return ranges
+
+def observe_features(kind, model, X, jcd=None):
+    """推論に渡した特徴量 X (DataFrame) を学習時の範囲と比べて記録する"""
+    if not DRIFT_MONITOR or not len(X): return
+    try:
+        _observe_features(kind, model, X, jcd)
+    except Exception as e:
+        # 監視の不具合で予測を止めない
+        metrics.inc("drift_monitor_errors_total")
+        print(f"⚠️ [監視] 特徴量の記録エラー: {e}")
+
+def _observe_features(kind, model, X, jcd):
+    ranges = feature_ranges(model)
+    names = [n for n in ranges if n in X.columns]
+    if not names: return
+    lo = np.array([ranges[n][0] for n in names])
+    hi = np.array([ranges[n][1] for n in names])
+    eps = np.maximum(hi - lo, 1.0) * 1e-6
+    M = X[names].to_numpy(dtype=float, na_value=np.nan)
+    valid = ~np.isnan(M)
+    # LightGBM は 0 を別扱いにして範囲に含めないので、0 は範囲内とみなす
+    out = (valid & (M != 0) & ((M < lo - eps) | (M > hi + eps))).sum(axis=0)
+    for k, name in enumerate(names):
+        v = M[valid[:, k], k]
+        if not len(v): continue
+        span = (hi[k] - lo[k]) or 1.0
+        edges = tuple(lo[k] + span * i / DRIFT_BINS for i in range(DRIFT_BINS + 1))
+        # 会場別モデルは範囲 (=ビン) がモデルごとに違うので会場でも分ける
+        labels = {"model": kind, "feature": name}
+        if jcd is not None: labels["jcd"] = jcd
+        metrics.observe_many("feature_value", v.tolist(), labels, buckets=edges)
+        if out[k]:
+            metrics.inc("feature_out_of_range_total", {"model": kind, "feature": name, "jcd": jcd if jcd is not None else "all"}, int(out[k]))
+        rate = _window(f"feature_{kind}", name, int(out[k]), len(v))
+        metrics.set_gauge("feature_out_of_range_rate", round(rate, 4), {"model": kind, "feature": name})
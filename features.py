@@ -0,0 +1,105 @@
+import numpy as np
+from race_card import RaceCard
+
+# ==========================================
+# 🧩 特徴量 (推論・学習で共通)
+# ==========================================
+# predict_race と train_models はどちらもここを通して特徴量を作る。
+# 列の追加・変更はここだけで行うこと (学習済みモデルとの整合が崩れるため)。
+
+# 特徴量リスト (学習時と合わせる)
+FEATURES = ['boat_no', 'pid', 'wind', 'wr', 'mo', 'ex', 'st', 'f', 'wr_z', 'mo_z', 'ex_z', 'st_z']
+# 全体モデル(2T)は jcd を含む特徴量で学習している
+FEATURES_2T = ['jcd'] + FEATURES
+Z_COLS = ['wr', 'mo', 'ex', 'st']
+# 選手別成績 (racer_stats) 由来の列。これを含めて学習したモデルのときだけ付ける
+RACER_FEATURES = ['rs_starts', 'rs_recent_top3', 'rs_course_win', 'rs_venue_win', 'rs_avg_st']
+# 取得失敗時の既定値 (scraper.parse_race_data と同じ)
+DEFAULTS = {'pid': 0, 'wr': 0.0, 'mo': 0.0, 'ex': 0.0, 'st': 0.20, 'f': 0}
+
+def to_float(val):
+    try:
+        if val is None or val == "": return 0.0
+        return float(val)
+    except: return 0.0
+
+def _to_int(val):
+    try: return int(val or 0)
+    except (TypeError, ValueError): return 0
+
+def boat_arrays(raws):
+    """raw 辞書 (または RaceCard) のリストから (レース数, 6) の配列群を作る"""
+    if raws and all(isinstance(r, RaceCard) for r in raws):
+        return RaceCard.stack(raws)
+    n = len(raws)
+    out = {c: np.empty((n, 6), dtype=np.float64) for c in ('wr', 'mo', 'ex', 'st', 'f')}
+    out['pid'] = np.empty((n, 6), dtype=np.int64)
+    out['jcd'] = np.empty(n, dtype=np.int64)
+    out['wind'] = np.empty(n, dtype=np.float64)
+    for r, raw in enumerate(raws):
+        out['jcd'][r] = int(raw.get('jcd', 0))
+        out['wind'][r] = to_float(raw.get('wind', 0.0))
+        for i in range(6):
+            s = i + 1
+            out['pid'][r, i] = _to_int(raw.get(f'pid{s}', 0))
+            out['wr'][r, i] = to_float(raw.get(f'wr{s}', 0))
+            out['mo'][r, i] = to_float(raw.get(f'mo{s}', 0))
+            out['ex'][r, i] = to_float(raw.get(f'ex{s}', 0))
+            st = raw.get(f'st{s}')
+            out['st'][r, i] = DEFAULTS['st'] if st is None or st == "" else to_float(st)
+            out['f'][r, i] = to_float(raw.get(f'f{s}', 0))
+    return out
+
+def build_feature_frame(raws, with_jcd_category=False):
+    """複数レースの特徴量を1つの DataFrame (6行/レース) にまとめる。
+    戻り値: (df, valid) — valid は展示タイムが取れていたレースの真偽配列。df は valid なレースのみ"""
+    return frame_from_arrays(boat_arrays(raws), with_jcd_category)
+
+def frame_from_arrays(a, with_jcd_category=False):
+    """boat_arrays と同じ形の配列群から build_feature_frame と同じ (df, valid) を作る"""
+    import pandas as pd # 結果確定だけのプロセス (racer_stats 経由) では読み込まない
+    valid = a['ex'].sum(axis=1) != 0
+    n = int(valid.sum())
+    cols = {
+        'jcd': np.repeat(a['jcd'][valid], 6),
+        'wind': np.repeat(a['wind'][valid], 6),
+        'boat_no': np.tile(np.arange(1, 7, dtype=np.int64), n),
+    }
+    for c in ('pid', 'wr', 'mo', 'ex', 'st', 'f'):
+        cols[c] = a[c][valid].reshape(-1)
+    # Zスコア計算 (レース内, 不偏標準偏差)
+    for c in Z_COLS:
+        x = a[c][valid]
+        m = x.mean(axis=1, keepdims=True)
+        s = x.std(axis=1, ddof=1, keepdims=True) if n else x[:, :1]
+        s = np.where(s != 0, s, 1e-6)
+        cols[f'{c}_z'] = ((x - m) / s).reshape(-1)
+
+    df = pd.DataFrame(cols)
+    df['pid'] = df['pid'].astype('category')
+    if with_jcd_category:
+        df['jcd'] = df['jcd'].astype('category')
+    return df, valid
+
+def build_race_frame(raw):
+    """raw 辞書から6艇分の特徴量 DataFrame を作る (展示タイムが全て0なら None)"""
+    df, valid = build_feature_frame([raw])
+    return df if valid[0] else None
+
+def add_racer_features(df, block):
+    """df (6行/レース) に選手別成績の列を足す。block: (行数, len(RACER_FEATURES))"""
+    for k, c in enumerate(RACER_FEATURES):
+        df[c] = block[:, k]
+    return df
+
+def finish_labels(combo_3t, n_class):
+    """3連単の確定組番から艇ごとのラベル (0=1着, 1=2着, ..., n_class-1=それ以外) を作る"""
+    labels = np.full(6, n_class - 1, dtype=np.int64)
+    if not combo_3t: return None
+    try:
+        order = [int(x) for x in combo_3t.split('-')]
+    except ValueError:
+        return None
+    for place, boat in enumerate(order[:n_class - 1]):
+        if 1 <= boat <= 6: labels[boat - 1] = place
+    return labels
@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import time
+import argparse
+from itertools import permutations, combinations
+
+import numpy as np
+
+# ==========================================
+# 🎲 組み合わせ確率エンジン (2連単 / 3連単 / 2連複 / 3連複)
+# ==========================================
+# モデルはレース×艇ごとに着順クラスの確率 p[:, :, 0]=1着, 1=2着, 2=3着 ... を出す。
+# そこから全順列の確率を、複数レースまとめて添字配列の演算だけで作る。
+#
+#   product   p1[i]・p2[j]・p3[k] をそのまま掛ける (従来の値。合計は1にならない)
+#   harville  1着確率だけを強さとして、既に決まった艇を除いて条件付きで掛ける
+#   pl        着順ごとの強さ (p1, p2, p3) で条件付きに掛ける (Plackett-Luce)
+#             P(i,j,k) = s1[i] ・ s2[j] / (1 - s2[i]) ・ s3[k] / (1 - s3[i] - s3[j])   (s は行ごとに合計1)
+# harville / pl は全順列の合計が1になり、2連単は3連単の周辺和と一致する。
+# 2連複 / 3連複 は着順を問わないので、同じ艇の組の順列を足し合わせる (unordered)。
+#
+# 補正 (任意): 着順ごとの強さを s = p ** a で均す (a<1 で下位の着順の確信を弱める)。
+#   prob_calibration.json = {"3t": [a1, a2, a3], "2t": [a1, a2]}   (fit で作る)
+#
+# 既定は product。EV 閾値 (predict_boat の STRATEGY_*) は従来の値で調整されているので、
+# 切り替えるときは PROB_ENGINE=pl python backtest.py --store ... で閾値を取り直すこと。
+#
+#   python harville.py check [--races 20000]           # ループ版との一致・合計・速度の確認
+#   python harville.py fit --store race_store.db --from 20250101 --to 20251231
+
+ENGINES = ("product", "harville", "pl")
+ENGINE = os.environ.get("PROB_ENGINE", "product")
+CALIB_FILE = os.environ.get("PROB_CALIB", "prob_calibration.json")
+EPS = 1e-12
+
+PERMS_3T = list(permutations(range(6), 3))
+PERMS_2T = list(permutations(range(6), 2))
+_IDX_3T = np.array(PERMS_3T).T
+_IDX_2T = np.array(PERMS_2T).T
+COMBS_3F = list(combinations(range(6), 3))
+COMBS_2F = list(combinations(range(6), 2))
+
+def _fold_matrix(perms, combs):
+    """順列 -> 組 の 0/1 行列 (確率 @ 行列 で組ごとの和になる)"""
+    pos = {c: k for k, c in enumerate(combs)}
+    m = np.zeros((len(perms), len(combs)))
+    for i, perm in enumerate(perms): m[i, pos[tuple(sorted(perm))]] = 1.0
+    return m
+
+_FOLD_3F = _fold_matrix(PERMS_3T, COMBS_3F)
+_FOLD_2F = _fold_matrix(PERMS_2T, COMBS_2F)
+
+def load_calibration(path=None):
+    """{'3t': (a1, a2, a3), '2t': (a1, a2)}。ファイルが無ければ空"""
+    path = path or CALIB_FILE
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            d = json.load(f)
+        return {k: tuple(float(x) for x in d[k]) for k in ("3t", "2t") if k in d}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+CALIBRATION = load_calibration()
+
+def _strengths(p, n_pos, engine, alphas):
+    """(R, 6, K) -> 着順ごとの強さ [(R, 6), ...] (行ごとに合計1)"""
+    cols = [p[:, :, 0]] * n_pos if engine == "harville" else [p[:, :, t] for t in range(n_pos)]
+    out = []
+    for t, s in enumerate(cols):
+        s = np.clip(s, EPS, None)
+        if alphas and alphas[t] != 1.0: s = s ** alphas[t]
+        out.append(s / s.sum(axis=1, keepdims=True))
+    return out
+
+def _conditional(strengths, idx):
+    """Plackett-Luce: 前の着順で決まった艇を除いた残りの強さで割りながら掛ける"""
+    prob = None
+    for t, s in enumerate(strengths):
+        num = s[:, idx[t]]
+        den = 1.0 - sum(s[:, idx[u]] for u in range(t)) if t else 1.0
+        term = num / np.maximum(den, EPS)
+        prob = term if prob is None else prob * term
+    return prob
+
+def combo_probs(p, n_pos, engine=None, alphas=None):
+    """p: (R, 6, K) 着順クラス確率 -> (R, 120) (n_pos=3) / (R, 30) (n_pos=2)。並びは PERMS_*"""
+    engine = engine or ENGINE
+    if engine not in ENGINES: raise ValueError(f"未知のエンジン: {engine}")
+    idx = _IDX_3T if n_pos == 3 else _IDX_2T
+    if engine == "product":
+        prob = p[:, idx[0], 0]
+        for t in range(1, n_pos): prob = prob * p[:, idx[t], t]
+        return prob
+    return _conditional(_strengths(p, n_pos, engine, alphas), idx)
+
+def probs_3t(p, engine=None, alphas=None):
+    return combo_probs(p, 3, engine, alphas if alphas is not None else CALIBRATION.get("3t"))
+
+def probs_2t(p, engine=None, alphas=None):
+    return combo_probs(p, 2, engine, alphas if alphas is not None else CALIBRATION.get("2t"))
+
+def unordered(probs, n_pos):
+    """順列の確率 (..., 120) / (..., 30) -> 組の確率 (..., 20) / (..., 15)。並びは COMBS_*"""
+    return probs @ (_FOLD_3F if n_pos == 3 else _FOLD_2F)
+
+# ------------------------------------------
+# 一致確認 (ループで書いた定義どおりの計算と比べる)
+# ------------------------------------------
+def reference(p, n_pos, engine, alphas=None):
+    """1レースずつ・1順列ずつ定義どおりに計算する (確認用・遅い)"""
+    perms = PERMS_3T if n_pos == 3 else PERMS_2T
+    out = np.zeros((len(p), len(perms)))
+    for r in range(len(p)):
+        if engine == "product":
+            for c, perm in enumerate(perms):
+                v = 1.0
+                for t, b in enumerate(perm): v *= p[r, b, t]
+                out[r, c] = v
+            continue
+        s = []
+        for t in range(n_pos):
+            col = [max(p[r, b, 0 if engine == "harville" else t], EPS) for b in range(6)]
+            if alphas: col = [x ** alphas[t] for x in col]
+            tot = sum(col)
+            s.append([x / tot for x in col])
+        for c, perm in enumerate(perms):
+            v = 1.0
+            for t, b in enumerate(perm):
+                v *= s[t][b] / max(1.0 - sum(s[t][perm[u]] for u in range(t)), EPS)
+            out[r, c] = v
+    return out
+
+def random_class_probs(n, k=6, seed=0):
+    """合成の着順クラス確率 (艇ごとに K クラスの softmax)"""
+    rng = np.random.default_rng(seed)
+    z = rng.normal(0, 1.5, (n, 6, k))
+    e = np.exp(z)
+    return e / e.sum(axis=2, keepdims=True)
+
+def check(n_races=20000, n_ref=200, out=sys.stdout):
+    """ベクトル版とループ版の一致、合計=1、2連単=3連単の周辺和、速度を確認する。問題があれば False"""
+    p = random_class_probs(n_races)
+    ok = True
+    for engine in ENGINES:
+        for alphas3 in (None, (1.0, 0.85, 0.7)):
+            if engine == "product" and alphas3: continue
+            alphas2 = alphas3[:2] if alphas3 else None
+            v3, v2 = combo_probs(p, 3, engine, alphas3), combo_probs(p, 2, engine, alphas2)
+            d3 = np.abs(v3[:n_ref] - reference(p[:n_ref], 3, engine, alphas3)).max()
+            d2 = np.abs(v2[:n_ref] - reference(p[:n_ref], 2, engine, alphas2)).max()
+            line = f"{engine:<9} a={alphas3 or '-'!s:<16} max|diff| 3T={d3:.1e} 2T={d2:.1e}"
+            good = d3 < 1e-12 and d2 < 1e-12
+            if engine != "product":
+                s3, s2 = np.abs(v3.sum(axis=1) - 1).max(), np.abs(v2.sum(axis=1) - 1).max()
+                marg = np.abs(v3.reshape(-1, 30, 4).sum(axis=2) - v2).max()
+                line += f" |Σ-1| 3T={s3:.1e} 2T={s2:.1e} 周辺和={marg:.1e}"
+                good = good and s3 < 1e-9 and s2 < 1e-9 and marg < 1e-9
+            print(("✅ " if good else "❌ ") + line, file=out)
+            ok = ok and good
+    # 組 (2連複 / 3連複) の和をループで取り直して比べる
+    for n_pos, perms, combs in ((3, PERMS_3T, COMBS_3F), (2, PERMS_2T, COMBS_2F)):
+        v = combo_probs(p[:n_ref], n_pos, "pl")
+        ref = np.zeros((len(v), len(combs)))
+        for c, comb in enumerate(combs):
+            for k, perm in enumerate(perms):
+                if tuple(sorted(perm)) == comb: ref[:, c] += v[:, k]
+        d = np.abs(unordered(v, n_pos) - ref).max()
+        good = d < 1e-12
+        print(("✅ " if good else "❌ ") + f"{n_pos}連複 組への集約 max|diff|={d:.1e}", file=out)
+        ok = ok and good
+    for engine in ENGINES:
+        t0 = time.perf_counter()
+        combo_probs(p, 3, engine); combo_probs(p, 2, engine)
+        dt = time.perf_counter() - t0
+        print(f"⏱️ {engine:<9} {n_races:,}レース {dt * 1000:.1f}ms ({dt / n_races * 1e6:.2f}µs/レース)", file=out)
+    return ok
+
+# ------------------------------------------
+# 補正係数の推定
+# ------------------------------------------
+GRID_A1 = [0.8, 0.9, 1.0, 1.1, 1.2]
+GRID_AN = [0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.1]
+
+def class_probs_from_store(store_path=None, date_from=None, date_to=None, batch=2000):
+    """race_store の結果付きレースに現行モデルを当て、着順クラス確率と的中組み合わせを集める"""
+    import race_store
+    import racer_stats
+    import predict_boat
+    from features import boat_arrays
+    predict_boat.load_models()
+    models = predict_boat.current_models()[:2]
+    idx3 = {c: i for i, c in enumerate(predict_boat.COMBOS_3T)}
+    idx2 = {c: i for i, c in enumerate(predict_boat.COMBOS_2T)}
+    store = racer_stats.get_store()
+    acc = {"p3": [], "r3": [], "p2": [], "r2": []}
+    conn = race_store.connect(store_path)
+    raws, results = [], []
+    def run():
+        rs = np.stack([store.feature_block(r) for r in raws])
+        cp3, cp2 = predict_boat.class_probs(predict_boat.build_frame(boat_arrays(raws), rs), models, monitor=False)
+        for k, res in enumerate(results):
+            r3, r2 = idx3.get(res.get('combo_3t'), -1), idx2.get(res.get('combo_2t'), -1)
+            if cp3[k] is not None and r3 >= 0: acc["p3"].append(cp3[k]); acc["r3"].append(r3)
+            if cp2[k] is not None and r2 >= 0: acc["p2"].append(cp2[k]); acc["r2"].append(r2)
+        raws.clear(); results.clear()
+    for rec in race_store.iter_races(conn, date_from, date_to):
+        if not rec.get('result'): continue
+        raws.append(rec['raw']); results.append(rec['result'])
+        if len(raws) >= batch: run()
+    if raws: run()
+    conn.close()
+    return {k: np.asarray(v) for k, v in acc.items()}
+
+def fit(p, result, n_pos, engine="pl"):
+    """的中組み合わせの対数損失が最小になる (a1, a2[, a3]) をグリッドで探す: (係数, 損失, 補正なしの損失)"""
+    rows = np.arange(len(result))
+    def loss(alphas):
+        return float(-np.log(np.clip(combo_probs(p, n_pos, engine, alphas)[rows, result], EPS, None)).mean())
+    base = loss(None)
+    best, best_loss = (1.0,) * n_pos, base
+    grids = [GRID_A1] + [GRID_AN] * (n_pos - 1)
+    for alphas in np.array(np.meshgrid(*grids)).T.reshape(-1, n_pos):
+        l = loss(tuple(alphas))
+        if l < best_loss: best, best_loss = tuple(float(a) for a in alphas), l
+    return best, best_loss, base
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="組み合わせ確率エンジンの確認・補正")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("check", help="ループ版との一致と速度の確認")
+    c.add_argument("--races", type=int, default=20000)
+    f = sub.add_parser("fit", help="race_store の結果から補正係数を推定する")
+    f.add_argument("--store", default=None, help="取り込み済みデータ (省略時は race_store の既定)")
+    f.add_argument("--from", dest="date_from", default=None, help="開始日 YYYYMMDD")
+    f.add_argument("--to", dest="date_to", default=None, help="終了日 YYYYMMDD")
+    f.add_argument("--engine", default="pl", choices=["harville", "pl"])
+    f.add_argument("--out", default=CALIB_FILE)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "check":
+        sys.exit(0 if check(args.races) else 1)
+
+    data = class_probs_from_store(args.store, args.date_from, args.date_to)
+    calib = {}
+    for key, n_pos in (("3t", 3), ("2t", 2)):
+        p, r = data["p" + key[0]], data["r" + key[0]]
+        if not len(r):
+            print(f"⚠️ {key.upper()}: 結果付きのレースがありません")
+            continue
+        alphas, l, base = fit(p, r, n_pos, args.engine)
+        calib[key] = list(alphas)
+        print(f"📐 {key.upper()} ({len(r):,}レース): a={alphas} 対数損失 {base:.4f} -> {l:.4f}")
+    if calib:
+        with open(args.out, "w", encoding="utf-8") as fp:
+            json.dump(calib, fp, indent=2)
+        print(f"💾 {args.out} に保存しました (PROB_ENGINE={args.engine} で使われます)")
+
+if __name__ == "__main__":
+    main()
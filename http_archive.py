@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import zlib
+import base64
+import bisect
+import threading
+
+# ==========================================
+# 🎞️ HTTPアーカイブ (記録 & リプレイ)
+# ==========================================
+# HTTP_ARCHIVE_MODE=record : get_soup の全レスポンスを HTTP_ARCHIVE に追記する
+# HTTP_ARCHIVE_MODE=replay : HTTP_ARCHIVE からレスポンスを返し、時計もシミュレーションする
+#                            Bot の DB は RACE_DB 未指定なら <アーカイブ名>.replay.db (本番の DB は使わない)
+#
+# アーカイブは1行1レスポンスの JSON Lines。本文は zlib 圧縮 + base64。
+#   {"url": ..., "ts": 1700000000.123, "status": 200, "body": "eJz..."}
+
+MODE = os.environ.get("HTTP_ARCHIVE_MODE", "").lower()   # "", "record", "replay"
+ARCHIVE_FILE = os.environ.get("HTTP_ARCHIVE", "http_archive.jsonl")
+REPLAY_SPEED = float(os.environ.get("HTTP_REPLAY_SPEED", "60") or 60)  # 実時間の何倍で進めるか
+REPLAY_START = os.environ.get("HTTP_REPLAY_START", "")  # 開始時刻 (epoch秒)。空ならアーカイブ先頭
+
+def is_recording():
+    return MODE == "record"
+
+def is_replaying():
+    return MODE == "replay"
+
+# ------------------------------------------
+# 記録
+# ------------------------------------------
+_REC_LOCK = threading.Lock()
+_REC_FP = None
+
+def record(url, status_code, content, ts=None):
+    """1レスポンスをアーカイブに追記する"""
+    global _REC_FP
+    entry = {
+        "url": url,
+        "ts": round(time.time() if ts is None else ts, 3),
+        "status": int(status_code),
+        "body": base64.b64encode(zlib.compress(content or b"", 6)).decode("ascii"),
+    }
+    line = json.dumps(entry, ensure_ascii=False) + "\n"
+    with _REC_LOCK:
+        if _REC_FP is None:
+            _REC_FP = open(ARCHIVE_FILE, "a", encoding="utf-8")
+        _REC_FP.write(line)
+        _REC_FP.flush()
+
+# ------------------------------------------
+# リプレイ
+# ------------------------------------------
+class ReplayResponse:
+    """curl_cffi のレスポンスのうち get_soup が使う属性だけを持つ"""
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+class Archive:
+    def __init__(self, path):
+        self.entries = {}  # url -> ([ts...], [(status, body_b64)...])
+        self.first_ts = None
+        self.last_ts = None
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line: continue
+                try: e = json.loads(line)
+                except ValueError: continue
+                ts_list, payloads = self.entries.setdefault(e["url"], ([], []))
+                idx = bisect.bisect_right(ts_list, e["ts"])
+                ts_list.insert(idx, e["ts"])
+                payloads.insert(idx, (e["status"], e["body"]))
+                self.first_ts = e["ts"] if self.first_ts is None else min(self.first_ts, e["ts"])
+                self.last_ts = e["ts"] if self.last_ts is None else max(self.last_ts, e["ts"])
+
+    def lookup(self, url, at_ts):
+        """at_ts 時点で最後に記録されていたレスポンスを返す。
+        その時点でまだ記録が無ければ None (先の時刻のページ = 未来の結果やオッズは返さない)"""
+        hit = self.entries.get(url)
+        if not hit: return None
+        ts_list, payloads = hit
+        idx = bisect.bisect_right(ts_list, at_ts) - 1
+        if idx < 0: return None
+        status, body = payloads[idx]
+        return ReplayResponse(status, zlib.decompress(base64.b64decode(body)))
+
+_ARCHIVE = None
+_ARCHIVE_LOCK = threading.Lock()
+
+def get_archive():
+    global _ARCHIVE
+    with _ARCHIVE_LOCK:
+        if _ARCHIVE is None:
+            _ARCHIVE = Archive(ARCHIVE_FILE)
+            CLOCK.start(float(REPLAY_START) if REPLAY_START else (_ARCHIVE.first_ts or time.time()))
+    return _ARCHIVE
+
+class ReplaySession:
+    """get_session() の代わりに返すセッション。HTTP には一切アクセスしない"""
+    def get(self, url, headers=None, timeout=None):
+        res = get_archive().lookup(url, now())
+        if res is None:
+            return ReplayResponse(404, b"")
+        return res
+
+    def close(self):
+        pass
+
+# ------------------------------------------
+# 時計 (リプレイ中はシミュレーション時刻)
+# ------------------------------------------
+class SimClock:
+    def __init__(self):
+        self.base_ts = None
+        self.real_start = None
+        self.speed = REPLAY_SPEED
+
+    def start(self, base_ts):
+        if self.base_ts is None:
+            self.base_ts = base_ts
+            self.real_start = time.monotonic()
+
+    def now(self):
+        if self.base_ts is None: return time.time()
+        return self.base_ts + (time.monotonic() - self.real_start) * self.speed
+
+    def sleep(self, sec, event=None):
+        if event is not None: return event.wait(max(sec, 0) / self.speed)
+        time.sleep(max(sec, 0) / self.speed)
+
+CLOCK = SimClock()
+
+def now():
+    """現在時刻 (epoch秒)。リプレイ中はアーカイブの時刻を基準に加速して進む"""
+    if is_replaying():
+        get_archive()
+        return CLOCK.now()
+    return time.time()
+
+def sleep(sec, event=None):
+    """event を渡すと、それがセットされた時点で待ちを打ち切る (戻り値は event の状態)"""
+    if is_replaying():
+        return CLOCK.sleep(sec, event)
+    if event is not None: return event.wait(sec)
+    time.sleep(sec)
+
+def replay_finished():
+    """シミュレーション時刻がアーカイブ末尾を過ぎたら True"""
+    if not is_replaying(): return False
+    arc = get_archive()
+    return arc.last_ts is not None and CLOCK.now() > arc.last_ts
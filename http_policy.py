@@ -0,0 +1,268 @@
+import os
+import time
+import random
+import threading
+import collections
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import metrics
+import http_archive
+
+# ==========================================
+# 🚦 HTTP 取得ポリシー (ホスト単位)
+# ==========================================
+# get_soup の1回の GET を次の4つで包む。
+#   1. 並列数 (AIMD): 速く成功している間は少しずつ増やし、遅延・エラーが出たら割合で減らす
+#   2. 再試行: タイムアウト・5xx・極端に小さい応答のみ。ゆらぎ付き指数バックオフで、
+#      レースの締切 (deadline コンテキスト) に間に合わない再試行はしない
+#   3. サーキットブレーカー: エラー率が高い間は遮断し、締切間近 (URGENT_SEC 以内) の取得だけ通す。
+#      冷却時間の後に1件だけ試して、成功すれば復帰する
+#   4. 優先レーン: critical (締切 CRITICAL_SEC 以内) > normal (予測の入力) > background (結果確定など)。
+#      枠待ちはレーンごとに上限付きで数え、上位のレーンが待っている間は下位は枠を取らない。
+#      normal は critical 用に CRITICAL_RESERVE 枠を残し、background は枠の BACKGROUND_SHARE までしか使わない。
+#      critical が待っている間、background は再試行せずに諦める
+#
+#   with http_policy.deadline(ts):   # このスレッドでの取得は ts (epoch秒) までに終えたい
+#       soup, status = get_soup(sess, url)
+#   with http_policy.lane(http_policy.BACKGROUND):   # 締切に関係なく後回しでよい取得
+#       ...
+
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "15") or 15)            # 1回あたりの上限 (秒)
+MIN_CONCURRENCY = 2
+MAX_CONCURRENCY = int(os.environ.get("HTTP_MAX_CONCURRENCY", "16") or 16)
+START_CONCURRENCY = int(os.environ.get("HTTP_START_CONCURRENCY", "8") or 8)
+SLOW_SEC = float(os.environ.get("HTTP_SLOW_SEC", "3.0") or 3.0)            # これより遅い応答は混雑とみなす
+DECREASE = 0.7      # 混雑時に並列数に掛ける係数
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+RETRY_BUDGET = 20.0 # 締切が分からない取得で再試行に使ってよい秒数
+URGENT_SEC = 900    # 締切までこれ以内なら遮断中でも取得する (= 予測対象の時間帯)
+
+BREAKER_WINDOW = 50       # 直近この回数の試行でエラー率を見る
+BREAKER_ERROR_RATE = 0.6  # エラー率がこれを超えたら遮断 (再試行で取り返せる程度の失敗では遮断しない)
+BREAKER_MIN_SAMPLES = 20
+BREAKER_COOLDOWN = 10.0   # 遮断してから試行を再開するまで (失敗するたびに倍, 最大 BREAKER_COOLDOWN_MAX)
+BREAKER_COOLDOWN_MAX = 120.0
+
+CRITICAL, NORMAL, BACKGROUND = "critical", "normal", "background"
+LANES = (CRITICAL, NORMAL, BACKGROUND) # 優先度の高い順
+CRITICAL_SEC = float(os.environ.get("HTTP_CRITICAL_SEC", "120") or 120) # 締切までこれ以内の取得は critical
+LANE_QUEUE = {CRITICAL: 64, NORMAL: 64, BACKGROUND: 8} # レーンごとの枠待ちの上限 (超えたら待たずに諦める)
+CRITICAL_RESERVE = 1    # normal / background が使わずに残しておく枠
+BACKGROUND_SHARE = 0.5  # background が使ってよい枠の割合
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+PROBE = "probe" # admit の戻り値: 復帰確認の1件として通した (終わったら end_probe)
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# 再試行してよい失敗 (NO_RACE / 404 は正常な応答)
+def _retryable(status):
+    return status in ("HTTP_ERROR", "SMALL_CONTENT") or status.startswith("EXCEPTION")
+
+class HostPolicy:
+    def __init__(self, host):
+        self.host = host
+        self.cond = threading.Condition()
+        self.limit = float(min(START_CONCURRENCY, MAX_CONCURRENCY))
+        self.inflight = 0
+        self.waiting = dict.fromkeys(LANES, 0)
+        self.outcomes = collections.deque(maxlen=BREAKER_WINDOW) # 1=失敗
+        self.last_decrease = 0.0
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.cooldown = BREAKER_COOLDOWN
+        self.probing = False
+        self._publish()
+
+    def _publish(self):
+        labels = {"host": self.host}
+        metrics.set_gauge("http_concurrency_limit", round(self.limit, 2), labels)
+        metrics.set_gauge("http_inflight", self.inflight, labels)
+        metrics.set_gauge("http_circuit_state", _STATE_VALUE[self.state], labels)
+
+    def admit(self, urgent):
+        """遮断中なら False (締切間近と、復帰確認の1件は通す。復帰確認なら PROBE)"""
+        with self.cond:
+            if self.state == OPEN and time.monotonic() >= self.open_until:
+                self.state, self.probing = HALF_OPEN, False
+                self._publish()
+            if self.state == CLOSED or urgent: return True
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return PROBE
+            return False
+
+    def end_probe(self):
+        """復帰確認の取得が release まで行かずに終わった (枠が取れなかった等) ら次の1件に譲る"""
+        with self.cond:
+            if self.state == HALF_OPEN: self.probing = False
+
+    def _lane_cap(self, lane):
+        cap = int(self.limit) if self.state == CLOSED else MIN_CONCURRENCY
+        if lane == CRITICAL: return cap
+        if lane == NORMAL: return max(1, cap - CRITICAL_RESERVE)
+        return max(1, min(cap - CRITICAL_RESERVE, int(cap * BACKGROUND_SHARE)))
+
+    def acquire(self, timeout, lane=NORMAL):
+        """並列数の枠が空くまで待つ。遮断中・復帰確認中は最小の並列数に絞る。
+        上位のレーンが待っている間は入らない。レーンの枠待ちが一杯なら待たずに False"""
+        end = time.monotonic() + timeout
+        higher = LANES[:LANES.index(lane)]
+        with self.cond:
+            if self.waiting[lane] >= LANE_QUEUE[lane]: return False
+            self.waiting[lane] += 1
+            t0 = time.monotonic()
+            try:
+                while True:
+                    if self.inflight < self._lane_cap(lane) and not any(self.waiting[h] for h in higher): break
+                    left = end - time.monotonic()
+                    if left <= 0:
+                        self.cond.notify_all() # 待ちが減ったので下位のレーンを起こす
+                        return False
+                    self.cond.wait(left)
+            finally:
+                self.waiting[lane] -= 1
+            self.inflight += 1
+            metrics.set_gauge("http_inflight", self.inflight, {"host": self.host})
+            if any(self.waiting.values()): self.cond.notify_all() # 上位の待ちが減ったので下位を起こす
+        metrics.observe("http_queue_wait_seconds", time.monotonic() - t0, {"lane": lane})
+        return True
+
+    def contended(self):
+        """critical の取得が枠待ちしているか"""
+        with self.cond:
+            return self.waiting[CRITICAL] > 0
+
+    def release(self, ok, latency):
+        with self.cond:
+            now = time.monotonic()
+            self.inflight -= 1
+            self.outcomes.append(0 if ok else 1)
+            if ok and latency <= SLOW_SEC:
+                self.limit = min(MAX_CONCURRENCY, self.limit + 1.0 / self.limit) # 枠1周で約+1
+            elif now - self.last_decrease >= 1.0:
+                # 同時に返ってきた失敗で何段も下げないよう1秒に1回まで
+                self.limit = max(MIN_CONCURRENCY, self.limit * DECREASE)
+                self.last_decrease = now
+
+            if self.state == HALF_OPEN:
+                if ok: self._close()
+                else: self._open(now, self.cooldown * 2)
+            elif self.state == CLOSED and len(self.outcomes) >= BREAKER_MIN_SAMPLES and self.err_rate() > BREAKER_ERROR_RATE:
+                self._open(now, BREAKER_COOLDOWN)
+            self._publish()
+            self.cond.notify_all()
+
+    def err_rate(self):
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def _open(self, now, cooldown):
+        self.cooldown = min(cooldown, BREAKER_COOLDOWN_MAX)
+        self.state, self.open_until = OPEN, now + self.cooldown
+        metrics.inc("http_circuit_open_total", {"host": self.host})
+        print(f"🚧 [{self.host}] エラー率 {self.err_rate():.0%} のため {self.cooldown:g}秒間 締切間近以外の取得を止めます")
+
+    def _close(self):
+        self.state, self.cooldown = CLOSED, BREAKER_COOLDOWN
+        self.outcomes.clear()
+        print(f"✅ [{self.host}] 取得を再開します")
+
+_POLICIES = {}
+_POLICIES_LOCK = threading.Lock()
+
+def policy_for(url):
+    host = urlsplit(url).netloc
+    with _POLICIES_LOCK:
+        p = _POLICIES.get(host)
+        if p is None:
+            p = _POLICIES[host] = HostPolicy(host)
+        return p
+
+# ------------------------------------------
+# 締切・レーン (スレッドごと)
+# ------------------------------------------
+_TLS = threading.local()
+
+@contextmanager
+def deadline(ts):
+    """このブロック内の取得は ts (epoch秒, None なら不明) までに終える"""
+    prev = getattr(_TLS, "deadline", None)
+    _TLS.deadline = ts
+    try:
+        yield
+    finally:
+        _TLS.deadline = prev
+
+@contextmanager
+def lane(name):
+    """このブロック内の取得のレーンを締切に関係なく固定する (結果確定・影モデルなどは BACKGROUND)"""
+    prev = getattr(_TLS, "lane", None)
+    _TLS.lane = name
+    try:
+        yield
+    finally:
+        _TLS.lane = prev
+
+def current_deadline():
+    """このスレッドの締切 (epoch秒, 不明なら None)"""
+    return getattr(_TLS, "deadline", None)
+
+def set_lane(name):
+    """専用スレッド用: このスレッドの以降の取得のレーンを固定する (None で締切から決める)"""
+    _TLS.lane = name
+
+def current_lane(due=None, now=None):
+    """指定が無ければ締切で決める: CRITICAL_SEC 以内なら critical、それ以外は normal"""
+    name = getattr(_TLS, "lane", None)
+    if name: return name
+    if due is not None and due - (now if now is not None else http_archive.now()) <= CRITICAL_SEC: return CRITICAL
+    return NORMAL
+
+def fetch(session, url, fetch_fn):
+    """fetch_fn(session, url, timeout) -> (本文 or None, ステータス) をポリシー付きで呼ぶ"""
+    pol = policy_for(url)
+    due = getattr(_TLS, "deadline", None)
+    now = http_archive.now()
+    urgent = due is not None and due - now <= URGENT_SEC
+    budget_end = due if due is not None else now + RETRY_BUDGET
+    lane_name = current_lane(due, now)
+    labels = {"host": pol.host}
+    admitted = pol.admit(urgent)
+    if not admitted:
+        metrics.inc("http_shed_total", dict(labels, lane=lane_name, reason="circuit_open"))
+        return None, "CIRCUIT_OPEN"
+    probing = admitted == PROBE
+    try:
+        attempt = 0
+        while True:
+            left = budget_end - http_archive.now()
+            # 1回目は締切を過ぎていても短めに試す (結果ページなど)
+            timeout = min(HTTP_TIMEOUT, max(left, 3.0))
+            if not pol.acquire(timeout, lane_name):
+                metrics.inc("http_shed_total", dict(labels, lane=lane_name, reason="throttled"))
+                return None, "THROTTLED"
+            t0 = time.monotonic()
+            try:
+                body, status = fetch_fn(session, url, timeout)
+            except Exception as e:
+                body, status = None, f"EXCEPTION_{e}"
+            ok = not _retryable(status)
+            pol.release(ok, time.monotonic() - t0)
+            probing = False # release で復帰確認の結果は反映済み
+            if ok: return body, status
+
+            attempt += 1
+            if attempt > MAX_RETRIES: return body, status
+            backoff = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)) # full jitter
+            if http_archive.now() + backoff + 1.0 > budget_end: return body, status     # 締切に間に合わない
+            admitted = pol.admit(urgent)
+            if not admitted: return body, status
+            probing = admitted == PROBE
+            if lane_name == BACKGROUND and pol.contended(): return body, status # 締切間近の取得に譲る
+            metrics.inc("http_retries_total", labels)
+            http_archive.sleep(backoff)
+    finally:
+        # 復帰確認の1件が release まで行かずに終わったら、probing を残さない (残すと遮断が解けない)
+        if probing: pol.end_probe()
@@ -0,0 +1,274 @@
+import argparse
+import os
+import queue
+import signal
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+from features import RACER_FEATURES, boat_arrays
+
+# ==========================================
+# 🧠 共有推論サーバー (Unix ソケット)
+# ==========================================
+#   python inference_server.py                       # 既定: /tmp/boatbot_infer.sock
+#   INFERENCE_SOCKET=/tmp/boatbot_infer.sock python main.py
+#
+# 同じホストで複数の Bot / バックテストを動かすとき、モデルをこのプロセスで1回だけ読み込み、
+# 各クライアントからの予測要求をまとめて (バッチで) LightGBM に流す。
+# クライアント (predict_boat) はサーバーに繋がらなければ自前のモデルで予測する。
+#
+# 通信形式 (すべてリトルエンディアン):
+#   フレーム  = 本体長 uint32 + 本体
+#   要求本体  = b"BBI1" + レース数 uint16 + REQ_DTYPE x レース数
+#   応答本体  = b"BBI1" + 状態 uint8 (0=OK) + 版の長さ uint8 + 版 (utf-8) + RESP_DTYPE x レース数
+
+MAGIC = b"BBI1"
+DEFAULT_SOCKET = "/tmp/boatbot_infer.sock"
+SOCKET_PATH = os.environ.get("INFERENCE_SOCKET") or DEFAULT_SOCKET
+BATCH_MAX = int(os.environ.get("INFERENCE_BATCH_MAX", "256"))
+BATCH_WAIT_MS = float(os.environ.get("INFERENCE_BATCH_WAIT_MS", "2"))
+
+REQ_DTYPE = np.dtype([
+    ('jcd', '<u2'), ('wind', '<f8'), ('pid', '<i8', 6),
+    ('wr', '<f8', 6), ('mo', '<f8', 6), ('ex', '<f8', 6), ('st', '<f8', 6), ('f', '<f8', 6),
+    ('rs', '<f8', (6, len(RACER_FEATURES))),
+])
+RESP_DTYPE = np.dtype([('flags', 'u1'), ('max_p1', '<f8'), ('p3', '<f8', 120), ('p2', '<f8', 30)])
+F_VALID, F_3T, F_2T = 1, 2, 4
+_HDR = struct.Struct("<4sH")
+_LEN = struct.Struct("<I")
+
+# ------------------------------------------
+# 符号化
+# ------------------------------------------
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk: raise ConnectionError("接続が切れました")
+        buf += chunk
+    return bytes(buf)
+
+def recv_frame(sock):
+    n = _LEN.unpack(_recv_exact(sock, _LEN.size))[0]
+    return _recv_exact(sock, n)
+
+def send_frame(sock, body):
+    sock.sendall(_LEN.pack(len(body)) + body)
+
+def encode_request(raws, rs):
+    """raw 辞書のリストと選手別成績 (レース数, 6, k) を要求本体にする"""
+    a = boat_arrays(raws)
+    rec = np.zeros(len(raws), dtype=REQ_DTYPE)
+    for c in ('jcd', 'wind', 'pid', 'wr', 'mo', 'ex', 'st', 'f'):
+        rec[c] = a[c]
+    rec['rs'] = rs
+    return _HDR.pack(MAGIC, len(raws)) + rec.tobytes()
+
+def decode_request(body):
+    """要求本体から (boat_arrays 形式の配列群, 選手別成績) を取り出す"""
+    magic, n = _HDR.unpack_from(body)
+    if magic != MAGIC: raise ValueError("不正な要求です")
+    rec = np.frombuffer(body, dtype=REQ_DTYPE, count=n, offset=_HDR.size)
+    a = {c: np.ascontiguousarray(rec[c]) for c in ('wind', 'pid', 'wr', 'mo', 'ex', 'st', 'f')}
+    a['jcd'] = rec['jcd'].astype(np.int64)
+    return a, np.ascontiguousarray(rec['rs'])
+
+def encode_response(results, version, status=0):
+    rec = np.zeros(len(results), dtype=RESP_DTYPE)
+    for i, res in enumerate(results):
+        if res is None: continue
+        p3, max_p1, p2 = res
+        flags = F_VALID
+        if p3 is not None: rec['p3'][i] = p3; flags |= F_3T
+        if p2 is not None: rec['p2'][i] = p2; flags |= F_2T
+        rec['flags'][i], rec['max_p1'][i] = flags, max_p1
+    v = (version or "").encode()[:255]
+    return MAGIC + bytes([status, len(v)]) + v + rec.tobytes()
+
+def decode_response(body, n):
+    """応答本体から (predict_probs と同じ形のリスト, 版) を取り出す"""
+    if body[:4] != MAGIC or body[4] != 0: raise ValueError("推論サーバーがエラーを返しました")
+    vlen = body[5]
+    version = body[6:6 + vlen].decode() or None
+    rec = np.frombuffer(body, dtype=RESP_DTYPE, count=n, offset=6 + vlen)
+    out = []
+    for r in rec:
+        if not r['flags'] & F_VALID: out.append(None); continue
+        out.append((r['p3'].copy() if r['flags'] & F_3T else None, float(r['max_p1']),
+                    r['p2'].copy() if r['flags'] & F_2T else None))
+    return out, version
+
+# ------------------------------------------
+# サーバー
+# ------------------------------------------
+class _Batcher:
+    """全接続からの要求を集めて、まとめて predict_probs_batch に流す"""
+    def __init__(self, batch_max, batch_wait):
+        self.q = queue.Queue()
+        self.batch_max = batch_max
+        self.batch_wait = batch_wait
+
+    def submit(self, a, rs):
+        job = {'a': a, 'rs': rs, 'done': threading.Event(), 'out': None, 'version': None, 'error': None}
+        self.q.put(job)
+        job['done'].wait()
+        if job['error']: raise job['error']
+        return job['out'], job['version']
+
+    def run(self, stop_event):
+        import predict_boat
+        import metrics
+        while not stop_event.is_set():
+            try:
+                jobs = [self.q.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            size = len(jobs[0]['a']['jcd'])
+            deadline = time.monotonic() + self.batch_wait
+            while size < self.batch_max:
+                left = deadline - time.monotonic()
+                if left <= 0: break
+                try:
+                    job = self.q.get(timeout=left)
+                except queue.Empty:
+                    break
+                jobs.append(job); size += len(job['a']['jcd'])
+
+            models_3t, model_2t, version = predict_boat.current_models()
+            try:
+                a = {k: np.concatenate([j['a'][k] for j in jobs]) for k in jobs[0]['a']}
+                rs = np.concatenate([j['rs'] for j in jobs])
+                t0 = time.perf_counter()
+                out = predict_boat.predict_probs_batch(a, rs, (models_3t, model_2t)) if size else []
+                metrics.observe("stage_seconds", time.perf_counter() - t0, {"stage": "infer_batch"})
+                metrics.observe("inference_batch_races", size, buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+                pos = 0
+                for j in jobs:
+                    n = len(j['a']['jcd'])
+                    j['out'], j['version'] = out[pos:pos + n], version
+                    pos += n
+            except Exception as e:
+                for j in jobs: j['error'] = e
+            for j in jobs: j['done'].set()
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        batcher = self.server.batcher
+        while True:
+            try:
+                body = recv_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                a, rs = decode_request(body)
+                out, version = batcher.submit(a, rs)
+                resp = encode_response(out, version)
+            except Exception as e:
+                print(f"⚠️ 推論エラー: {e}")
+                resp = encode_response([], None, status=1)
+            try:
+                send_frame(self.request, resp)
+            except OSError:
+                return
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def _remove_stale(path):
+    """前回の残骸のソケットファイルを消す (動いているサーバーがあれば例外)"""
+    if not os.path.exists(path): return
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        s.close()
+    raise RuntimeError(f"推論サーバーは既に起動しています: {path}")
+
+def serve(path=None, batch_max=BATCH_MAX, batch_wait_ms=BATCH_WAIT_MS, stop_event=None):
+    import predict_boat
+    path = path or SOCKET_PATH
+    stop_event = stop_event or threading.Event()
+    predict_boat.load_models()
+    predict_boat.start_model_watcher(stop_event)
+
+    _remove_stale(path)
+    server = _Server(path, _Handler)
+    server.batcher = _Batcher(batch_max, batch_wait_ms / 1000.0)
+    threading.Thread(target=server.batcher.run, args=(stop_event,), daemon=True, name="infer-batcher").start()
+    print(f"🧠 推論サーバー起動: {path} (version {predict_boat.MODEL_VERSION}, バッチ最大 {batch_max}R / 待ち {batch_wait_ms:g}ms)")
+    def watch_stop():
+        stop_event.wait()
+        server.shutdown()
+    threading.Thread(target=watch_stop, daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        server.server_close()
+        if os.path.exists(path): os.unlink(path)
+        print("🛑 推論サーバー停止")
+
+# ------------------------------------------
+# クライアント
+# ------------------------------------------
+class InferenceClient:
+    """スレッドごとに1本の接続を張って使い回す"""
+    def __init__(self, path=None, timeout=2.0):
+        self.path = path or SOCKET_PATH
+        self.timeout = timeout
+        self.tls = threading.local()
+
+    def _sock(self):
+        s = getattr(self.tls, "sock", None)
+        if s is None:
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.settimeout(self.timeout)
+            s.connect(self.path)
+            self.tls.sock = s
+        return s
+
+    def _close(self):
+        s = getattr(self.tls, "sock", None)
+        self.tls.sock = None
+        if s is not None:
+            try: s.close()
+            except OSError: pass
+
+    def predict(self, raws, rs):
+        """(レースごとの predict_probs の値のリスト, モデルの版)。通信失敗は OSError / ValueError"""
+        try:
+            s = self._sock()
+            send_frame(s, encode_request(raws, rs))
+            return decode_response(recv_frame(s), len(raws))
+        except (OSError, ValueError, ConnectionError):
+            self._close()
+            raise
+
+    def ping(self):
+        """サーバーのモデルの版 (繋がらなければ例外)"""
+        return self.predict([], np.zeros((0, 6, len(RACER_FEATURES))))[1]
+
+def main():
+    ap = argparse.ArgumentParser(description="共有推論サーバー (Unix ソケット)")
+    ap.add_argument("--socket", default=SOCKET_PATH, help="ソケットのパス")
+    ap.add_argument("--batch-max", type=int, default=BATCH_MAX, help="1回にまとめる最大レース数")
+    ap.add_argument("--batch-wait-ms", type=float, default=BATCH_WAIT_MS, help="バッチを集める待ち時間 (ミリ秒)")
+    args = ap.parse_args()
+    stop_event = threading.Event()
+    # kill (SIGTERM) でもソケットファイルを消してから終了する
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    serve(args.socket, args.batch_max, args.batch_wait_ms, stop_event)
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,173 @@
+import argparse
+import csv
+import os
 import sqlite3
-import pandas as pd
-from datetime import datetime
-
-def inspect_db():
-    conn = sqlite3.connect('race_data.db')
-    cursor = conn.cursor()
-    
-    # Get table names
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = cursor.fetchall()
-    print("Tables:", tables)
-    
-    for table_name in tables:
-        table_name = table_name[0]
-        print(f"\nSchema for {table_name}:")
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        columns = cursor.fetchall()
-        for col in columns:
-            print(col)
-            
-        # Try to get data for today if there's a date column
-        # Assuming there might be a 'date' or 'timestamp' column
-        print(f"\nSample data from {table_name} (first 5 rows):")
-        try:
-            df = pd.read_sql_query(f"SELECT * FROM {table_name} LIMIT 5", conn)
-            print(df)
-        except Exception as e:
-            print(f"Error reading data: {e}")
-
-        # Check for today's data (2026-02-07)
-        # This is a guess on column names based on common practices
-        try:
-            # common date columns: date, race_date, timestamp
-            date_cols = [col[1] for col in columns if 'date' in col[1].lower() or 'time' in col[1].lower()]
-            if date_cols:
-                col = date_cols[0]
-                print(f"\nChecking for today's data in {table_name} column {col}...")
-                query = f"SELECT * FROM {table_name} WHERE {col} LIKE '2026-02-07%'"
-                df_today = pd.read_sql_query(query, conn)
-                print(f"Found {len(df_today)} records for today.")
-                if not df_today.empty:
-                    print(df_today.head())
-        except Exception as e:
-            print(f"Error checking today's data: {e}")
+import sys
+import time
 
+# ==========================================
+# 📊 購入履歴 (history) の集計レポート
+# ==========================================
+#   python inspect_db.py                          # 券種別の概要
+#   python inspect_db.py by venue type            # 会場 x 券種
+#   python inspect_db.py by month --from 20250101
+#   python inspect_db.py ev --type 3t             # EV 帯ごとの回収率
+#   python inspect_db.py calib                    # 予測確率と実際の的中率
+#   python inspect_db.py odds                     # 購入時オッズと最終オッズの比較
+#   python inspect_db.py schema                   # テーブル定義と件数
+#
+# 集計はすべて SQL (インデックス付き) で行い、結果は1行ずつ出力する。
+# pandas には読み込まない。
+
+DB_FILE = os.environ.get("RACE_DB") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "race_data.db")
+STAKE = 100 # 1点あたりの購入額
+
+GROUP_KEYS = {
+    'venue': "place",
+    'type': "ticket_type",
+    'day': "date",
+    'month': "substr(date, 1, 6)",
+    'version': "COALESCE(model_version, '-')",
+}
+
+# status, date で絞ってから集計に使う列をすべて含める (本体を読まずに索引だけで集計できる)。
+# main.init_db と同じ定義
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_history_report ON history "
+    "(status, date, ticket_type, place, profit, odds, prob, ev, result_odds, model_version)",
+]
+
+def connect(path=None):
+    conn = sqlite3.connect(path or DB_FILE)
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='history'").fetchone():
+        raise SystemExit(f"history テーブルがありません: {path or DB_FILE}")
+    for sql in INDEXES:
+        try: conn.execute(sql)
+        except sqlite3.OperationalError: pass # 読み取り専用・古いスキーマなど
+    conn.commit()
+    return conn
+
+def _where(args, extra=""):
+    where, params = ["status = 'FINISHED'"], []
+    if args.date_from: where.append("date >= ?"); params.append(args.date_from)
+    if args.date_to: where.append("date <= ?"); params.append(args.date_to)
+    if args.type: where.append("ticket_type = ?"); params.append(args.type)
+    if extra: where.append(extra)
+    return " AND ".join(where), params
+
+# ------------------------------------------
+# 出力 (1行ずつ)
+# ------------------------------------------
+class Table:
+    def __init__(self, headers, widths, as_csv=False):
+        self.headers, self.widths = headers, widths
+        self.writer = csv.writer(sys.stdout) if as_csv else None
+        if self.writer:
+            self.writer.writerow(headers)
+        else:
+            print("  ".join(f"{h:>{w}}" for h, w in zip(headers, widths)))
+            print("  ".join("-" * w for w in widths))
+
+    def row(self, values):
+        if self.writer:
+            self.writer.writerow([round(v, 3) if isinstance(v, float) else v for v in values]); return
+        out = []
+        for v, w in zip(values, self.widths):
+            if isinstance(v, float): v = f"{v:,.1f}"
+            elif isinstance(v, int): v = f"{v:,}"
+            out.append(f"{v if v is not None else '-':>{w}}")
+        print("  ".join(out))
+
+def _agg_cols():
+    return (f"COUNT(*), SUM(profit > 0), SUM(profit), "
+            f"SUM(CASE WHEN profit > 0 THEN profit + {STAKE} ELSE 0 END)")
+
+def _rates(n, hits, profit, ret):
+    stake = n * STAKE
+    return (hits / n * 100 if n else 0.0), (ret / stake * 100 if stake else 0.0)
+
+# ------------------------------------------
+# レポート
+# ------------------------------------------
+def report_by(conn, args):
+    keys = args.keys or ['type']
+    exprs = [GROUP_KEYS[k] for k in keys]
+    where, params = _where(args)
+    sql = (f"SELECT {', '.join(exprs)}, {_agg_cols()} FROM history WHERE {where} "
+           f"GROUP BY {', '.join(exprs)} ORDER BY {', '.join(exprs)}")
+    t = Table(keys + ['bets', 'hits', 'hit%', 'roi%', 'profit'], [10] * len(keys) + [8, 6, 6, 7, 10], args.csv)
+    tot = [0, 0, 0, 0]
+    for row in conn.execute(sql, params):
+        k, (n, hits, profit, ret) = row[:len(keys)], row[len(keys):]
+        hit_rate, roi = _rates(n, hits, profit, ret)
+        t.row(list(k) + [n, hits, hit_rate, roi, profit])
+        tot = [a + (b or 0) for a, b in zip(tot, (n, hits, profit, ret))]
+    hit_rate, roi = _rates(*tot)
+    t.row(['合計'] + [''] * (len(keys) - 1) + [tot[0], tot[1], hit_rate, roi, tot[2]])
+
+def report_ev(conn, args):
+    """購入時EVの帯ごとの回収率 (EV が当たっているかの確認)"""
+    width = args.bucket or 0.25
+    where, params = _where(args, "ev IS NOT NULL")
+    sql = (f"SELECT MIN(CAST(ev / ? AS INTEGER), 40) AS b, AVG(ev), {_agg_cols()} FROM history "
+           f"WHERE {where} GROUP BY b ORDER BY b")
+    t = Table(['ev>=', 'avg_ev', 'bets', 'hits', 'hit%', 'roi%', 'profit'], [7, 7, 8, 6, 6, 7, 10], args.csv)
+    for b, avg_ev, n, hits, profit, ret in conn.execute(sql, [width] + params):
+        hit_rate, roi = _rates(n, hits, profit, ret)
+        t.row([f"{b * width:.2f}", f"{avg_ev:.2f}", n, hits, hit_rate, roi, profit])
+
+def report_calib(conn, args):
+    """予測確率 (購入時, %) の帯ごとに実際の的中率と比べる"""
+    width = args.bucket or 5.0
+    where, params = _where(args, "prob IS NOT NULL")
+    sql = (f"SELECT ticket_type, CAST(prob / ? AS INTEGER) AS b, AVG(prob), COUNT(*), SUM(profit > 0) "
+           f"FROM history WHERE {where} GROUP BY ticket_type, b ORDER BY ticket_type, b")
+    t = Table(['type', 'prob%>=', 'pred%', 'actual%', 'bets', 'gap'], [5, 8, 7, 8, 8, 7], args.csv)
+    for t_type, b, pred, n, hits in conn.execute(sql, [width] + params):
+        actual = hits / n * 100 if n else 0.0
+        t.row([t_type, f"{b * width:.0f}", pred, actual, n, actual - pred])
+
+def report_odds(conn, args):
+    """購入時オッズ (odds) と最終オッズ (result_odds) の比較"""
+    where, params = _where(args, "odds > 0 AND result_odds > 0")
+    sql = (f"SELECT ticket_type, COUNT(*), AVG(result_odds / odds), "
+           f"SUM(result_odds < odds), SUM(result_odds < odds * 0.8), "
+           f"SUM(CASE WHEN profit > 0 THEN odds * {STAKE} ELSE 0 END), SUM(CASE WHEN profit > 0 THEN profit + {STAKE} ELSE 0 END) "
+           f"FROM history WHERE {where} GROUP BY ticket_type ORDER BY ticket_type")
+    t = Table(['type', 'bets', 'final/bet', 'down%', 'down20%', 'hit_ret@bet', 'hit_ret'], [5, 8, 9, 6, 7, 11, 10], args.csv)
+    for t_type, n, ratio, down, down20, ret_bet, ret in conn.execute(sql, params):
+        t.row([t_type, n, f"{ratio:.3f}", down / n * 100, down20 / n * 100, int(ret_bet or 0), int(ret or 0)])
+
+def report_schema(conn, args):
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name").fetchall():
+        cnt = conn.execute(f"SELECT COUNT(*) FROM \"{name}\"").fetchone()[0]
+        cols = ", ".join(f"{r[1]} {r[2]}" for r in conn.execute(f"PRAGMA table_info(\"{name}\")"))
+        print(f"{name} ({cnt:,}件): {cols}")
+    for name, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type='index' AND sql IS NOT NULL"):
+        print(f"  index {name}: {sql}")
+
+REPORTS = {'by': report_by, 'ev': report_ev, 'calib': report_calib, 'odds': report_odds, 'schema': report_schema}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="購入履歴の集計レポート")
+    ap.add_argument("report", nargs="?", default="by", choices=sorted(REPORTS), help="レポートの種類")
+    ap.add_argument("keys", nargs="*", metavar="KEY", help=f"by の集計キー ({' / '.join(GROUP_KEYS)})")
+    ap.add_argument("--db", default=None, help=f"DB (省略時は {DB_FILE})")
+    ap.add_argument("--from", dest="date_from", default=None, help="開始日 YYYYMMDD")
+    ap.add_argument("--to", dest="date_to", default=None, help="終了日 YYYYMMDD")
+    ap.add_argument("--type", choices=["2t", "3t", "2f", "3f"], default=None, help="券種で絞り込む")
+    ap.add_argument("--bucket", type=float, default=None, help="ev / calib の帯の幅")
+    ap.add_argument("--csv", action="store_true", help="CSV で出力")
+    args = ap.parse_args(argv)
+    bad = [k for k in args.keys if k not in GROUP_KEYS]
+    if bad: ap.error(f"不明な集計キー: {', '.join(bad)}")
+
+    t0 = time.perf_counter()
+    conn = connect(args.db)
+    REPORTS[args.report](conn, args)
     conn.close()
+    if not args.csv:
+        print(f"⏱️ {time.perf_counter() - t0:.3f}秒", file=sys.stderr)
 
 if __name__ == "__main__":
-    inspect_db()
+    main()
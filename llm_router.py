@@ -0,0 +1,166 @@
+import os
+import json
+import importlib.util
+import time
+import threading
+import collections
+
+import metrics
+
+# ==========================================
+# 🤖 解説用 LLM の振り分け (OpenAI 互換エンドポイント)
+# ==========================================
+# モデル (エンドポイント) ごとに直近の応答時間とエラーを記録し、1回の解説依頼を
+# 「今いちばん速くて健全なモデル」に送る。遅い・失敗したら残り時間の範囲で次のモデルへ。
+# どれも間に合わなければ None を返し、呼び出し側は定型文にする。
+#
+# 既定は Groq の LLM_MODELS (カンマ区切り) を GROQ_API_KEY で使う。別の構成は LLM_ENDPOINTS に JSON で:
+#   LLM_ENDPOINTS='[{"base_url": "http://127.0.0.1:8766/v1", "model": "mock-fast", "api_key_env": "MOCK_KEY"}]'
+# ローカルの代替サーバーは mock_llm.py。
+
+GROQ_BASE_URL = "https://api.groq.com/openai/v1"
+DEFAULT_MODELS = "meta-llama/llama-4-scout-17b-16e-instruct,llama-3.1-8b-instant"
+LLM_BUDGET_SEC = float(os.environ.get("LLM_BUDGET_SEC", "8") or 8)  # 1回の解説にかけてよい合計時間
+PRIOR_LATENCY = 2.0     # 未計測のモデルの想定応答時間 (秒)
+MIN_ATTEMPT_SEC = 1.0   # 残りがこれ未満なら次のモデルは試さない
+WINDOW = 20             # 直近何回分で応答時間を見るか
+FAIL_LIMIT = 3          # 連続でこれだけ失敗したら一時的に外す
+COOLDOWN = 30.0         # 外す時間 (続けて失敗するたびに倍, 最大 COOLDOWN_MAX)
+COOLDOWN_MAX = 600.0
+RATE_LIMIT_COOLDOWN = 60.0  # 429 で Retry-After が無いときに外す時間
+
+# openai は読み込みに時間がかかるので、最初にクライアントを作るときまで import しない
+OPENAI_AVAILABLE = importlib.util.find_spec("openai") is not None
+
+class Endpoint:
+    def __init__(self, base_url, model, api_key_env="GROQ_API_KEY"):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.api_key_env = api_key_env
+        self.latencies = collections.deque(maxlen=WINDOW)
+        self.errors = collections.deque(maxlen=WINDOW) # 1=失敗
+        self.fails = 0          # 連続失敗
+        self.down_until = 0.0
+        self.cooldown = COOLDOWN
+        self._client = None
+
+    @property
+    def name(self):
+        return self.model
+
+    def client(self):
+        if self._client is None:
+            api_key = os.environ.get(self.api_key_env)
+            if not api_key: return None
+            from openai import OpenAI
+            # 再試行はこちらで (別のモデルに) 行うので SDK 側では行わない
+            self._client = OpenAI(base_url=self.base_url, api_key=api_key, max_retries=0, timeout=LLM_BUDGET_SEC)
+        return self._client
+
+    def estimate(self):
+        """想定応答時間: 直近の中央値と最大値の間 (遅い外れ値を少し重く見る)"""
+        if not self.latencies: return PRIOR_LATENCY
+        s = sorted(self.latencies)
+        return (s[len(s) // 2] + s[-1]) / 2
+
+    def healthy(self, now):
+        return now >= self.down_until
+
+    def error_rate(self):
+        return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+class Router:
+    def __init__(self, endpoints):
+        self.endpoints = endpoints
+        self.lock = threading.Lock()
+
+    def ranked(self):
+        """健全なモデルを想定応答時間の短い順に (エラー率の分だけ後回し)"""
+        now = time.monotonic()
+        with self.lock:
+            up = [e for e in self.endpoints if e.healthy(now)]
+            return sorted(up, key=lambda e: e.estimate() * (1 + e.error_rate()))
+
+    def _record(self, ep, ok, latency=None, kind=None, retry_after=None):
+        labels = {"model": ep.name}
+        with self.lock:
+            ep.errors.append(0 if ok else 1)
+            if ok:
+                ep.latencies.append(latency)
+                ep.fails, ep.cooldown = 0, COOLDOWN
+                return
+            ep.fails += 1
+            if kind == "timeout":
+                # 打ち切った時間を応答時間として入れておく (次回から後回しになる)
+                ep.latencies.append(latency)
+            if kind == "rate_limit":
+                ep.down_until = time.monotonic() + (retry_after or RATE_LIMIT_COOLDOWN)
+            elif ep.fails >= FAIL_LIMIT:
+                ep.down_until = time.monotonic() + ep.cooldown
+                ep.cooldown = min(ep.cooldown * 2, COOLDOWN_MAX)
+        metrics.inc("llm_errors_total", dict(labels, kind=kind or "error"))
+
+    def complete(self, prompt, budget=None, **params):
+        """残り時間 budget 秒以内に答えられたモデルの本文を返す (全滅なら None)"""
+        end = time.monotonic() + (budget or LLM_BUDGET_SEC)
+        candidates = [e for e in self.ranked() if e.client() is not None]
+        for i, ep in enumerate(candidates):
+            left = end - time.monotonic()
+            if left < MIN_ATTEMPT_SEC: break
+            # 後ろにまだ候補があるなら、遅いモデルが残り時間を使い切らないよう打ち切る
+            timeout = left if i == len(candidates) - 1 else min(left, max(2 * ep.estimate(), MIN_ATTEMPT_SEC))
+            t0 = time.monotonic()
+            try:
+                chat = ep.client().chat.completions.create(
+                    messages=[{"role": "user", "content": prompt}], model=ep.model, timeout=timeout, **params)
+                text = chat.choices[0].message.content
+            except Exception as e:
+                kind, retry_after = classify_error(e)
+                self._record(ep, False, time.monotonic() - t0, kind, retry_after)
+                print(f"⚠️ LLM {ep.name}: {kind} ({e.__class__.__name__})")
+                continue
+            latency = time.monotonic() - t0
+            self._record(ep, True, latency)
+            metrics.observe("llm_request_seconds", latency, {"model": ep.name})
+            metrics.inc("llm_route_total", {"model": ep.name, "attempt": str(i + 1)})
+            return text
+        metrics.inc("llm_fallback_total")
+        return None
+
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            return [{'model': e.name, 'base_url': e.base_url, 'estimate': round(e.estimate(), 2),
+                     'error_rate': round(e.error_rate(), 2), 'down_sec': round(max(0.0, e.down_until - now), 1)}
+                    for e in self.endpoints]
+
+def classify_error(e):
+    """例外を timeout / rate_limit / error に分ける: (種類, Retry-After 秒 or None)"""
+    name = e.__class__.__name__
+    if "Timeout" in name: return "timeout", None
+    status = getattr(e, "status_code", None)
+    if status == 429 or "RateLimit" in name:
+        try: retry_after = float(e.response.headers.get("retry-after"))
+        except Exception: retry_after = None
+        return "rate_limit", retry_after
+    return "error", None
+
+def endpoints_from_env():
+    spec = os.environ.get("LLM_ENDPOINTS", "").strip()
+    if spec:
+        return [Endpoint(d['base_url'], d['model'], d.get('api_key_env', "GROQ_API_KEY")) for d in json.loads(spec)]
+    models = os.environ.get("LLM_MODELS", DEFAULT_MODELS)
+    return [Endpoint(GROQ_BASE_URL, m.strip()) for m in models.split(",") if m.strip()]
+
+_ROUTER = None
+_ROUTER_LOCK = threading.Lock()
+
+def get_router():
+    """設定済みのモデルが1つも使えなければ None"""
+    global _ROUTER
+    if not OPENAI_AVAILABLE: return None
+    with _ROUTER_LOCK:
+        if _ROUTER is None:
+            _ROUTER = Router(endpoints_from_env())
+    if not any(os.environ.get(e.api_key_env) for e in _ROUTER.endpoints): return None
+    return _ROUTER
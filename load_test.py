@@ -0,0 +1,123 @@
+import argparse
+import concurrent.futures
+import datetime
+import json
+import threading
+import time
+
+import metrics
+import scraper
+import mock_boatrace
+from scraper import scrape_race_data, get_session, get_odds_map, get_odds_2tf
+from predict_boat import predict_race, load_models, filter_and_sort_bets, ODDS_PAGES
+
+# ==========================================
+# 🏋️ 負荷ドライバー (代替サーバー相手に判定パイプラインを回す)
+# ==========================================
+#   python load_test.py --workers 5,10,20 --latency 0.3 --jitter 0.2 --error-rate 0.05
+#   python load_test.py --base-url http://127.0.0.1:8765/owpc/pc/race   # 起動済みのサーバーを使う
+#
+# 1レース = 出走表/直前情報 → predict_race → オッズ取得 → filter_and_sort_bets を
+# 「判定」とみなし、その所要時間を end-to-end の判定レイテンシとして集計する。
+
+JST = datetime.timezone(datetime.timedelta(hours=9), 'JST')
+
+def decide_race(jcd, rno, date_str):
+    """main.process_race の判定部分 (DB保存・通知・締切待機なし) を実行して結果種別を返す"""
+    sess = get_session()
+    raw, error = scrape_race_data(sess, jcd, rno, date_str)
+    if error != "OK" or not raw: return error if error.startswith("NO_RACE") else "FETCH_ERR"
+    candidates, _, _, _ = predict_race(raw)
+    if not candidates: return "VETTED"
+    pages = {ODDS_PAGES[c['type']] for c in candidates}
+    odds_2t, odds_2f = get_odds_2tf(sess, jcd, rno, date_str) if '2tf' in pages else ({}, {})
+    odds_3t = get_odds_map(sess, jcd, rno, date_str) if '3t' in pages else {}
+    final_bets, _, _ = filter_and_sort_bets(candidates, odds_2t, odds_3t, jcd, odds_2f)
+    return "BET" if final_bets else "NO_EV"
+
+def _percentile(sorted_vals, q):
+    if not sorted_vals: return 0.0
+    idx = min(len(sorted_vals) - 1, int(round(q * (len(sorted_vals) - 1))))
+    return sorted_vals[idx]
+
+def run_load(workers, date_str, venues, races, rounds=1):
+    """指定スレッド数で全レースを rounds 周させ、スループットとレイテンシを返す"""
+    latencies = []
+    outcomes = {}
+    lock = threading.Lock()
+
+    def _one(jcd, rno):
+        t0 = time.perf_counter()
+        try:
+            res = decide_race(jcd, rno, date_str)
+        except Exception as e:
+            res = f"EXCEPTION:{type(e).__name__}"
+        dt = time.perf_counter() - t0
+        with lock:
+            latencies.append(dt)
+            outcomes[res] = outcomes.get(res, 0) + 1
+
+    t_start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
+        for _ in range(rounds):
+            for rno in races:
+                for jcd in venues:
+                    ex.submit(_one, jcd, rno)
+    elapsed = time.perf_counter() - t_start
+
+    lat = sorted(latencies)
+    return {
+        "workers": workers,
+        "races": len(lat),
+        "elapsed_sec": round(elapsed, 3),
+        "races_per_sec": round(len(lat) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_sec": {
+            "p50": round(_percentile(lat, 0.50), 4),
+            "p95": round(_percentile(lat, 0.95), 4),
+            "p99": round(_percentile(lat, 0.99), 4),
+            "max": round(lat[-1], 4) if lat else 0.0,
+        },
+        "outcomes": outcomes,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="代替サーバーを使った負荷試験")
+    ap.add_argument("--base-url", default="", help="起動済みサーバーのURL (省略時は内蔵サーバーを起動)")
+    ap.add_argument("--workers", default="10", help="スレッド数 (カンマ区切りで複数指定)")
+    ap.add_argument("--venues", type=int, default=24, help="開催会場数 (1〜24)")
+    ap.add_argument("--races", type=int, default=12, help="1会場あたりのレース数")
+    ap.add_argument("--rounds", type=int, default=1, help="全レースを何周するか")
+    ap.add_argument("--json", default="", help="結果JSONの出力先")
+    mock_boatrace.add_config_args(ap)
+    args = ap.parse_args()
+
+    srv = None
+    if args.base_url:
+        scraper.BASE_URL = args.base_url.rstrip("/")
+    else:
+        srv = mock_boatrace.start_server(mock_boatrace.config_from_args(args))
+        scraper.BASE_URL = srv.base_url
+    print(f"🧪 取得先: {scraper.BASE_URL}")
+
+    load_models()
+    date_str = datetime.datetime.now(JST).strftime('%Y%m%d')
+    venues = list(range(1, min(args.venues, 24) + 1))
+    races = list(range(1, min(args.races, 12) + 1))
+
+    results = []
+    for w in [int(x) for x in args.workers.split(",") if x.strip()]:
+        r = run_load(w, date_str, venues, races, args.rounds)
+        results.append(r)
+        lat = r["latency_sec"]
+        print(f"🏋️ workers={w:>3}: {r['races_per_sec']:>7.2f} races/s  "
+              f"p50={lat['p50']:.3f}s p95={lat['p95']:.3f}s p99={lat['p99']:.3f}s  {r['outcomes']}")
+
+    report = {"base_url": scraper.BASE_URL, "results": results, "metrics": metrics.snapshot()}
+    if srv: report["server_counts"] = dict(srv.counts)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 結果を保存しました: {args.json}")
+
+if __name__ == "__main__":
+    main()
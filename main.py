@@ -1,18 +1,53 @@
+import time
+_T_START = time.perf_counter()
 import os
 import datetime
-import time
 import sqlite3
 import concurrent.futures
 import threading
+import queue
 import sys
-import requests as std_requests
 import json
-
+import argparse
+import importlib
+import metrics
+import http_archive
+import supervisor
+import run_state
+import db_journal
+import http_policy
+import shadow
+import profiler
+_T_IMPORTED = time.perf_counter()
+
+# 重いモジュール (scraper, predict_boat, racer_stats, requests) は使うモードでだけ読み込む。
 # scraper, predict_boat は同じフォルダに配置してください
-from scraper import scrape_race_data, get_session, get_odds_map, get_odds_2t, scrape_result
-from predict_boat import predict_race, attach_reason, load_models, filter_and_sort_bets, CONF_THRESH_3T, CONF_THRESH_2T, STRATEGY_3T, STRATEGY_2T, MIN_PROB_3T, check_groq_setup
 
-DB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "race_data.db")
+# ==========================================
+# 🧩 実行モード
+# ==========================================
+#   python main.py            # all: 走査・結果確定・通知を1プロセスで (既定)
+#   python main.py scan       # 走査・予測・購入判定だけ (通知は notify_outbox 経由)
+#   python main.py settle     # 結果確定・選手成績・影モデルの確定だけ (pandas/lightgbm/openai を読まない)
+#   python main.py notify     # notify_outbox の送信だけ
+# RUN_MODE 環境変数でも指定できる。
+MODES = {
+    'scan': ('scanner',),
+    'settle': ('reporter',),
+    'notify': ('notifier',),
+    'all': ('scanner', 'reporter', 'notifier'),
+}
+MODE_IMPORTS = {
+    'scanner': ('scraper', 'racer_stats', 'predict_boat'),
+    'reporter': ('scraper', 'racer_stats'),
+    'notifier': ('requests',),
+}
+RUN_MODE = "all"
+
+DB_FILE = os.environ.get("RACE_DB") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "race_data.db")
+if http_archive.is_replaying() and not os.environ.get("RACE_DB"):
+    # リプレイの購入履歴・選手成績で本番の DB を汚さない (既定はアーカイブの隣の別ファイル)
+    DB_FILE = os.path.splitext(os.path.abspath(http_archive.ARCHIVE_FILE))[0] + ".replay.db"
 PLACE_NAMES = {i: n for i, n in enumerate(["","桐生","戸田","江戸川","平和島","多摩川","浜名湖","蒲郡","常滑","津","三国","びわこ","住之江","尼崎","鳴門","丸亀","児島","宮島","徳山","下関","若松","芦屋","福岡","唐津","大村"])}
 JST = datetime.timezone(datetime.timedelta(hours=9), 'JST')
 
@@ -23,21 +58,94 @@ STATS = {"scanned": 0, "hits": 0, "errors": 0, "skipped": 0, "vetted": 0, "waiti
 STATS_LOCK = threading.Lock()
 FINISHED_RACES = set()
 FINISHED_RACES_LOCK = threading.Lock()
+RACER_PENDING = set() # 選手別成績の結果待ちに登録済みのレース (FINISHED_RACES_LOCK で保護)
+RUN_STATE = run_state.RunState(DB_FILE) # レースごとの締切・進行状況 (再起動後に復元)
+
+def now_jst():
+    # リプレイ中はシミュレーション時刻を返す
+    return datetime.datetime.fromtimestamp(http_archive.now(), JST)
 
 def log(msg):
-    print(f"[{datetime.datetime.now(JST).strftime('%H:%M:%S')}] {msg}", flush=True)
+    print(f"[{now_jst().strftime('%H:%M:%S')}] {msg}", flush=True)
 
 def error_log(msg):
-    print(f"[{datetime.datetime.now(JST).strftime('%H:%M:%S')}] ❌ {msg}", file=sys.stderr, flush=True)
-
-def send_discord(content):
+    print(f"[{now_jst().strftime('%H:%M:%S')}] ❌ {msg}", file=sys.stderr, flush=True)
+
+NOTIFY_QUEUE = queue.Queue() # (本文, 券種 or None, 締切 epoch秒 or None)
+OUTBOX_POLL = 1.0 # notify_outbox を見に行く間隔 (秒)
+
+def _posted(bet_type=None, deadline_ts=None):
+    """買い目の通知を送り終えたときの計測"""
+    if not bet_type: return
+    # 投稿時点での締切までの残り時間 (マイナスは締切超過)
+    slack = deadline_ts - http_archive.now()
+    metrics.observe("deadline_slack_seconds", slack, {"type": bet_type}, buckets=metrics.SLACK_BUCKETS)
+    metrics.inc("bets_posted_total", {"type": bet_type})
+
+def send_discord(content, bet_type=None, deadline_ts=None):
+    """通知を送信キューに積む (実際の送信は notifier_worker)。
+    このプロセスに通知ワーカーがいなければ notify_outbox に書き、notify モードのプロセスが送る"""
+    if http_archive.is_replaying():
+        _posted(bet_type, deadline_ts)
+        return
+    if 'notifier' not in MODES[RUN_MODE]:
+        # 呼び出し元は DB_LOCK を持ったまま (コミット済み) 呼ぶので、ここではロックを取らずに別接続で書く
+        conn = sqlite3.connect(DB_FILE, timeout=30)
+        with conn:
+            conn.execute("INSERT INTO notify_outbox (content, bet_type, deadline_ts, created_at) VALUES (?,?,?,?)",
+                         (content, bet_type, deadline_ts, http_archive.now()))
+        conn.close()
+        return
+    if not os.environ.get("DISCORD_WEBHOOK_URL"):
+        _posted(bet_type, deadline_ts)
+        return
+    NOTIFY_QUEUE.put((content, bet_type, deadline_ts))
+
+def _post_discord(content):
+    import requests as std_requests
     url = os.environ.get("DISCORD_WEBHOOK_URL")
     if not url: return
     try:
-        std_requests.post(url, json={"content": content}, timeout=10)
+        with metrics.timer("discord"):
+            std_requests.post(url, json={"content": content}, timeout=10)
     except Exception as e:
+        metrics.inc("discord_errors_total")
         error_log(f"Discord通知エラー: {e}")
 
+def _drain_outbox():
+    """別プロセス (scan / settle) が積んだ通知を古い順に送る。送った件数を返す"""
+    with DB_LOCK:
+        conn = sqlite3.connect(DB_FILE, timeout=30)
+        rows = conn.execute("SELECT id, content, bet_type, deadline_ts FROM notify_outbox ORDER BY id LIMIT 50").fetchall()
+        conn.close()
+    for row_id, content, bet_type, deadline_ts in rows:
+        _post_discord(content)
+        _posted(bet_type, deadline_ts)
+        with DB_LOCK:
+            conn = sqlite3.connect(DB_FILE, timeout=30)
+            with conn:
+                conn.execute("DELETE FROM notify_outbox WHERE id=?", (row_id,))
+            conn.close()
+    return len(rows)
+
+def notifier_worker(stop_event):
+    log("ℹ️ 通知スレッド起動")
+    next_poll = 0.0
+    while True:
+        if time.monotonic() >= next_poll:
+            try:
+                _drain_outbox()
+            except sqlite3.Error as e:
+                error_log(f"通知キュー(DB)読み込みエラー: {e}")
+            next_poll = time.monotonic() + OUTBOX_POLL
+        try:
+            content, bet_type, deadline_ts = NOTIFY_QUEUE.get(timeout=0.5)
+        except queue.Empty:
+            if stop_event.is_set(): return # 停止時は積まれている分を送り切ってから抜ける
+            continue
+        _post_discord(content)
+        _posted(bet_type, deadline_ts)
+
 def init_db():
     conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
@@ -70,7 +178,8 @@ def init_db():
         "ev": "REAL",
         "comment": "TEXT",
         "ticket_type": "TEXT",
-        "result_odds": "REAL"
+        "result_odds": "REAL",
+        "model_version": "TEXT"
     }
     
     for col_name, col_type in required_columns.items():
@@ -80,24 +189,78 @@ def init_db():
                 cursor.execute(f"ALTER TABLE history ADD COLUMN {col_name} {col_type}")
             except Exception as e:
                 print(f"⚠️ マイグレーション警告: {e}")
+
+    # プロセスを分けて動かすとき (scan / settle -> notify) の通知の受け渡し
+    cursor.execute("CREATE TABLE IF NOT EXISTS notify_outbox "
+                   "(id INTEGER PRIMARY KEY AUTOINCREMENT, content TEXT, bet_type TEXT, deadline_ts REAL, created_at REAL)")
+
+    # 未確定の取得・日別集計・レポート (inspect_db.py) 用。集計列も含めて索引だけで済ませる
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_report ON history "
+                   "(status, date, ticket_type, place, profit, odds, prob, ev, result_odds, model_version)")
     
     conn.commit()
     conn.close()
 
+def settle_racer_stats(sess):
+    """結果待ちレースの選手別成績を反映する。取得できた結果を {(date, jcd, rno): res} で返す"""
+    import racer_stats
+    from scraper import scrape_result
+    store = racer_stats.get_store()
+    known = {}
+    waiting = []
+    now = http_archive.now()
+    # 締切 + 待ち時間を過ぎたものだけ (未確定なら間隔を空けて取り直す)
+    for date_str, jcd, rno, entry in store.pending(now):
+        res = scrape_result(sess, jcd, rno, date_str)
+        if not res or not res.get('combo_3t'):
+            waiting.append((date_str, jcd, rno))
+            if not res: continue
+        known[(date_str, jcd, rno)] = res
+        if res.get('combo_3t') and store.update(date_str, jcd, rno, entry, res['combo_3t']):
+            metrics.inc("racer_stats_updates_total")
+    store.defer_pending(waiting, now)
+    return known
+
+# 列順は既存DB (マイグレーションで後から列を足したもの) に依存しないよう明示する
+HISTORY_INSERT = (
+    "INSERT INTO history (race_id, date, place, race_no, predict_combo, status, profit, odds, prob, ev, comment, ticket_type, result_odds, model_version) "
+    "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
+)
+
 def report_worker(stop_event):
+    from scraper import get_session, get_odds_map, get_odds_2tf, scrape_result
+    from predict_boat import BET_LABELS
     log("ℹ️ レポート監視スレッド起動 (レース単位集約版)")
+    # 結果確定の取得は締切間近のオッズ取得より後回しでよい
+    http_policy.set_lane(http_policy.BACKGROUND)
     while not stop_event.is_set():
         try:
+            # 選手別成績の更新 (購入の有無に関係なく、出走表を取ったレースすべて)
+            known_results = {}
+            profiler.set_tag("選手成績")
+            try:
+                known_results = settle_racer_stats(get_session())
+            except Exception as e:
+                error_log(f"選手成績更新エラー: {e}")
+            # 影モデルの買い目も同じ結果で確定する (通知はしない)
+            profiler.set_tag("影モデル")
+            try:
+                shadow.settle(DB_FILE, get_session(), known_results)
+            except Exception as e:
+                error_log(f"影モデル確定エラー: {e}")
+            profiler.set_tag(None)
+
             with DB_LOCK:
                 conn = sqlite3.connect(DB_FILE)
                 conn.row_factory = sqlite3.Row
                 
                 # 未完了のレースを会場・R番号でグルーピングして取得
                 # race_id形式: YYYYMMDD_JCD_RNO_COMBO_TYPE
-                pending_bets = conn.execute("SELECT * FROM history WHERE status='PENDING'").fetchall()
+                with metrics.timer("sqlite"):
+                    pending_bets = conn.execute("SELECT * FROM history WHERE status='PENDING'").fetchall()
                 if not pending_bets:
                     conn.close()
-                    time.sleep(60)
+                    http_archive.sleep(60, stop_event)
                     continue
 
                 # グルーピング: (date, jcd, rno) -> [bet_rows...]
@@ -113,7 +276,7 @@ def report_worker(stop_event):
                 
                 if not race_groups:
                     conn.close()
-                    time.sleep(60)
+                    http_archive.sleep(60, stop_event)
                     continue
 
                 sess = get_session()
@@ -121,9 +284,10 @@ def report_worker(stop_event):
                 for key, bets in race_groups.items():
                     date_str, jcd, rno = key
                     place_name = bets[0]['place']
+                    profiler.set_tag(f"結果 {place_name}{rno}R")
                     
                     # 1. 結果取得 (レース単位で1回だけ)
-                    res = scrape_result(sess, jcd, rno, date_str)
+                    res = known_results.get(key) or scrape_result(sess, jcd, rno, date_str)
                     if not res: continue # まだ結果が出ていない
                     
                     # 2. まとめて判定 & DB更新
@@ -131,24 +295,21 @@ def report_worker(stop_event):
                     results_summary = []
                     hit_count = 0
                     
-                    # 共通の結果文字列取得 (2t/3t両方確認)
-                    res_str_2t = res.get('combo_2t', '未確定')
-                    payout_2t = res.get('payout_2t', 0)
-                    res_str_3t = res.get('combo_3t', '未確定')
-                    payout_3t = res.get('payout_3t', 0)
+                    # 共通の結果文字列取得 (券種ごとに combo_<券種> / payout_<券種>)
+                    res_strs = {t: res.get(f'combo_{t}', '未確定') for t in BET_LABELS}
+                    payouts = {t: res.get(f'payout_{t}', 0) for t in BET_LABELS}
                     
                     # 最終オッズ取得 (乖離計測用)
-                    final_odds_2t = {}
-                    final_odds_3t = {}
+                    final_odds = {}
                     try:
-                        final_odds_2t = get_odds_2t(sess, jcd, rno, date_str)
-                        final_odds_3t = get_odds_map(sess, jcd, rno, date_str)
+                        final_odds['2t'], final_odds['2f'] = get_odds_2tf(sess, jcd, rno, date_str)
+                        final_odds['3t'] = get_odds_map(sess, jcd, rno, date_str)
                     except Exception as e:
                         # error_log(f"最終オッズ取得エラー: {e}")
                         pass # オッズ取得エラーは致命的ではないので無視
                     
-                    # 結果が両方とも未確定ならスキップ
-                    if (res_str_2t == "未確定" or res_str_2t is None) and (res_str_3t == "未確定" or res_str_3t is None):
+                    # 結果がすべて未確定ならスキップ
+                    if all(v == "未確定" or v is None for v in res_strs.values()):
                         continue
 
                     # トランザクション更新
@@ -159,12 +320,8 @@ def report_worker(stop_event):
                         t_type = bet['ticket_type']
                         race_id = bet['race_id']
                         
-                        if t_type == '2t':
-                            result_str = res_str_2t
-                            payout = payout_2t
-                        else:
-                            result_str = res_str_3t
-                            payout = payout_3t
+                        result_str = res_strs.get(t_type)
+                        payout = payouts.get(t_type, 0)
                         
                         # 念のため結果が入っているか確認
                         if result_str == "未確定" or result_str is None:
@@ -176,10 +333,7 @@ def report_worker(stop_event):
                         # 最終オッズ取得
                         result_odds_val = 0.0
                         try:
-                            if t_type == '2t':
-                                result_odds_val = final_odds_2t.get(combo, 0.0)
-                            else:
-                                result_odds_val = final_odds_3t.get(combo, 0.0)
+                            result_odds_val = final_odds.get(t_type, {}).get(combo, 0.0)
                         except: pass
 
                         conn.execute("UPDATE history SET status='FINISHED', profit=?, result_odds=? WHERE race_id=?", (profit, result_odds_val, race_id))
@@ -191,10 +345,12 @@ def report_worker(stop_event):
                         results_summary.append(f"{hit_mark} {combo} (結果:{result_str}) {'+' if profit>0 else ''}{profit}円")
 
                     if not updated: continue
-                    conn.commit()
+                    with metrics.timer("sqlite"):
+                        conn.commit()
                     
                     # 3. 集計 & 通知作成
                     month_str = date_str[:6]
+                    t_agg = time.perf_counter()
                     
                     total_profit_day = conn.execute("SELECT SUM(profit) FROM history WHERE date=? AND status='FINISHED'", (date_str,)).fetchone()[0] or 0
                     total_profit_month = conn.execute("SELECT SUM(profit) FROM history WHERE substr(date,1,6)=? AND status='FINISHED'", (month_str,)).fetchone()[0] or 0
@@ -208,6 +364,14 @@ def report_worker(stop_event):
                     hits_3t = conn.execute("SELECT COUNT(*) FROM history WHERE date=? AND ticket_type='3t' AND status='FINISHED' AND profit > 0", (date_str,)).fetchone()[0]
                     total_3t = conn.execute("SELECT COUNT(*) FROM history WHERE date=? AND ticket_type='3t' AND status='FINISHED'", (date_str,)).fetchone()[0]
                     rate_3t = (hits_3t / total_3t * 100) if total_3t > 0 else 0.0
+
+                    # 連複は買った日だけ表示する
+                    extra_lines = ""
+                    for t in ('2f', '3f'):
+                        hits_x = conn.execute("SELECT COUNT(*) FROM history WHERE date=? AND ticket_type=? AND status='FINISHED' AND profit > 0", (date_str, t)).fetchone()[0]
+                        total_x = conn.execute("SELECT COUNT(*) FROM history WHERE date=? AND ticket_type=? AND status='FINISHED'", (date_str, t)).fetchone()[0]
+                        if total_x: extra_lines += f"📊 {BET_LABELS[t]}: {hits_x}/{total_x} ({hits_x / total_x * 100:.1f}%)\n"
+                    metrics.observe("stage_seconds", time.perf_counter() - t_agg, {"stage": "sqlite"})
                     
                     # メッセージ構築
                     title_emoji = "�" if race_profit > 0 else "💀"
@@ -222,28 +386,50 @@ def report_worker(stop_event):
                         f"-------------------\n"
                         f"📊 2連単: {hits_2t}/{total_2t} ({rate_2t:.1f}%)\n"
                         f"📊 3連単: {hits_3t}/{total_3t} ({rate_3t:.1f}%)\n"
+                        f"{extra_lines}"
                         f"📅 本日: {'+' if total_profit_day>0 else ''}{total_profit_day:,}円\n"
                         f"🗓️ 今月: {'+' if total_profit_month>0 else ''}{total_profit_month:,}円"
                     )
                     
+                    metrics.inc("settled_races_total")
                     log(f"📝 結果通知: {place_name}{rno}R (収支:{race_profit}円)")
                     send_discord(msg)
                     
                 conn.close()
         except Exception as e:
             error_log(f"レポート監視エラー: {e}")
-        time.sleep(60) # 頻度調整
+        profiler.set_tag(None)
+        http_archive.sleep(60, stop_event) # 頻度調整
 
 def process_race(jcd, rno, today):
+    with metrics.timer("process_race"), profiler.tag(f"{PLACE_NAMES.get(jcd, jcd)}{rno}R"):
+        _process_race(jcd, rno, today)
+
+def _process_race(jcd, rno, today):
+    import racer_stats
+    from scraper import scrape_race_data, get_session, get_odds_map, get_odds_2tf
+    from predict_boat import predict_race, attach_reason, filter_and_sort_bets, CONF_THRESH_3T, CONF_THRESH_2T, STRATEGY_3T, STRATEGY_2T, MIN_PROB_3T, ODDS_PAGES
+    place = PLACE_NAMES.get(jcd, "不明")
     try:
         with FINISHED_RACES_LOCK:
             if (jcd, rno) in FINISHED_RACES: return
 
+        # 締切時刻が分かっている待機中のレースは、取得せずに時刻だけで判定する
+        known_deadline, state = RUN_STATE.get(today, jcd, rno)
+        due = None # 締切 (epoch秒)。取得の再試行・遮断の判断に使う
+        if known_deadline:
+            h, m = map(int, known_deadline.split(':'))
+            known_dt = now_jst().replace(hour=h, minute=m, second=0, microsecond=0)
+            due = known_dt.timestamp()
+            if state == run_state.WAIT and (known_dt - now_jst()).total_seconds() > 900:
+                with STATS_LOCK: STATS["waiting"] += 1
+                return
+
         sess = get_session()
-        place = PLACE_NAMES.get(jcd, "不明")
         
         try:
-            raw, error = scrape_race_data(sess, jcd, rno, today)
+            with http_policy.deadline(due):
+                raw, error = scrape_race_data(sess, jcd, rno, today)
         except Exception as e:
             with STATS_LOCK: STATS["errors"] += 1
             return
@@ -262,25 +448,38 @@ def process_race(jcd, rno, today):
             return
 
         try:
-            now = datetime.datetime.now(JST)
+            now = now_jst()
             h, m = map(int, deadline_str.split(':'))
             deadline_dt = now.replace(hour=h, minute=m, second=0, microsecond=0)
             
             # 締切後 (1分経過)
             if now > (deadline_dt + datetime.timedelta(minutes=1)):
                 with FINISHED_RACES_LOCK: FINISHED_RACES.add((jcd, rno))
+                RUN_STATE.mark(today, jcd, rno, run_state.CLOSED, deadline_str)
                 with STATS_LOCK: STATS["skipped"] += 1
                 return
 
             # 締切15分前より前なら待機
             delta = deadline_dt - now
             if delta.total_seconds() > 900: 
+                RUN_STATE.mark(today, jcd, rno, run_state.WAIT, deadline_str)
                 with STATS_LOCK: STATS["waiting"] += 1
                 return
+            RUN_STATE.mark(today, jcd, rno, run_state.ACTIVE, deadline_str)
         except Exception as e:
             error_log(f"時間計算エラー {place}{rno}R: {e}")
             return
 
+        # 選手別成績: 確定後に report_worker が反映できるよう出走選手を控えておく
+        with FINISHED_RACES_LOCK:
+            first = (jcd, rno) not in RACER_PENDING
+            RACER_PENDING.add((jcd, rno))
+        if first:
+            try:
+                racer_stats.get_store().register_pending(today, jcd, rno, raw, deadline_dt.timestamp())
+            except Exception as e:
+                error_log(f"選手成績の登録エラー {place}{rno}R: {e}")
+
         # 2. 予測実行
         try:
             candidates, max_conf, max_removed_prob, _ = predict_race(raw)
@@ -302,23 +501,31 @@ def process_race(jcd, rno, today):
                     # 自信度は足りているが、個別の買い目確率が基準(MIN_PROB)に届かなかった場合
                     log(f"👀 [見送り] {place}{rno}R: 組み合わせ確率不足 (AIスコア:{max_conf:.2f}OK 最大コンボ:{max_removed_prob*100:.1f}% < 基準:{min_prob_display*100:.0f}%)")
             
+            shadow.share_odds(raw, {}) # 本番はオッズを取らない (影が必要な分だけ取る)
             with STATS_LOCK: STATS["vetted"] += 1
             return
 
         # 3. オッズ取得
-        odds_2t, odds_3t = {}, {}
-        has_2t = any(c['type'] == '2t' for c in candidates)
-        has_3t = any(c['type'] == '3t' for c in candidates)
+        # 2連複のオッズも 2連単と同じ odds2tf ページから取れる
+        odds_2t, odds_2f, odds_3t = {}, {}, {}
+        has_2t = any(ODDS_PAGES[c['type']] == '2tf' for c in candidates)
+        has_3t = any(ODDS_PAGES[c['type']] == '3t' for c in candidates)
         
         try:
-            if has_2t: odds_2t = get_odds_2t(sess, jcd, rno, today)
-            if has_3t: odds_3t = get_odds_map(sess, jcd, rno, today)
+            with http_policy.deadline(deadline_dt.timestamp()):
+                if has_2t: odds_2t, odds_2f = get_odds_2tf(sess, jcd, rno, today)
+                if has_3t: odds_3t = get_odds_map(sess, jcd, rno, today)
         except Exception as e:
             error_log(f"オッズ取得例外 {place}{rno}R: {e}")
+        # 影モデルには取れたページだけ渡す (取れなかったページは影が取り直す)
+        shared = {}
+        if odds_2t: shared['2tf'] = (odds_2t, odds_2f)
+        if odds_3t: shared['3t'] = odds_3t
+        shadow.share_odds(raw, shared)
 
         # 4. EVフィルタリング
         try:
-            final_bets, max_ev, current_thresh = filter_and_sort_bets(candidates, odds_2t, odds_3t, jcd)
+            final_bets, max_ev, current_thresh = filter_and_sort_bets(candidates, odds_2t, odds_3t, jcd, odds_2f)
         except: return
 
         # --- 見送り理由ログ: 期待値(EV)不足 ---
@@ -356,7 +563,7 @@ def process_race(jcd, rno, today):
                 
                 log(f"🔥 [HIT] {place}{rno}R ({t_type.upper()}) -> {combo} ({odds_val}倍 EV:{ev_val:.2f})")
                 
-                odds_url = f"https://www.boatrace.jp/owpc/pc/race/odds{'2tf' if t_type=='2t' else '3t'}?rno={rno}&jcd={jcd:02d}&hd={today}"
+                odds_url = f"https://www.boatrace.jp/owpc/pc/race/odds{ODDS_PAGES[t_type]}?rno={rno}&jcd={jcd:02d}&hd={today}"
                 deadline_str = raw.get('deadline_time', '不明')
 
                 msg = (
@@ -368,11 +575,12 @@ def process_race(jcd, rno, today):
                     f"🔗 [オッズ確認]({odds_url})"
                 )
                 
-                conn.execute(
-                    "INSERT INTO history VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
-                    (race_id, today, place, rno, combo, 'PENDING', 0, odds_val, prob, ev_val, reason, t_type, 0.0)
-                )
-                conn.commit()
+                with metrics.timer("sqlite"):
+                    conn.execute(
+                        HISTORY_INSERT,
+                        (race_id, today, place, rno, combo, 'PENDING', 0, odds_val, prob, ev_val, reason, t_type, 0.0, p.get('model_version'))
+                    )
+                    conn.commit()
                 
                 # 書き込み確認ログ
                 try:
@@ -381,7 +589,8 @@ def process_race(jcd, rno, today):
                 except:
                     pass
 
-                send_discord(msg)
+                send_discord(msg, bet_type=t_type, deadline_ts=deadline_dt.timestamp())
+                RUN_STATE.mark(today, jcd, rno, run_state.BET)
                 with STATS_LOCK: STATS["hits"] += 1
             conn.close()
     except Exception as e:
@@ -389,18 +598,169 @@ def process_race(jcd, rno, today):
         error_log(f"CRITICAL ERROR in process_race ({place}{rno}R): {e}")
         error_log(traceback.format_exc())
 
-def main():
-    log(f"🚀 ハイブリッドAI Bot (ROI130% & 黄金律) 起動")
-    
+START_TIME = None
+MAX_RUNTIME = 20700 # 5時間45分 (GitHub Actions 6時間制限回避のため)
+
+def _stop_reason():
+    """稼働終了条件を満たしていればその旨のログ文言、満たしていなければ None"""
+    if http_archive.now() - START_TIME > MAX_RUNTIME:
+        return "🔄 稼働時間上限のため終了"
+    if http_archive.replay_finished():
+        return "🎞️ アーカイブ末尾に到達したためリプレイを終了"
+    # 夜間停止 (22:00 〜 08:00 は停止)
+    now = now_jst()
+    if now.hour >= 22 or now.hour < 8:
+        return f"🌙 夜間のため稼働を終了します ({now.strftime('%H:%M')})"
+    return None
+
+def scanner_worker(stop_event):
+    """1分ごとに全会場・全レースを走査する。稼働終了条件を満たしたら戻る"""
+    while not stop_event.is_set():
+        reason = _stop_reason()
+        if reason:
+            log(reason)
+            return
+
+        today = now_jst().strftime('%Y%m%d')
+        
+        # 統計リセット
+        with STATS_LOCK:
+            STATS["scanned"] = 0; STATS["hits"] = 0; STATS["errors"] = 0
+            STATS["skipped"] = 0; STATS["vetted"] = 0; STATS["waiting"] = 0
+
+        log(f"🔍 スキャン開始 ({today})...")
+        
+        t_cycle = time.monotonic()
+        with metrics.timer("cycle"):
+            # 実際の同時接続数は http_policy が応答状況に合わせて絞る
+            # 締切の近いレースから投入する (締切が分からないレースは従来どおり R 順で後ろ)
+            races = [(jcd, rno) for rno in range(1, 13) for jcd in range(1, 25)]
+            races.sort(key=lambda r: RUN_STATE.get(today, *r)[0] or "99:99")
+            with concurrent.futures.ThreadPoolExecutor(max_workers=http_policy.MAX_CONCURRENCY) as ex:
+                for jcd, rno in races:
+                    ex.submit(process_race, jcd, rno, today)
+        shadow.note_cycle(time.monotonic() - t_cycle)
+        path = profiler.dump()
+        if path: log(f"🔬 プロファイル出力: {path}")
+
+        with STATS_LOCK:
+            for k, v in STATS.items(): metrics.set_gauge("cycle_stats", v, {"kind": k})
+        log(f"🏁 サイクル完了: 購入={STATS['hits']}, 見送り={STATS['vetted']}, 待機={STATS['waiting']}, 締切={STATS['skipped']}")
+        try:
+            with metrics.timer("sqlite"):
+                RUN_STATE.flush()
+        except Exception as e:
+            error_log(f"進行状況の保存エラー: {e}")
+        http_archive.sleep(60, stop_event)
+
+def clock_worker(stop_event):
+    """scanner を動かさないモード用: scanner と同じ終了条件で全体を止める"""
+    while not stop_event.is_set():
+        reason = _stop_reason()
+        if reason:
+            log(reason)
+            return
+        http_archive.sleep(30, stop_event)
+
+def _load_modules(workers):
+    """モードで使う重いモジュールを読み込み、[(名前, 秒)] を返す (main 自体の import は含まない)"""
+    took = []
+    for name in dict.fromkeys(m for w in workers for m in MODE_IMPORTS[w]):
+        t0 = time.perf_counter()
+        importlib.import_module(name)
+        took.append((name, time.perf_counter() - t0))
+    return took
+
+def _max_rss_mb():
     try:
-        check_groq_setup()
-        load_models()
-        log("✅ AIモデル(2T/3T) 読み込み完了")
-    except Exception as e:
-        error_log(f"FATAL: モデル読み込みエラー: {e}")
-        sys.exit(1)
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # Linux は KB
+    except (ImportError, AttributeError):
+        return None
+
+def main(argv=None):
+    global START_TIME, RUN_MODE
+    ap = argparse.ArgumentParser(description="ハイブリッドAI Bot")
+    ap.add_argument("mode", nargs="?", choices=list(MODES), default=os.environ.get("RUN_MODE") or "all")
+    RUN_MODE = ap.parse_args(argv).mode
+    workers = MODES[RUN_MODE]
+    scan = 'scanner' in workers
+    log(f"🚀 ハイブリッドAI Bot (ROI130% & 黄金律) 起動 (モード: {RUN_MODE})")
+
+    base = _T_IMPORTED - _T_START
+    took = _load_modules(workers)
+    for name, sec in [("main", base)] + took:
+        metrics.set_gauge("import_seconds", round(sec, 4), {"module": name, "mode": RUN_MODE})
+    rss = _max_rss_mb()
+    log(f"⏱️ 読み込み時間: 計{base + sum(t for _, t in took):.2f}秒 (main {base:.2f}秒"
+        + "".join(f", {n} {t:.2f}秒" for n, t in took) + ")" + (f" / メモリ {rss:.0f}MB" if rss else ""))
+
+    if http_archive.is_replaying():
+        # オフライン再現: 外部への通知・LLM呼び出しは行わない
+        os.environ.pop("GROQ_API_KEY", None)
+        os.environ.pop("LLM_ENDPOINTS", None)
+        log(f"🎞️ リプレイモード: {http_archive.ARCHIVE_FILE} (x{http_archive.REPLAY_SPEED:g}, DB: {DB_FILE})")
+    elif http_archive.is_recording():
+        log(f"🎞️ 記録モード: {http_archive.ARCHIVE_FILE}")
+    
+    remote = None
+    if scan:
+        import predict_boat
+        try:
+            predict_boat.check_groq_setup()
+            remote = predict_boat.remote_version()
+            if remote:
+                # モデルは推論サーバー側に1つだけ。自前のモデルは接続できないときに初めて読む
+                log(f"🧠 推論サーバーを使用: {predict_boat.INFERENCE_SOCKET} (version {remote})")
+            else:
+                predict_boat.load_models()
+                log(f"✅ AIモデル(2T/3T) 読み込み完了 (version {predict_boat.MODEL_VERSION})")
+        except Exception as e:
+            error_log(f"FATAL: モデル読み込みエラー: {e}")
+            sys.exit(1)
 
+    # DB は git に載せず、db_journal/ のベース + 差分セグメントから復元する
+    journal = not http_archive.is_replaying()
+    if journal and not os.path.exists(DB_FILE) and db_journal.has_journal(DB_FILE):
+        try:
+            db_journal.rebuild(DB_FILE)
+        except Exception as e:
+            error_log(f"FATAL: DB の再構築エラー: {e}")
+            sys.exit(1)
     init_db()
+    try:
+        shadow.init_db(DB_FILE)
+        if scan and shadow.load_candidates():
+            log(f"👥 影モデル: {', '.join(c.version for c in shadow.CANDIDATES)} (CPU {shadow.SHADOW_CPU_SHARE:.0%}まで)")
+    except Exception as e:
+        error_log(f"影モデル読み込みエラー: {e}")
+    if scan or 'reporter' in workers:
+        import racer_stats
+        try:
+            store = racer_stats.init_store(DB_FILE)
+            store.drop_pending_before(now_jst().strftime('%Y%m%d'))
+            log(f"🧑‍✈️ 選手別成績: {len(store.racers):,}人分を読み込み")
+        except Exception as e:
+            error_log(f"選手成績ストア読み込みエラー: {e}")
+    try:
+        # 途中再起動でも締切済みのレースは取り直さない
+        today = now_jst().strftime('%Y%m%d')
+        n = RUN_STATE.load(today) if scan else 0
+        closed = RUN_STATE.races(today, {run_state.CLOSED})
+        with FINISHED_RACES_LOCK:
+            FINISHED_RACES.update(closed)
+            RACER_PENDING.update(RUN_STATE.races(today, {run_state.ACTIVE, run_state.BET}))
+        if n: log(f"📌 進行状況を復元: {n}R (締切済み {len(closed)}R)")
+    except Exception as e:
+        error_log(f"進行状況の復元エラー: {e}")
+    if journal:
+        try:
+            # 前回書き出せなかった変更があれば先にセグメントにしておく
+            path, n = db_journal.flush(DB_FILE)
+            if path: log(f"🧾 前回分の変更を書き出し: {n}行")
+            db_journal.install(DB_FILE)
+        except Exception as e:
+            error_log(f"ジャーナル初期化エラー: {e}")
     
     # 🐞 DBパスとレコード数確認用
     try:
@@ -424,42 +784,52 @@ def main():
         log("⚠️ Discord通知: OFF (環境変数が設定されていません)")
 
     stop_event = threading.Event()
-    t = threading.Thread(target=report_worker, args=(stop_event,), daemon=True)
-    t.start()
-    
-    start_time = time.time()
-    MAX_RUNTIME = 20700 # 5時間45分 (GitHub Actions 6時間制限回避のため)
-    
-    while True:
-        if time.time() - start_time > MAX_RUNTIME:
-            log("🔄 稼働時間上限のため終了")
-            break
-        
-        now = datetime.datetime.now(JST)
-        
-        # 夜間停止 (22:00 〜 08:00 は停止)
-        if now.hour >= 22 or now.hour < 8:
-            log(f"🌙 夜間のため稼働を終了します ({now.strftime('%H:%M')})")
-            break
-            
-        today = now.strftime('%Y%m%d')
-        
-        # 統計リセット
-        with STATS_LOCK:
-            STATS["scanned"] = 0; STATS["hits"] = 0; STATS["errors"] = 0
-            STATS["skipped"] = 0; STATS["vetted"] = 0; STATS["waiting"] = 0
+    sup = supervisor.Supervisor(log, error_log, stop_event)
 
-        log(f"🔍 スキャン開始 ({today})...")
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as ex:
-            for rno in range(1, 13):
-                for jcd in range(1, 25):
-                    ex.submit(process_race, jcd, rno, today)
+    # モデルファイルの更新を監視して無停止で差し替える (推論サーバー使用中は自前のモデルを持たないので監視しない)
+    if scan and not remote and not http_archive.is_replaying():
+        predict_boat.start_model_watcher(stop_event)
+        log(f"♻️ モデル監視: {predict_boat.MODEL_WATCH_INTERVAL:g}秒毎")
 
-        log(f"🏁 サイクル完了: 購入={STATS['hits']}, 見送り={STATS['vetted']}, 待機={STATS['waiting']}, 締切={STATS['skipped']}")
-        time.sleep(60)
+    # 計測エンドポイント (METRICS_PORT / METRICS_JSON が設定されている場合のみ)
+    try:
+        if metrics.start_metrics_server():
+            log(f"📈 メトリクス公開: http://127.0.0.1:{metrics.METRICS_PORT}/metrics")
+        if metrics.start_json_dumper(stop_event):
+            log(f"📈 メトリクスJSON出力: {metrics.METRICS_JSON} ({metrics.METRICS_JSON_INTERVAL}秒毎)")
+    except Exception as e:
+        error_log(f"メトリクス起動エラー: {e}")
 
-    stop_event.set()
+    # サンプリングプロファイラ (PROFILE=1 で起動時から / SIGUSR2 で切り替え)
+    try:
+        if profiler.install():
+            log(f"🔬 プロファイラ有効: {profiler.PROFILE_HZ:g}Hz, 1周ごとに {profiler.PROFILE_DIR}/ へ出力")
+    except Exception as e:
+        error_log(f"プロファイラ起動エラー: {e}")
+
+    # 各ワーカーは落ちてもこのプロセス内で再起動する (モデル等は読み込み済みのまま)
+    START_TIME = http_archive.now()
+    if scan: sup.add("scanner", scanner_worker, essential=True)
+    else: sup.add("clock", clock_worker, essential=True)
+    if 'reporter' in workers: sup.add("reporter", report_worker)
+    if 'notifier' in workers: sup.add("notifier", notifier_worker)
+    if shadow.CANDIDATES: sup.add("shadow", shadow.worker)
+    code = sup.run()
+    path = profiler.stop()
+    if path: log(f"🔬 プロファイル出力: {path}")
+    try:
+        if scan: RUN_STATE.flush()
+    except Exception as e:
+        error_log(f"進行状況の保存エラー: {e}")
+    if journal:
+        try:
+            path, n = db_journal.flush(DB_FILE)
+            if path: log(f"🧾 変更を書き出し: {n}行 -> {os.path.basename(path)}")
+        except Exception as e:
+            error_log(f"ジャーナル書き出しエラー: {e}")
+    if code:
+        error_log(f"致命的エラーのため終了します (exit {code})")
+        sys.exit(code)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import bisect
+import threading
+import datetime
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ==========================================
+# 📈 計測 (レイテンシヒストグラム & カウンタ)
+# ==========================================
+# STATS はサイクル毎にリセットされるため、ここでは起動からの累積値を保持する。
+# 外部ライブラリに依存しないよう、Prometheusテキスト形式は自前で出力する。
+
+PREFIX = "boatbot"
+
+# 秒単位の既定バケット (HTTP 〜 Groq まで幅広くカバー)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+# 締切までの残り時間 (秒)
+SLACK_BUCKETS = (0, 30, 60, 120, 180, 300, 450, 600, 900)
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0") or 0)   # 0 なら HTTP 公開しない
+METRICS_JSON = os.environ.get("METRICS_JSON", "")               # 空なら JSON ダンプしない
+METRICS_JSON_INTERVAL = int(os.environ.get("METRICS_JSON_INTERVAL", "60") or 60)
+
+_LOCK = threading.Lock()
+_COUNTERS = {}    # (name, labels) -> value
+_GAUGES = {}      # (name, labels) -> value
+_HISTOGRAMS = {}  # (name, labels) -> {"buckets": tuple, "counts": list, "sum": float, "count": int}
+_STARTED_AT = time.time()
+
+def _key(name, labels):
+    return (name, tuple(sorted((labels or {}).items())))
+
+def inc(name, labels=None, value=1):
+    """カウンタを加算する"""
+    k = _key(name, labels)
+    with _LOCK:
+        _COUNTERS[k] = _COUNTERS.get(k, 0) + value
+
+def set_gauge(name, value, labels=None):
+    k = _key(name, labels)
+    with _LOCK:
+        _GAUGES[k] = value
+
+def observe(name, value, labels=None, buckets=LATENCY_BUCKETS):
+    """ヒストグラムに1件記録する"""
+    k = _key(name, labels)
+    with _LOCK:
+        h = _HISTOGRAMS.get(k)
+        if h is None:
+            h = {"buckets": tuple(buckets), "counts": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0}
+            _HISTOGRAMS[k] = h
+        idx = len(h["buckets"])
+        for i, b in enumerate(h["buckets"]):
+            if value <= b:
+                idx = i
+                break
+        h["counts"][idx] += 1
+        h["sum"] += value
+        h["count"] += 1
+
+def observe_many(name, values, labels=None, buckets=LATENCY_BUCKETS):
+    """ヒストグラムに複数件まとめて記録する (ロックは1回)"""
+    k = _key(name, labels)
+    with _LOCK:
+        h = _HISTOGRAMS.get(k)
+        if h is None:
+            h = {"buckets": tuple(buckets), "counts": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0}
+            _HISTOGRAMS[k] = h
+        for value in values:
+            h["counts"][bisect.bisect_left(h["buckets"], value)] += 1
+            h["sum"] += value
+        h["count"] += len(values)
+
+@contextmanager
+def timer(stage):
+    """with timer("http"): ... で stage_seconds{stage=...} に所要時間を記録する"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("stage_seconds", time.perf_counter() - t0, {"stage": stage})
+
+def snapshot():
+    """現在の計測値を JSON 化可能な辞書で返す"""
+    with _LOCK:
+        counters = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in _COUNTERS.items()]
+        gauges = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in _GAUGES.items()]
+        hists = []
+        for (n, l), h in _HISTOGRAMS.items():
+            hists.append({
+                "name": n, "labels": dict(l),
+                "buckets": list(h["buckets"]), "counts": list(h["counts"]),
+                "sum": h["sum"], "count": h["count"],
+            })
+    return {
+        "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "uptime_sec": round(time.time() - _STARTED_AT, 1),
+        "counters": counters, "gauges": gauges, "histograms": hists,
+    }
+
+def _esc(v):
+    return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _fmt_labels(labels, extra=None):
+    items = list(labels) + list((extra or {}).items())
+    if not items: return ""
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in items) + "}"
+
+def render_prometheus():
+    """Prometheus テキスト形式 (0.0.4) で出力する"""
+    lines = []
+    with _LOCK:
+        typed = set()
+        for (n, l), v in sorted(_COUNTERS.items()):
+            full = f"{PREFIX}_{n}"
+            if full not in typed:
+                lines.append(f"# TYPE {full} counter"); typed.add(full)
+            lines.append(f"{full}{_fmt_labels(l)} {v}")
+        for (n, l), v in sorted(_GAUGES.items()):
+            full = f"{PREFIX}_{n}"
+            if full not in typed:
+                lines.append(f"# TYPE {full} gauge"); typed.add(full)
+            lines.append(f"{full}{_fmt_labels(l)} {v}")
+        for (n, l), h in sorted(_HISTOGRAMS.items()):
+            full = f"{PREFIX}_{n}"
+            if full not in typed:
+                lines.append(f"# TYPE {full} histogram"); typed.add(full)
+            cum = 0
+            for b, c in zip(h["buckets"], h["counts"]):
+                cum += c
+                lines.append(f"{full}_bucket{_fmt_labels(l, {'le': b})} {cum}")
+            lines.append(f"{full}_bucket{_fmt_labels(l, {'le': '+Inf'})} {h['count']}")
+            lines.append(f"{full}_sum{_fmt_labels(l)} {h['sum']:.6f}")
+            lines.append(f"{full}_count{_fmt_labels(l)} {h['count']}")
+    return "\n".join(lines) + "\n"
+
+def dump_json(path=None):
+    path = path or METRICS_JSON
+    if not path: return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body = json.dumps(snapshot(), ensure_ascii=False).encode("utf-8")
+            ctype = "application/json; charset=utf-8"
+        elif self.path.startswith("/metrics"):
+            body = render_prometheus().encode("utf-8")
+            ctype = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            self.send_response(404); self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass # アクセスログは出さない
+
+def start_metrics_server(port=None, host="127.0.0.1"):
+    """ローカル専用の /metrics エンドポイントを起動する (port=0 なら何もしない)"""
+    port = METRICS_PORT if port is None else port
+    if not port: return None
+    srv = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+def start_json_dumper(stop_event, path=None, interval=None):
+    """一定間隔で JSON ダンプするスレッドを起動する"""
+    path = path or METRICS_JSON
+    interval = interval or METRICS_JSON_INTERVAL
+    if not path: return None
+
+    def _loop():
+        while not stop_event.wait(interval):
+            try: dump_json(path)
+            except Exception as e: print(f"⚠️ メトリクスJSON出力エラー: {e}")
+        try: dump_json(path)
+        except Exception: pass
+
+    t = threading.Thread(target=_loop, daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,324 @@
+import argparse
+import datetime
+import random
+import threading
+import time
+from itertools import permutations, combinations
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# ==========================================
+# 🧪 boatrace.jp 代替サーバー (負荷試験・障害注入用)
+# ==========================================
+# racelist / beforeinfo / odds3t / odds2tf / raceresult を合成データから生成する。
+# HTML は scraper.py のパーサが読む構造だけを再現している。
+#
+#   python mock_boatrace.py --port 8765 --latency 0.2 --error-rate 0.05
+#   BOATRACE_BASE_URL=http://127.0.0.1:8765/owpc/pc/race python main.py
+
+JST = datetime.timezone(datetime.timedelta(hours=9), 'JST')
+PATH_PREFIX = "/owpc/pc/race/"
+NO_DATA_HTML = "<html><body><p>データがありません。</p></body></html>"
+
+class MockConfig:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, not_found_rate=0.0, no_data_rate=0.0,
+                 odds_churn=0.0, first_deadline_min=5, interval_min=3, result_delay_min=2, seed=0):
+        self.latency = latency                    # 平均遅延 (秒)
+        self.jitter = jitter                      # 遅延のゆらぎ (秒, 一様分布)
+        self.error_rate = error_rate              # 500 を返す確率
+        self.not_found_rate = not_found_rate      # 404 を返す確率
+        self.no_data_rate = no_data_rate          # 「データがありません」を返す確率
+        self.odds_churn = odds_churn              # 取得毎のオッズ変動幅 (0.1 = ±10%)
+        self.first_deadline_min = first_deadline_min  # 起動から1Rの締切まで (分)
+        self.interval_min = interval_min          # 各Rの締切間隔 (分)
+        self.result_delay_min = result_delay_min  # 締切から結果公開まで (分)
+        self.seed = seed
+        self.started_at = datetime.datetime.now(JST)
+
+# ------------------------------------------
+# 合成レースデータ
+# ------------------------------------------
+def synth_race(cfg, date_str, jcd, rno):
+    """(日付, 会場, R) ごとに決定的な出走表を作る"""
+    rng = random.Random(f"{cfg.seed}:{date_str}:{jcd}:{rno}")
+    boats = []
+    for i in range(1, 7):
+        boats.append({
+            'pid': rng.randint(3000, 5299),
+            'wr': round(rng.uniform(3.0, 8.0) + (0.8 if i == 1 else 0.0), 2),
+            'mo': round(rng.uniform(25.0, 60.0), 2),
+            'ex': round(rng.uniform(6.60, 6.95), 2),
+            'st': round(rng.uniform(0.10, 0.22), 2),
+            'f': 1 if rng.random() < 0.05 else 0,
+        })
+    # 強さ (着順・オッズ生成用)
+    strength = [b['wr'] * 1.5 - (b['ex'] - 6.6) * 10 + (3.0 if i == 0 else 0.0) for i, b in enumerate(boats)]
+    order = sorted(range(6), key=lambda i: strength[i] + rng.gauss(0, 2.0), reverse=True)
+    return {'boats': boats, 'strength': strength, 'wind': rng.randint(0, 7), 'order': [o + 1 for o in order]}
+
+def deadline_of(cfg, rno):
+    return cfg.started_at + datetime.timedelta(minutes=cfg.first_deadline_min + (rno - 1) * cfg.interval_min)
+
+def _weights(race):
+    w = [2.0 ** (s / 3.0) for s in race['strength']]
+    tot = sum(w)
+    return [x / tot for x in w]
+
+def synth_odds_3t(cfg, race, rng):
+    w = _weights(race)
+    odds = {}
+    for i, j, k in permutations(range(6), 3):
+        p = w[i] * w[j] / (1 - w[i]) * w[k] / (1 - w[i] - w[j])
+        o = 0.75 / max(p, 1e-6)
+        if cfg.odds_churn: o *= 1 + rng.uniform(-cfg.odds_churn, cfg.odds_churn)
+        odds[(i + 1, j + 1, k + 1)] = round(min(max(o, 1.0), 9999.0), 1)
+    return odds
+
+def synth_odds_2t(cfg, race, rng):
+    w = _weights(race)
+    odds = {}
+    for i, j in permutations(range(6), 2):
+        p = w[i] * w[j] / (1 - w[i])
+        o = 0.75 / max(p, 1e-6)
+        if cfg.odds_churn: o *= 1 + rng.uniform(-cfg.odds_churn, cfg.odds_churn)
+        odds[(i + 1, j + 1)] = round(min(max(o, 1.0), 9999.0), 1)
+    return odds
+
+def synth_odds_2f(cfg, race, rng):
+    w = _weights(race)
+    odds = {}
+    for i, j in combinations(range(6), 2):
+        p = w[i] * w[j] / (1 - w[i]) + w[j] * w[i] / (1 - w[j])
+        o = 0.75 / max(p, 1e-6)
+        if cfg.odds_churn: o *= 1 + rng.uniform(-cfg.odds_churn, cfg.odds_churn)
+        odds[(i + 1, j + 1)] = round(min(max(o, 1.0), 9999.0), 1)
+    return odds
+
+def synth_odds_3f(cfg, race, rng):
+    w = _weights(race)
+    odds = {}
+    for trio in combinations(range(6), 3):
+        p = sum(w[i] * w[j] / (1 - w[i]) * w[k] / (1 - w[i] - w[j]) for i, j, k in permutations(trio))
+        o = 0.75 / max(p, 1e-6)
+        if cfg.odds_churn: o *= 1 + rng.uniform(-cfg.odds_churn, cfg.odds_churn)
+        odds[tuple(b + 1 for b in trio)] = round(min(max(o, 1.0), 9999.0), 1)
+    return odds
+
+# ------------------------------------------
+# HTML 生成
+# ------------------------------------------
+def _deadline_table(cfg):
+    cells = "".join(f"<td>{deadline_of(cfg, r).strftime('%H:%M')}</td>" for r in range(1, 13))
+    return f"<table><tbody><tr><th>締切予定時刻</th>{cells}</tr></tbody></table>"
+
+def _pad(html):
+    # 本物のページと同程度の大きさにして SMALL_CONTENT 判定を避ける
+    return f"<html><head><title>BOATRACE</title></head><body>{html}<!-- {'x' * 600} --></body></html>"
+
+def html_racelist(cfg, race):
+    parts = [_deadline_table(cfg), "<table>"]
+    for b in race['boats']:
+        # パーサの正規表現順 (登録番号 → 勝率 → ST → モーター) に合わせ、空白で区切って並べる
+        f_txt = f"F{b['f']}" if b['f'] else ""
+        parts.append(
+            f"<tbody class=\"is-fs12\"><tr><td>{b['pid']} </td><td>{f_txt} </td>"
+            f"<td>{b['wr']:.2f} </td><td>{b['st']:.2f} </td><td>{b['mo']:.2f} </td></tr></tbody>"
+        )
+    parts.append("</table>")
+    return _pad("".join(parts))
+
+def html_beforeinfo(cfg, race):
+    rows = "".join(
+        f"<tr><td class=\"is-boatColor{i}\">{i}</td><td>{b['ex']:.2f}</td></tr>"
+        for i, b in enumerate(race['boats'], start=1)
+    )
+    wind = (f"<div class=\"weather1_bodyUnit is-windDirection\">"
+            f"<span class=\"weather1_bodyUnitLabelData\">{race['wind']}m</span></div>")
+    return _pad(_deadline_table(cfg) + wind + f"<table><tbody>{rows}</tbody></table>")
+
+def html_odds3t(odds):
+    rows = []
+    for r in range(20):
+        j_idx, k_idx = divmod(r, 4)
+        cells = []
+        for first in range(1, 7):
+            seconds = [b for b in range(1, 7) if b != first]
+            second = seconds[j_idx]
+            thirds = [b for b in range(1, 7) if b not in (first, second)]
+            third = thirds[k_idx]
+            if k_idx == 0:
+                cells.append(f"<td rowspan=\"4\">{second}</td>")
+            cells.append(f"<td>{third}</td><td class=\"oddsPoint\">{odds[(first, second, third)]}</td>")
+        rows.append("<tr>" + "".join(cells) + "</tr>")
+    return _pad(f"<div class=\"table1\"><table><tbody>{''.join(rows)}</tbody></table></div>")
+
+def html_odds2tf(odds, odds_2f=None):
+    rows = []
+    for r in range(5):
+        cells = []
+        for first in range(1, 7):
+            second = [b for b in range(1, 7) if b != first][r]
+            cells.append(f"<td class=\"numberSet1_number\">{second}</td><td class=\"oddsPoint\">{odds[(first, second)]}</td>")
+        rows.append("<tr>" + "".join(cells) + "</tr>")
+    html = f"<div class=\"table1\"><table><tbody>{''.join(rows)}</tbody></table></div>"
+    if odds_2f is None: return _pad(html)
+    # 本物と同じく 2連単 の下に 2連複 の表 (相手は大きい艇番だけ、残りは空きセル)
+    rows = []
+    for r in range(5):
+        cells = []
+        for first in range(1, 7):
+            seconds = [b for b in range(first + 1, 7)]
+            if r < len(seconds):
+                cells.append(f"<td class=\"numberSet1_number\">{seconds[r]}</td><td class=\"oddsPoint\">{odds_2f[(first, seconds[r])]}</td>")
+            else:
+                cells.append("<td class=\"is-disabled\"></td><td class=\"is-disabled\"></td>")
+        rows.append("<tr>" + "".join(cells) + "</tr>")
+    title = "<div class=\"title7\"><span class=\"title7_mainLabel\">{}</span></div>"
+    return _pad(title.format("2連単オッズ") + html + title.format("2連複オッズ")
+                + f"<div class=\"table1\"><table><tbody>{''.join(rows)}</tbody></table></div>")
+
+def html_raceresult(race, odds_2t, odds_3t, odds_2f, odds_3f):
+    o = race['order']
+    pay_3t = int(odds_3t[(o[0], o[1], o[2])] * 100)
+    pay_2t = int(odds_2t[(o[0], o[1])] * 100)
+    pay_3f = int(odds_3f[tuple(sorted(o[:3]))] * 100)
+    pay_2f = int(odds_2f[tuple(sorted(o[:2]))] * 100)
+    def row(label, nums, pay):
+        spans = "".join(f"<span class=\"numberSet1_number\">{n}</span>" for n in nums)
+        return f"<tr><td>{label}</td><td>{spans}</td><td>¥{pay:,}</td></tr>"
+    return _pad(
+        "<table class=\"is-w495\"><tbody>"
+        + row("3連単", o[:3], pay_3t) + row("3連複", sorted(o[:3]), pay_3f)
+        + row("2連単", o[:2], pay_2t) + row("2連複", sorted(o[:2]), pay_2f)
+        + "</tbody></table>"
+    )
+
+# ------------------------------------------
+# HTTP サーバー
+# ------------------------------------------
+class MockBoatraceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, cfg):
+        super().__init__(addr, _Handler)
+        self.cfg = cfg
+        self.rng = random.Random(cfg.seed)
+        self.rng_lock = threading.Lock()
+        self.counts = {}
+        self.counts_lock = threading.Lock()
+
+    def count(self, key):
+        with self.counts_lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def roll(self):
+        with self.rng_lock:
+            return self.rng.random()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{PATH_PREFIX.rstrip('/')}"
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        srv, cfg = self.server, self.server.cfg
+        u = urlparse(self.path)
+        page = u.path[len(PATH_PREFIX):] if u.path.startswith(PATH_PREFIX) else ""
+        q = parse_qs(u.query)
+        try:
+            rno, jcd, hd = int(q["rno"][0]), int(q["jcd"][0]), q["hd"][0]
+        except (KeyError, ValueError):
+            return self._send(404, NO_DATA_HTML, "bad_request")
+
+        if cfg.latency or cfg.jitter:
+            time.sleep(max(0.0, cfg.latency + (srv.roll() * 2 - 1) * cfg.jitter))
+
+        roll = srv.roll()
+        if roll < cfg.error_rate:
+            return self._send(500, "<html>Internal Server Error</html>", "error_500")
+        roll -= cfg.error_rate
+        if roll < cfg.not_found_rate:
+            return self._send(404, NO_DATA_HTML, "error_404")
+        roll -= cfg.not_found_rate
+        if roll < cfg.no_data_rate:
+            return self._send(200, NO_DATA_HTML, "no_data")
+
+        race = synth_race(cfg, hd, jcd, rno)
+        with srv.rng_lock:
+            churn_rng = random.Random(srv.rng.random())
+
+        if page == "racelist":
+            body = html_racelist(cfg, race)
+        elif page == "beforeinfo":
+            body = html_beforeinfo(cfg, race)
+        elif page == "odds3t":
+            body = html_odds3t(synth_odds_3t(cfg, race, churn_rng))
+        elif page == "odds2tf":
+            body = html_odds2tf(synth_odds_2t(cfg, race, churn_rng), synth_odds_2f(cfg, race, churn_rng))
+        elif page == "raceresult":
+            published = deadline_of(cfg, rno) + datetime.timedelta(minutes=cfg.result_delay_min)
+            if datetime.datetime.now(JST) < published:
+                return self._send(200, NO_DATA_HTML, "result_pending")
+            # 払戻金は確定オッズ (変動なし) から作る
+            fixed = random.Random(0)
+            body = html_raceresult(race, synth_odds_2t(cfg, race, fixed), synth_odds_3t(cfg, race, fixed),
+                                   synth_odds_2f(cfg, race, fixed), synth_odds_3f(cfg, race, fixed))
+        else:
+            return self._send(404, NO_DATA_HTML, "unknown_page")
+        self._send(200, body, page)
+
+    def _send(self, code, html, key):
+        self.server.count(key)
+        data = html.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, fmt, *args):
+        pass
+
+def start_server(cfg, host="127.0.0.1", port=0):
+    """バックグラウンドスレッドで代替サーバーを起動する (port=0 なら空きポート)"""
+    srv = MockBoatraceServer((host, port), cfg)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+def add_config_args(ap):
+    ap.add_argument("--latency", type=float, default=0.0, help="平均遅延 (秒)")
+    ap.add_argument("--jitter", type=float, default=0.0, help="遅延のゆらぎ (秒)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="HTTP 500 の確率")
+    ap.add_argument("--not-found-rate", type=float, default=0.0, help="HTTP 404 の確率")
+    ap.add_argument("--no-data-rate", type=float, default=0.0, help="「データがありません」の確率")
+    ap.add_argument("--odds-churn", type=float, default=0.0, help="取得毎のオッズ変動幅 (0.1=±10%%)")
+    ap.add_argument("--first-deadline-min", type=float, default=5, help="1R締切までの分数")
+    ap.add_argument("--interval-min", type=float, default=3, help="各Rの締切間隔 (分)")
+    ap.add_argument("--result-delay-min", type=float, default=2, help="締切から結果公開までの分数")
+    ap.add_argument("--seed", type=int, default=0)
+
+def config_from_args(args):
+    return MockConfig(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        not_found_rate=args.not_found_rate, no_data_rate=args.no_data_rate, odds_churn=args.odds_churn,
+        first_deadline_min=args.first_deadline_min, interval_min=args.interval_min,
+        result_delay_min=args.result_delay_min, seed=args.seed,
+    )
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="boatrace.jp 代替サーバー")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    add_config_args(ap)
+    args = ap.parse_args()
+
+    srv = MockBoatraceServer((args.host, args.port), config_from_args(args))
+    print(f"🧪 代替サーバー起動: BOATRACE_BASE_URL={srv.base_url}")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"📊 応答内訳: {srv.counts}")
@@ -0,0 +1,127 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ==========================================
+# 🧪 OpenAI 互換 LLM の代替サーバー (解説生成の試験用)
+# ==========================================
+# /v1/models と /v1/chat/completions だけを実装する。モデルごとに遅延・エラー・429 を注入できる。
+# 解説はプロンプト中の買い目 ("- 1-2-3: ...") ごとに1行の定型文を返す。
+#
+#   python mock_llm.py --port 8766 --model mock-fast:0.2 --model mock-slow:6 --model mock-limited:0.3:0:1.0
+#   LLM_ENDPOINTS='[{"base_url": "http://127.0.0.1:8766/v1", "model": "mock-fast", "api_key_env": "MOCK_LLM_KEY"}, ...]'
+#   MOCK_LLM_KEY=x python main.py
+
+class MockModel:
+    def __init__(self, name, latency=0.0, error_rate=0.0, rate_limit_rate=0.0):
+        self.name = name
+        self.latency = latency                  # 応答までの秒数
+        self.error_rate = error_rate            # 500 を返す確率
+        self.rate_limit_rate = rate_limit_rate  # 429 を返す確率
+
+    @classmethod
+    def parse(cls, spec):
+        """'名前[:遅延[:エラー率[:429率]]]'"""
+        name, *rest = spec.split(":")
+        return cls(name, *[float(x) for x in rest])
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, models, seed=0):
+        super().__init__(addr, _Handler)
+        self.models = {m.name: m for m in models}
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.counts = {}
+
+    def roll(self):
+        with self.rng_lock:
+            return self.rng.random()
+
+    def count(self, key):
+        with self.rng_lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+def _comments(prompt):
+    combos = re.findall(r"-\s*([1-6][-=][1-6](?:[-=][1-6])?):", prompt)
+    return "\n".join(f"{c}: 展示気配が良く、穴目としても妙味あり。" for c in combos) or "解説なし"
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            data = [{"id": n, "object": "model", "owned_by": "mock"} for n in self.server.models]
+            return self._json(200, {"object": "list", "data": data})
+        self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        srv = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            return self._json(404, {"error": {"message": "not found"}})
+        m = srv.models.get(body.get("model"))
+        if m is None:
+            return self._json(404, {"error": {"message": f"model not found: {body.get('model')}"}})
+        roll = srv.roll()
+        if roll < m.rate_limit_rate:
+            srv.count(f"{m.name}:429")
+            return self._json(429, {"error": {"message": "rate limited"}}, {"Retry-After": "30"})
+        time.sleep(m.latency)
+        if srv.roll() < m.error_rate:
+            srv.count(f"{m.name}:500")
+            return self._json(500, {"error": {"message": "internal error"}})
+        srv.count(f"{m.name}:ok")
+        prompt = " ".join(str(msg.get("content", "")) for msg in body.get("messages", []))
+        self._json(200, {
+            "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": m.name,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": _comments(prompt)}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def _json(self, code, obj, headers=None):
+        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        try:
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items(): self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass # クライアントがタイムアウトで切断済み
+
+    def log_message(self, fmt, *args):
+        pass
+
+def start_server(models, host="127.0.0.1", port=0):
+    """バックグラウンドスレッドで代替サーバーを起動する (port=0 なら空きポート)"""
+    srv = MockLLMServer((host, port), models)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="OpenAI 互換 LLM の代替サーバー")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8766)
+    ap.add_argument("--model", action="append", default=None, help="名前[:遅延[:エラー率[:429率]]] (複数可)")
+    args = ap.parse_args()
+
+    srv = MockLLMServer((args.host, args.port), [MockModel.parse(s) for s in (args.model or ["mock-fast:0.2"])])
+    print(f"🧪 LLM 代替サーバー起動: {srv.base_url} (モデル: {', '.join(srv.models)})")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"📊 応答内訳: {srv.counts}")
@@ -1,9 +1,19 @@
-import pandas as pd
 import numpy as np
 import lightgbm as lgb
 import os
 import joblib
-from itertools import permutations
+import json
+import time
+import hashlib
+import threading
+import collections
+import metrics
+import llm_router
+import racer_stats
+import drift_monitor
+import harville
+import shadow
+from features import FEATURES, FEATURES_2T, RACER_FEATURES, add_racer_features, boat_arrays, frame_from_arrays
 
 # ==========================================
 # ⚙️ 設定: 攻めの穴狙い設定
@@ -80,215 +90,435 @@ STRATEGY_2T = {
     24: {'ev_thresh': 99.9}, # 大村 (見送り)
 }
 
+# --- 二連複 (2F) 設定 ---
+# 確率は 2T のモデルの順列確率を組ごとに足したもの (追加の推論なし)、オッズは 2連単と同じ
+# odds2tf ページの 2連複 の表。会場別の閾値はバックテストで決めるまで空 (どの会場も見送り)。
+# 3連複 (3F) のオッズは取得済みのページに無いため買い目にはしない (確率は harville.unordered で出せる)。
+
+MIN_PROB_2F = 0.02
+ODDS_CAP_2F = 50.0
+MAX_BETS_2F = 2
+
+STRATEGY_2F = {}
+
+# 券種ごとの表示名 (3連複は以前の購入分の確定用) と、オッズが載っているページ (odds{ページ})
+BET_LABELS = {'3t': "3連単", '2t': "2連単", '3f': "3連複", '2f': "2連複"}
+ODDS_PAGES = {'3t': "3t", '2t': "2tf", '2f': "2tf"}
+
 # ==========================================
-# 🤖 Groq 設定
+# 🤖 解説用 LLM (llm_router で速いモデルに振り分け)
 # ==========================================
-OPENAI_AVAILABLE = False
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    pass
-
-_GROQ_CLIENT = None
-
-def get_groq_client():
-    global _GROQ_CLIENT
-    if not OPENAI_AVAILABLE:
-        print("⚠️ Groq Error: 'openai' module not found. pip install openai")
-        return None
-    if _GROQ_CLIENT is None:
-        api_key = os.environ.get("GROQ_API_KEY")
-        if not api_key:
-            print("⚠️ Groq Error: GROQ_API_KEY env var not found.")
-            return None
-        try:
-            _GROQ_CLIENT = OpenAI(
-                base_url="https://api.groq.com/openai/v1",
-                api_key=api_key,
-                max_retries=3, 
-                timeout=20.0
-            )
-        except Exception as e:
-            print(f"⚠️ Groq Init Error: {e}")
-            return None
-    return _GROQ_CLIENT
-
 def check_groq_setup():
-    """起動時にGroqの設定を確認する"""
-    print("🤖 Groqセットアップ確認中...")
-    if not OPENAI_AVAILABLE:
+    """起動時に解説用 LLM の設定を確認する"""
+    print("🤖 LLMセットアップ確認中...")
+    if not llm_router.OPENAI_AVAILABLE:
         print("❌ 'openai' ライブラリが見つかりません。")
         return
-    
-    api_key = os.environ.get("GROQ_API_KEY")
-    if not api_key:
-        print("❌ 環境変数 GROQ_API_KEY が設定されていません。")
+    router = llm_router.get_router()
+    if not router:
+        print("❌ 解説用 LLM の APIキーが設定されていません (GROQ_API_KEY / LLM_ENDPOINTS)。解説は定型文になります。")
         return
-    
-    client = get_groq_client()
-    if client:
-        print("✅ Groqクライアント初期化成功")
-    else:
-        print("❌ Groqクライアント初期化失敗")
+    print(f"✅ 解説用 LLM: {', '.join(e.name for e in router.endpoints)} (1件あたり最大 {llm_router.LLM_BUDGET_SEC:g}秒)")
 
 # ==========================================
 # 📂 モデル管理 (2T:単一ファイル, 3T:一括pkl)
 # ==========================================
 MODELS_3T = None # 会場別辞書
 MODEL_2T = None  # 単一モデル
+MODEL_VERSION = None # 読み込み中のモデルの版 (history に記録する)
 
 FILE_3T = "boatrace_models_all.pkl"
 FILE_2T = "boatrace_model_2t.txt"
+MANIFEST_FILE = "models_manifest.json" # train_models.py が出力する
 
-def load_models():
-    """起動時に2つのモデルを読み込む"""
-    global MODELS_3T, MODEL_2T
-    
+# 差し替えは (MODELS_3T, MODEL_2T, MODEL_VERSION) を1回の代入でまとめて行う。
+# 予測側は開始時にこの3つを一度だけ読むので、実行中の予測は旧版のまま最後まで走る。
+_MODEL_LOCK = threading.Lock()
+MODEL_WATCH_INTERVAL = float(os.environ.get("MODEL_WATCH_INTERVAL", "30"))
+_SMOKE_RAWS = collections.deque(maxlen=20) # 直近の実レース入力 (差し替え前の検証に使う)
+
+def _file_sig(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+def _files_sig():
+    return tuple(_file_sig(p) for p in (FILE_2T, FILE_3T, MANIFEST_FILE))
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""): h.update(chunk)
+    return h.hexdigest()
+
+def _manifest_version(shas):
+    """マニフェストの version。載っているファイルのハッシュが1つでも食い違えば None"""
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        models = manifest.get('models', {})
+        if all(m.get('sha256') == shas.get(m.get('file')) for m in (models.get(k, {}) for k in ('2t', '3t')) if m.get('file')):
+            return manifest['version']
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def _model_version():
+    """マニフェストの version (ファイルのハッシュが一致する場合)。なければファイルのハッシュから作る"""
+    shas = {f: _sha256(f) for f in (FILE_2T, FILE_3T) if os.path.exists(f)}
+    return _manifest_version(shas) or "file-" + "".join(shas.get(f, "000000")[:6] for f in (FILE_2T, FILE_3T))
+
+def _read_model_files(strict=False):
+    """モデルファイルを読み込んで (3T辞書, 2Tモデル, 版) を返す (グローバルは触らない)。
+    strict なら、ファイルがあるのに読めない (壊れている・コピー途中) ときは例外を投げる"""
+    models_3t, model_2t = {}, None
     # --- 3連単 (会場別pkl) ---
-    if MODELS_3T is None:
-        if os.path.exists(FILE_3T):
-            try:
-                print(f"📂 3Tモデル読み込み中: {FILE_3T}")
-                MODELS_3T = joblib.load(FILE_3T)
-                print("✅ 3Tモデル読み込み完了")
-            except Exception as e:
-                print(f"❌ 3Tモデル読み込みエラー: {e}")
-                MODELS_3T = {}
-        else:
-            print(f"⚠️ 3Tモデルなし: {FILE_3T}")
-            MODELS_3T = {}
+    if os.path.exists(FILE_3T):
+        try:
+            print(f"📂 3Tモデル読み込み中: {FILE_3T}")
+            models_3t = joblib.load(FILE_3T)
+            print("✅ 3Tモデル読み込み完了")
+        except Exception as e:
+            print(f"❌ 3Tモデル読み込みエラー: {e}")
+            if strict: raise
+            models_3t = {}
+    else:
+        print(f"⚠️ 3Tモデルなし: {FILE_3T}")
 
     # --- 2連単 (全体txt) ---
-    if MODEL_2T is None:
-        if os.path.exists(FILE_2T):
-            try:
-                print(f"📂 2Tモデル読み込み中: {FILE_2T}")
-                MODEL_2T = lgb.Booster(model_file=FILE_2T)
-                print("✅ 2Tモデル読み込み完了")
-            except Exception as e:
-                print(f"❌ 2Tモデル読み込みエラー: {e}")
-                MODEL_2T = None
-        else:
-            print(f"⚠️ 2Tモデルなし: {FILE_2T}")
-            MODEL_2T = None
+    if os.path.exists(FILE_2T):
+        try:
+            print(f"📂 2Tモデル読み込み中: {FILE_2T}")
+            model_2t = lgb.Booster(model_file=FILE_2T)
+            print("✅ 2Tモデル読み込み完了")
+        except Exception as e:
+            print(f"❌ 2Tモデル読み込みエラー: {e}")
+            if strict: raise
+            model_2t = None
+    else:
+        print(f"⚠️ 2Tモデルなし: {FILE_2T}")
+    return models_3t, model_2t, _model_version()
 
-def get_3t_model(jcd):
-    global MODELS_3T
+def load_models():
+    """起動時に2つのモデルを読み込む"""
+    global MODELS_3T, MODEL_2T, MODEL_VERSION
+    if MODELS_3T is not None and MODEL_2T is not None: return
+    models_3t, model_2t, version = _read_model_files()
+    with _MODEL_LOCK:
+        if MODELS_3T is None: MODELS_3T = models_3t
+        if MODEL_2T is None: MODEL_2T = model_2t
+        MODEL_VERSION = version
+    metrics.set_gauge("model_info", 1, {"version": version})
+
+def current_models():
+    """(3T辞書, 2Tモデル, 版) をまとめて取得する"""
     if MODELS_3T is None: load_models()
-    return MODELS_3T.get(jcd)
+    with _MODEL_LOCK:
+        return MODELS_3T, MODEL_2T, MODEL_VERSION
+
+def get_3t_model(jcd):
+    return current_models()[0].get(jcd)
 
 def get_2t_model():
-    global MODEL_2T
-    if MODEL_2T is None: load_models()
-    return MODEL_2T
+    return current_models()[1]
+
+# ------------------------------------------
+# ♻️ ホットリロード (無停止差し替え)
+# ------------------------------------------
+def _smoke_batch():
+    raws = list(_SMOKE_RAWS)
+    if raws: return raws
+    # まだ実レースを見ていなければ固定の1レースで確認する
+    raw = {'jcd': 1, 'wind': 2.0}
+    for i in range(1, 7):
+        raw.update({f'pid{i}': 4000 + i, f'wr{i}': 7.0 - i * 0.5, f'mo{i}': 35.0, f'ex{i}': 6.70 + i * 0.02,
+                    f'st{i}': 0.15, f'f{i}': 0})
+    return [raw]
+
+def validate_models(models_3t, model_2t):
+    """新モデルで予測が通り、確率として妥当かを確認する。問題があれば例外"""
+    if model_2t is None and not models_3t:
+        raise ValueError("モデルが1つもありません")
+    for raw in _smoke_batch():
+        probs = predict_probs(raw, (models_3t, model_2t))
+        if probs is None: continue
+        probs_3t, _, probs_2t = probs
+        for name, p, size in (("3T", probs_3t, len(COMBOS_3T)), ("2T", probs_2t, len(COMBOS_2T))):
+            if p is None: continue
+            if p.shape != (size,) or not np.all(np.isfinite(p)) or p.min() < 0 or p.max() > 1.0:
+                raise ValueError(f"{name}確率が不正です (jcd={raw.get('jcd')})")
+        if int(raw.get('jcd', 0)) in models_3t and probs_3t is None:
+            raise ValueError(f"3T予測に失敗しました (jcd={raw.get('jcd')})")
+        if model_2t is not None and probs_2t is None:
+            raise ValueError("2T予測に失敗しました")
+
+def _dropped_models(models_3t, model_2t):
+    """今読み込んでいるのに新しい組に無いもの ("2T" / 3T の会場番号) の一覧"""
+    with _MODEL_LOCK:
+        cur_3t, cur_2t = MODELS_3T or {}, MODEL_2T
+    dropped = ["2T"] if cur_2t is not None and model_2t is None else []
+    return dropped + [f"3T(jcd={j})" for j in sorted(set(cur_3t) - set(models_3t or {}))]
 
-def to_float(val):
+def reload_models():
+    """モデルファイルを読み直し、検証に通れば差し替える。差し替えたら True"""
+    global MODELS_3T, MODEL_2T, MODEL_VERSION
+    # 推論サーバーを使っている間は自前のモデルを持たない (読み込むとホスト1つ分の節約が無駄になる)
+    if MODEL_VERSION is None: return False
     try:
-        if val is None or val == "": return 0.0
-        return float(val)
-    except: return 0.0
+        models_3t, model_2t, version = _read_model_files(strict=True)
+    except Exception as e:
+        print(f"❌ 新モデルを読み込めないため差し替えません: {e}")
+        metrics.inc("model_reloads_total", {"result": "rejected"})
+        return False
+    if version == MODEL_VERSION: return False
+    # マニフェストがあるのにハッシュが合わないのは書き込み途中 (2T/3T が新旧混在)。
+    # マニフェストは最後に置き換わるので、その変更で監視がもう一度呼ぶ
+    if os.path.exists(MANIFEST_FILE) and version.startswith("file-"):
+        print(f"⏳ モデルファイルがマニフェストと一致しないため差し替えを見送ります ({version})")
+        return False
+    try:
+        dropped = _dropped_models(models_3t, model_2t)
+        if dropped: raise ValueError(f"読み込み中のモデルが新しい組にありません: {', '.join(dropped)}")
+        validate_models(models_3t, model_2t)
+    except Exception as e:
+        print(f"❌ 新モデル({version})の検証に失敗したため差し替えません: {e}")
+        metrics.inc("model_reloads_total", {"result": "rejected"})
+        return False
+    with _MODEL_LOCK:
+        old = MODEL_VERSION
+        MODELS_3T, MODEL_2T, MODEL_VERSION = models_3t, model_2t, version
+    metrics.set_gauge("model_info", 0, {"version": old})
+    metrics.set_gauge("model_info", 1, {"version": version})
+    metrics.inc("model_reloads_total", {"result": "swapped"})
+    print(f"♻️ モデル差し替え: {old} -> {version}")
+    return True
+
+def start_model_watcher(stop_event, interval=None):
+    """モデルファイル/マニフェストの更新を監視して差し替えるスレッドを起動する"""
+    interval = interval or MODEL_WATCH_INTERVAL
+    def worker():
+        seen = _files_sig()
+        while not stop_event.wait(interval):
+            sig = _files_sig()
+            if sig == seen: continue
+            # コピー途中を読まないよう、変化が止まるまで1周待つ
+            if stop_event.wait(min(interval, 5.0)) or _files_sig() != sig: continue
+            seen = sig
+            try:
+                reload_models()
+            except Exception as e:
+                print(f"❌ モデル再読み込みエラー: {e}")
+                metrics.inc("model_reloads_total", {"result": "error"})
+    t = threading.Thread(target=worker, daemon=True, name="model-watcher")
+    t.start()
+    return t
 
 # ==========================================
 # 🔮 1. 候補出し (2T & 3T対応)
 # ==========================================
 def predict_race(raw):
-    jcd = int(raw.get('jcd', 0))
-    
-    # データフレーム作成
-    rows = []
-    ex_list = []
-    wind = to_float(raw.get('wind', 0.0))
-    for i in range(1, 7):
-        s = str(i)
-        val_ex = to_float(raw.get(f'ex{s}', 0))
-        ex_list.append(val_ex)
-        rows.append({
-            'jcd': jcd, 'wind': wind, 'boat_no': i,
-            'pid': raw.get(f'pid{s}', 0), 
-            'wr': to_float(raw.get(f'wr{s}', 0)),
-            'mo': to_float(raw.get(f'mo{s}', 0)), 
-            'ex': val_ex,
-            'st': to_float(raw.get(f'st{s}', 0.20)), 
-            'f': to_float(raw.get(f'f{s}', 0)),
-        })
-    
-    if sum(ex_list) == 0: return [], 0.0, 0.0, True
+    with metrics.timer("predict"):
+        return _predict_race(raw)
 
-    df = pd.DataFrame(rows)
-    # Zスコア計算
-    for col in ['wr', 'mo', 'ex', 'st']:
-        m, s = df[col].mean(), df[col].std()
-        df[f'{col}_z'] = (df[col] - m) / (s if s != 0 else 1e-6)
+# 組み合わせの並び順 (確率ベクトルの添字と対応)
+PERMS_3T = harville.PERMS_3T
+PERMS_2T = harville.PERMS_2T
+COMBOS_3T = [f"{i+1}-{j+1}-{k+1}" for i, j, k in PERMS_3T]
+COMBOS_2T = [f"{i+1}-{j+1}" for i, j in PERMS_2T]
+COMBOS_3F = [f"{i+1}={j+1}={k+1}" for i, j, k in harville.COMBS_3F]
+COMBOS_2F = [f"{i+1}={j+1}" for i, j in harville.COMBS_2F]
+
+_MODEL_FEATURES = {} # id(model) -> (model, 推論に使う列)
+
+def model_features(model, base):
+    """モデルの学習時の列に合わせる (選手別成績込みで学習したモデルなら RACER_FEATURES を足す)"""
+    hit = _MODEL_FEATURES.get(id(model))
+    if hit is None or hit[0] is not model:
+        names = model.feature_name() if callable(getattr(model, 'feature_name', None)) else getattr(model, 'feature_name_', [])
+        hit = (model, base + RACER_FEATURES if RACER_FEATURES[0] in names else base)
+        _MODEL_FEATURES[id(model)] = hit
+    return hit[1]
+
+def predict_probs(raw, models=None):
+    """全組み合わせの確率を返す: (3T確率(120,) or None, 3T自信度(max p1), 2T確率(30,) or None)
+    展示タイムが取れていないレースは None を返す。models: (3T辞書, 2Tモデル) 省略時は現行版"""
+    if models is None:
+        models = current_models()[:2]
+        _SMOKE_RAWS.append(raw)
+    return score_frame(race_frame(raw), models)[0]
+
+def race_frame(raw):
+    """1レース分の特徴量行列 (本番と影モデルで同じものを使う)"""
+    # 選手別成績は常駐辞書から引くだけなので毎回付けておく
+    rs = racer_stats.get_store().feature_block(raw)[None]
+    return build_frame(boat_arrays([raw]), rs)
+
+def build_frame(a, rs):
+    """a: features.boat_arrays 形式, rs: (レース数, 6, len(RACER_FEATURES))
+    戻り値: (特徴量 DataFrame, 予測できるレースの添字, その会場, レース数)"""
+    df, valid = frame_from_arrays(a)
+    races = np.flatnonzero(valid)
+    if len(races): add_racer_features(df, rs[races].reshape(-1, len(RACER_FEATURES)))
+    return df, races, a['jcd'][races], len(valid)
+
+def predict_probs_batch(a, rs, models):
+    """複数レースをまとめて予測する (推論サーバーのバッチ処理もここを通る)。
+    models: (3T辞書, 2Tモデル)。戻り値: レースごとの predict_probs の値のリスト"""
+    return score_frame(build_frame(a, rs), models)
+
+def class_probs(frame, models, monitor=True):
+    """build_frame の行列からレースごとの着順クラス確率 (6, K) を出す: (3T用リスト, 2T用リスト)。
+    frame は書き換えない (影モデルが同じ行列を後から読む)。monitor=False ならドリフト監視に数えない"""
+    models_3t, model_2t = models
+    df, races, jcds, n = frame
+    cp3, cp2 = [None] * n, [None] * n
+    if not len(races): return cp3, cp2
 
-    df['pid'] = df['pid'].astype('category')
-    
-    # 特徴量リスト (学習時と合わせる)
-    features = ['boat_no', 'pid', 'wind', 'wr', 'mo', 'ex', 'st', 'f', 'wr_z', 'mo_z', 'ex_z', 'st_z']
-    
-    candidates = []
-    b = df['boat_no'].values
-    
     # ----------------------------------------
     # 🎯 3連単予測 (会場別モデル)
     # ----------------------------------------
-    max_p1 = 0.0
-    max_removed_prob = 0.0
-    
-    model_3t = get_3t_model(jcd)
-    if model_3t:
+    for jcd in np.unique(jcds):
+        model_3t = models_3t.get(int(jcd))
+        if not model_3t: continue
+        sel = np.flatnonzero(jcds == jcd)
         try:
             # 3T用予測 (特徴量からjcdを除外したもので学習している前提)
-            p = model_3t.predict(df[features])
-            p1, p2, p3 = p[:, 0], p[:, 1], p[:, 2] 
-            
-            max_p1 = max(p1)
-            
-            if max_p1 >= CONF_THRESH_3T:
-                for i, j, k in permutations(range(6), 3):
-                    prob = p1[i] * p2[j] * p3[k]
-                    if prob > max_removed_prob: max_removed_prob = prob
-                    
-                    if prob >= MIN_PROB_3T:
-                        candidates.append({
-                            'combo': f"{b[i]}-{b[j]}-{b[k]}", 
-                            'raw_prob': prob, 
-                            'prob': round(prob * 100, 1),
-                            'type': '3t'
-                        })
+            rows = (sel[:, None] * 6 + np.arange(6)).reshape(-1)
+            X = df.iloc[rows][model_features(model_3t, FEATURES)]
+            if monitor: drift_monitor.observe_features("3t", model_3t, X, int(jcd))
+            p = model_3t.predict(X).reshape(len(sel), 6, -1)
+            for k, r in enumerate(sel): cp3[races[r]] = p[k]
         except Exception as e:
             print(f"⚠️ 3T予測エラー JCD{jcd}: {e}")
 
     # ----------------------------------------
     # 🎯 2連単予測 (全体モデル)
     # ----------------------------------------
-    model_2t = get_2t_model()
     if model_2t:
         try:
             # 2T用特徴量 (jcdを含める)
             df_2t = df.copy()
-            df_2t['jcd'] = jcd
             df_2t['jcd'] = df_2t['jcd'].astype('category')
-            
-            # 全体モデルは jcd を含む特徴量で学習している
-            features_2t = ['jcd'] + features
-            
-            p_2t = model_2t.predict(df_2t[features_2t])
+            X = df_2t[model_features(model_2t, FEATURES_2T)]
+            if monitor: drift_monitor.observe_features("2t", model_2t, X)
             # 多クラス分類 (0=1着, 1=2着...)
-            p1_2t, p2_2t = p_2t[:, 0], p_2t[:, 1]
-            
-            for i, j in permutations(range(6), 2):
-                prob = p1_2t[i] * p2_2t[j]
-                
-                if prob >= MIN_PROB_2T:
-                    candidates.append({
-                        'combo': f"{b[i]}-{b[j]}", 
-                        'raw_prob': prob, 
-                        'prob': round(prob * 100, 1),
-                        'type': '2t'
-                    })
+            p_2t = model_2t.predict(X).reshape(len(races), 6, -1)
+            for k, r in enumerate(races): cp2[r] = p_2t[k]
         except Exception as e:
-            print(f"⚠️ 2T予測エラー JCD{jcd}: {e}")
+            print(f"⚠️ 2T予測エラー JCD{','.join(str(j) for j in np.unique(jcds))}: {e}")
+    return cp3, cp2
+
+def _combo_probs(cps, fn):
+    """レースごとの (6, K) をまとめて harville の fn に通す (None はそのまま)"""
+    out = [None] * len(cps)
+    groups = {}
+    for r, p in enumerate(cps):
+        if p is not None: groups.setdefault(p.shape, []).append(r)
+    for rs in groups.values():
+        pr = fn(np.stack([cps[r] for r in rs]))
+        for k, r in enumerate(rs): out[r] = pr[k]
+    return out
+
+def score_frame(frame, models, monitor=True):
+    """build_frame の行列でレースごとの (3T確率, 3T自信度, 2T確率) を出す (組み合わせ確率は harville.ENGINE)"""
+    cp3, cp2 = class_probs(frame, models, monitor)
+    probs_3t, probs_2t = _combo_probs(cp3, harville.probs_3t), _combo_probs(cp2, harville.probs_2t)
+    out = [None] * frame[3]
+    for r in frame[1]:
+        max_p1 = cp3[r][:, 0].max() if cp3[r] is not None else 0.0
+        out[r] = (probs_3t[r], max_p1, probs_2t[r])
+    return out
+
+# ------------------------------------------
+# 🧠 共有推論サーバー (INFERENCE_SOCKET 設定時のみ)
+# ------------------------------------------
+INFERENCE_SOCKET = os.environ.get("INFERENCE_SOCKET", "")
+INFERENCE_RETRY_SEC = 30 # 繋がらなかったら暫く自前のモデルで予測する
+_REMOTE = {'client': None, 'down_until': 0.0}
+_REMOTE_LOCK = threading.Lock()
+
+def _remote_client():
+    if not INFERENCE_SOCKET: return None
+    with _REMOTE_LOCK:
+        if time.monotonic() < _REMOTE['down_until']: return None
+        if _REMOTE['client'] is None:
+            import inference_server
+            _REMOTE['client'] = inference_server.InferenceClient(INFERENCE_SOCKET)
+        return _REMOTE['client']
+
+def _remote_failed(e):
+    with _REMOTE_LOCK:
+        if time.monotonic() >= _REMOTE['down_until']:
+            print(f"⚠️ 推論サーバーに接続できないため自前のモデルで予測します ({INFERENCE_RETRY_SEC}秒): {e}")
+        _REMOTE['down_until'] = time.monotonic() + INFERENCE_RETRY_SEC
+
+def remote_version():
+    """推論サーバーが使えればそのモデルの版、使えなければ None"""
+    client = _remote_client()
+    if client is None: return None
+    try:
+        return client.ping()
+    except (OSError, ValueError) as e:
+        _remote_failed(e)
+        return None
+
+def _remote_probs(raw):
+    """推論サーバーで predict_probs 相当を行う: (結果, 版)。使えなければ None"""
+    client = _remote_client()
+    if client is None: return None
+    try:
+        out, version = client.predict([raw], racer_stats.get_store().feature_block(raw)[None])
+    except (OSError, ValueError) as e:
+        _remote_failed(e)
+        metrics.inc("inference_calls_total", {"where": "fallback"})
+        return None
+    metrics.inc("inference_calls_total", {"where": "remote"})
+    return out[0], version
+
+def _predict_race(raw):
+    remote = _remote_probs(raw)
+    if remote is not None:
+        res, version = remote
+        shadow.submit(raw) # 行列は影モデル側で作る
+    else:
+        models_3t, model_2t, version = current_models()
+        frame = race_frame(raw)
+        res = score_frame(frame, (models_3t, model_2t))[0]
+        _SMOKE_RAWS.append(raw)
+        shadow.submit(raw, frame)
+    return candidates_from_probs(res, version)
+
+def _push_candidates(candidates, probs, combos, min_prob, bet_type, version):
+    for idx in np.flatnonzero(probs >= min_prob):
+        prob = probs[idx]
+        candidates.append({
+            'combo': combos[idx], 
+            'raw_prob': prob, 
+            'prob': round(prob * 100, 1),
+            'type': bet_type,
+            'model_version': version
+        })
+
+def candidates_from_probs(res, version):
+    """predict_probs の値から候補を出す: (候補, 3T自信度, 3T最大確率, True)"""
+    if res is None: return [], 0.0, 0.0, True
+    probs_3t, max_p1, probs_2t = res
+    
+    candidates = []
+    max_removed_prob = 0.0
+    
+    if probs_3t is not None and max_p1 >= CONF_THRESH_3T:
+        max_removed_prob = probs_3t.max()
+        _push_candidates(candidates, probs_3t, COMBOS_3T, MIN_PROB_3T, '3t', version)
+
+    if probs_2t is not None:
+        _push_candidates(candidates, probs_2t, COMBOS_2T, MIN_PROB_2T, '2t', version)
+
+    # 2連複は同じ確率を組ごとに足すだけ
+    if probs_2t is not None:
+        _push_candidates(candidates, harville.unordered(probs_2t, 2), COMBOS_2F, MIN_PROB_2F, '2f', version)
 
     if not candidates:
         return [], 0.0, 0.0, True # 何も出なくてもエラーではない
@@ -299,9 +529,10 @@ def predict_race(raw):
 # ==========================================
 # 💰 2. EVフィルタ
 # ==========================================
-def filter_and_sort_bets(candidates, odds_2t, odds_3t, jcd):
+def filter_and_sort_bets(candidates, odds_2t, odds_3t, jcd, odds_2f=None):
     final_bets = []
     max_ev = 0.0
+    odds_2f = odds_2f or {}
     
     # 戦略設定（2t, 3tで分けるならここ）
     # 今回は簡易的に共通閾値だが、本来は辞書等で分ける
@@ -325,6 +556,10 @@ def filter_and_sort_bets(candidates, odds_2t, odds_3t, jcd):
             cap = ODDS_CAP_2T
             # 修正: 会場ごとのEV設定を適用
             thresh = STRATEGY_2T.get(jcd, {}).get('ev_thresh', 99.9)
+        elif bet_type == '2f':
+            real_o = odds_2f.get(combo, 0.0)
+            cap = ODDS_CAP_2F
+            thresh = STRATEGY_2F.get(jcd, {}).get('ev_thresh', 99.9)
 
         if real_o > 0:
             ev = prob * min(real_o, cap)
@@ -343,8 +578,9 @@ def filter_and_sort_bets(candidates, odds_2t, odds_3t, jcd):
     
     bets_3t = [b for b in final_bets if b['type'] == '3t'][:MAX_BETS_3T]
     bets_2t = [b for b in final_bets if b['type'] == '2t'][:MAX_BETS_2T]
+    bets_2f = [b for b in final_bets if b['type'] == '2f'][:MAX_BETS_2F]
     
-    merged = bets_3t + bets_2t
+    merged = bets_3t + bets_2t + bets_2f
     merged.sort(key=lambda x: x['ev'], reverse=True)
     
     return merged, max_ev, 0.0
@@ -353,8 +589,8 @@ def filter_and_sort_bets(candidates, odds_2t, odds_3t, jcd):
 # 📝 3. 解説生成 (変更なし)
 # ==========================================
 def generate_batch_reasons(jcd, bets_info, raw_data):
-    client = get_groq_client()
-    if not client: return {}
+    router = llm_router.get_router()
+    if not router: return {}
     
     players_info = ""
     for i in range(1, 7):
@@ -381,20 +617,18 @@ def generate_batch_reasons(jcd, bets_info, raw_data):
     """
     
     try:
-        chat = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="meta-llama/llama-4-scout-17b-16e-instruct", temperature=0.7, max_tokens=400
-        )
-        text = chat.choices[0].message.content
+        with metrics.timer("groq"):
+            text = router.complete(prompt, temperature=0.7, max_tokens=400)
+        if text is None: return {} # どのモデルも時間内に答えられなかった
         comments = {}
         for line in text.split('\n'):
             if ':' in line:
                 p = line.split(':', 1)
                 comments[p[0].strip()] = p[1].strip()
         return comments
-        return comments
     except Exception as e:
-        print(f"⚠️ Groq API Error: {e}")
+        metrics.inc("groq_errors_total")
+        print(f"⚠️ LLM Error: {e}")
         return {}
 
 def attach_reason(results, raw, odds_map=None):
@@ -407,4 +641,5 @@ def attach_reason(results, raw, odds_map=None):
         if ai_msg:
             item['reason'] = f"{ai_msg} (EV:{item['ev']:.2f})"
         else:
-            item['reason'] = f"【勝負】AI推奨 (EV:{item['ev']:.2f})"
+            # 解説が間に合わなかったときの定型文
+            item['reason'] = f"【勝負】AI推奨 確率{item['prob']}%×オッズ{item['odds']} (EV:{item['ev']:.2f})"
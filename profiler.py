@@ -0,0 +1,192 @@
+import os
+import sys
+import time
+import signal
+import datetime
+import argparse
+import threading
+import collections
+
+import metrics
+
+# ==========================================
+# 🔬 サンプリングプロファイラ (任意)
+# ==========================================
+# 一定間隔で全スレッドのスタックを覗き、どこで時間を使っているかを数える。
+# 各サンプルの根元には スレッド名;タグ (処理中のレース・段階) を付け、
+# スキャン1周ごとに collapsed-stack 形式 (flamegraph.pl / speedscope でそのまま読める) で書き出す。
+#
+#   PROFILE=1 python main.py                  # 起動時から有効
+#   kill -USR2 <pid>                          # 実行中に有効/無効を切り替え
+#   python profiler.py top profiles/cycle-*.folded   # 重い関数の一覧
+#
+# 1回のサンプルにかかった時間を測り、間隔の PROFILE_MAX_OVERHEAD を超えないよう間隔を自動で広げる。
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_HZ = float(os.environ.get("PROFILE_HZ", "20") or 20)
+PROFILE_MAX_OVERHEAD = float(os.environ.get("PROFILE_MAX_OVERHEAD", "0.02") or 0.02)
+MAX_DEPTH = 64
+
+_TAGS = {} # スレッドID -> [タグ, ...]
+_STATE = {'thread': None, 'stop': None, 'counts': collections.Counter(), 'samples': 0, 'spent': 0.0, 'since': 0.0}
+_LOCK = threading.RLock() # シグナルハンドラ (メインスレッド) から入り直しても固まらないように
+
+# ------------------------------------------
+# タグ (処理中のレース・段階)
+# ------------------------------------------
+class tag:
+    """with profiler.tag("桐生1R"): ... の間、このスレッドのサンプルにタグを付ける"""
+    __slots__ = ("name", "tid")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.tid = threading.get_ident()
+        _TAGS.setdefault(self.tid, []).append(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        stack = _TAGS.get(self.tid)
+        if stack: stack.pop()
+        if not stack: _TAGS.pop(self.tid, None)
+
+def set_tag(name):
+    """ループの1周ごとなど with で囲みにくい所用: このスレッドのタグを置き換える (None で外す)"""
+    tid = threading.get_ident()
+    if name is None: _TAGS.pop(tid, None)
+    else: _TAGS[tid] = [name]
+
+# ------------------------------------------
+# サンプリング
+# ------------------------------------------
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+def _sample(own, names):
+    frames = sys._current_frames()
+    counts = _STATE['counts']
+    for tid, frame in frames.items():
+        if tid == own: continue
+        stack = []
+        while frame is not None and len(stack) < MAX_DEPTH:
+            stack.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        name = names.get(tid)
+        if name is None:
+            names.clear()
+            names.update({t.ident: t.name for t in threading.enumerate()})
+            name = names.get(tid, "?")
+        root = [name.rstrip("0123456789_-") or name]
+        tags = _TAGS.get(tid)
+        if tags: root.extend(tags)
+        counts[";".join(root + stack)] += 1
+
+def _run(stop):
+    own = threading.get_ident()
+    names = {}
+    interval = base = 1.0 / PROFILE_HZ
+    while not stop.wait(interval):
+        t0 = time.perf_counter()
+        with _LOCK:
+            _sample(own, names)
+            _STATE['samples'] += 1
+        cost = time.perf_counter() - t0
+        _STATE['spent'] += cost
+        # 1回のサンプルが重ければ (スレッドが多い・スタックが深い) 間隔を広げる
+        interval = max(base, cost / PROFILE_MAX_OVERHEAD)
+
+def running():
+    return _STATE['thread'] is not None
+
+def start():
+    if running(): return False
+    stop = threading.Event()
+    t = threading.Thread(target=_run, args=(stop,), daemon=True, name="profiler")
+    with _LOCK:
+        _STATE.update(thread=t, stop=stop, counts=collections.Counter(), samples=0, spent=0.0, since=time.monotonic())
+    t.start()
+    metrics.set_gauge("profiler_running", 1)
+    return True
+
+def stop():
+    """止めて、それまでの分を書き出す。書き出したファイル (なければ None) を返す"""
+    if not running(): return None
+    path = dump("final")
+    _STATE['stop'].set()
+    _STATE['thread'].join(timeout=2)
+    _STATE['thread'] = None
+    metrics.set_gauge("profiler_running", 0)
+    return path
+
+def dump(label="cycle"):
+    """溜まったサンプルを collapsed-stack 形式で書き出してリセットする。書いたファイルを返す"""
+    if not running(): return None
+    with _LOCK:
+        counts, samples, spent, since = _STATE['counts'], _STATE['samples'], _STATE['spent'], _STATE['since']
+        _STATE.update(counts=collections.Counter(), samples=0, spent=0.0, since=time.monotonic())
+    if not counts: return None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(PROFILE_DIR, f"{label}-{stamp}.folded")
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, n in counts.most_common():
+            f.write(f"{stack} {n}\n")
+    wall = max(time.monotonic() - since, 1e-9)
+    metrics.inc("profiler_samples_total", value=samples)
+    metrics.set_gauge("profiler_overhead_ratio", round(spent / wall, 4))
+    return path
+
+def toggle(*_):
+    """シグナルハンドラ: 有効/無効を切り替える"""
+    if running():
+        path = stop()
+        print(f"🔬 プロファイラ停止{f' -> {path}' if path else ''}")
+    else:
+        start()
+        print(f"🔬 プロファイラ開始 ({PROFILE_HZ:g}Hz, 出力: {PROFILE_DIR}/)")
+
+def install():
+    """PROFILE が設定されていれば開始し、SIGUSR2 で切り替えられるようにする (メインスレッドから呼ぶ)"""
+    if hasattr(signal, "SIGUSR2"):
+        signal.signal(signal.SIGUSR2, toggle)
+    if os.environ.get("PROFILE", "") not in ("", "0"):
+        start()
+    return running()
+
+# ------------------------------------------
+# 集計 (flamegraph が無い環境で見る用)
+# ------------------------------------------
+def top(paths, n=25, out=sys.stdout):
+    """collapsed-stack ファイルから 自己時間 (先端の関数) と 合計時間 (スタック中に出る関数) の上位を出す"""
+    own, total, tags = collections.Counter(), collections.Counter(), collections.Counter()
+    samples = 0
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                stack, _, cnt = line.rstrip("\n").rpartition(" ")
+                cnt = int(cnt)
+                frames = stack.split(";")
+                samples += cnt
+                own[frames[-1]] += cnt
+                for fr in set(frames): total[fr] += cnt
+                if len(frames) > 1 and "(" not in frames[1]: tags[frames[1]] += cnt
+    if not samples:
+        print("サンプルがありません", file=out)
+        return
+    for title, c in (("自己時間", own), ("合計時間", total), ("タグ別", tags)):
+        print(f"📊 {title} (全{samples:,}サンプル)", file=out)
+        for name, cnt in c.most_common(n):
+            print(f"  {cnt / samples:6.1%} {cnt:>7,}  {name}", file=out)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="collapsed-stack ファイルの集計")
+    ap.add_argument("cmd", choices=["top"])
+    ap.add_argument("files", nargs="+")
+    ap.add_argument("-n", type=int, default=25)
+    args = ap.parse_args(argv)
+    top(args.files, args.n)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import numpy as np
+
+# ==========================================
+# 🎴 出走表1レース分のレコード
+# ==========================================
+# 以前は {'pid1': .., 'wr1': .., ..., 'st6': ..} の約40キーの辞書だった。
+# 艇ごとの値は (6艇, len(BOAT_FIELDS)) の float64 配列 1つにまとめ、スカラーだけ属性で持つ。
+#   card.column('ex')      -> 6艇分の展示タイム (配列のビュー、コピーしない)
+#   RaceCard.stack(cards)  -> features.boat_arrays と同じ形の配列群 (Python でのキー単位の処理なし)
+# 従来の辞書と同じキーでも読み書きできる (card['wr3'], card.get('deadline_time'))。
+# ST は取れなかった艇も既定値 0.20 で埋まるので、実際に読めたかは別に持つ (card.parsed('st3') は読めなければ None)。
+
+BOAT_FIELDS = ('pid', 'wr', 'mo', 'ex', 'st', 'f')
+FIELD_INDEX = {c: k for k, c in enumerate(BOAT_FIELDS)}
+# 取得失敗時の既定値 (features.DEFAULTS と同じ)
+DEFAULT_ROW = np.array([0, 0.0, 0.0, 0.0, 0.20, 0], dtype=np.float64)
+_INT_FIELDS = {'pid', 'f'}
+SCALARS = ('date', 'jcd', 'rno', 'wind', 'deadline_time')
+KEYS = SCALARS + tuple(f'{c}{i}' for i in range(1, 7) for c in BOAT_FIELDS)
+
+def _split(key):
+    """'wr3' -> ('wr', 2)。艇ごとのキーでなければ None"""
+    c, s = key[:-1], key[-1:]
+    if c in FIELD_INDEX and s.isdigit() and 1 <= int(s) <= 6:
+        return c, int(s) - 1
+    return None
+
+def parsed_value(raw, key):
+    """raw (辞書 or RaceCard) の値。RaceCard で取れなかった ST は None"""
+    return raw.parsed(key) if isinstance(raw, RaceCard) else raw.get(key)
+
+class RaceCard:
+    __slots__ = ('date', 'jcd', 'rno', 'wind', 'deadline_time', 'boats', 'st_parsed')
+
+    def __init__(self, date, jcd, rno, wind=0.0, deadline_time=None, boats=None):
+        self.date, self.jcd, self.rno = date, jcd, rno
+        self.wind, self.deadline_time = wind, deadline_time
+        self.boats = np.tile(DEFAULT_ROW, (6, 1)) if boats is None else boats
+        self.st_parsed = np.zeros(6, dtype=bool) if boats is None else np.ones(6, dtype=bool)
+
+    def set(self, boat, field, value):
+        """boat: 1〜6"""
+        self.boats[boat - 1, FIELD_INDEX[field]] = value
+        if field == 'st': self.st_parsed[boat - 1] = True
+
+    def parsed(self, key):
+        """card[key] と同じだが、読めなかった ST (既定値のまま) は None"""
+        hit = _split(key)
+        if hit and hit[0] == 'st' and not self.st_parsed[hit[1]]: return None
+        return self[key]
+
+    def column(self, field):
+        return self.boats[:, FIELD_INDEX[field]]
+
+    @staticmethod
+    def stack(cards):
+        """features.boat_arrays と同じ {'jcd', 'wind', 'pid', 'wr', ...} を作る"""
+        b = np.stack([c.boats for c in cards]) if cards else np.empty((0, 6, len(BOAT_FIELDS)))
+        out = {c: b[:, :, k] for k, c in enumerate(BOAT_FIELDS)}
+        out['pid'] = out['pid'].astype(np.int64)
+        out['jcd'] = np.array([c.jcd for c in cards], dtype=np.int64)
+        out['wind'] = np.array([c.wind for c in cards], dtype=np.float64)
+        return out
+
+    # ------------------------------------------
+    # 辞書互換
+    # ------------------------------------------
+    @classmethod
+    def from_dict(cls, raw):
+        card = cls(raw.get('date'), raw.get('jcd'), raw.get('rno'), raw.get('wind', 0.0), raw.get('deadline_time'))
+        for key, v in raw.items():
+            hit = _split(key)
+            if hit and v is not None and v != "":
+                try: card.set(hit[1] + 1, hit[0], float(v))
+                except (TypeError, ValueError): pass
+        return card
+
+    def __getitem__(self, key):
+        hit = _split(key)
+        if hit:
+            v = self.boats[hit[1], FIELD_INDEX[hit[0]]]
+            return int(v) if hit[0] in _INT_FIELDS else float(v)
+        if key in SCALARS: return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        hit = _split(key)
+        if hit:
+            self.set(hit[1] + 1, hit[0], value)
+        elif key in SCALARS:
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        try: return self[key]
+        except KeyError: return default
+
+    def __contains__(self, key):
+        return key in SCALARS or _split(key) is not None
+
+    def keys(self):
+        return KEYS
+
+    def __iter__(self):
+        return iter(KEYS)
+
+    def __len__(self):
+        return len(KEYS)
+
+    def items(self):
+        return [(k, self[k]) for k in KEYS]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"RaceCard({self.date} {self.jcd}場{self.rno}R)"
@@ -0,0 +1,108 @@
+import os
+import json
+import sqlite3
+import datetime
+
+from race_card import parsed_value
+
+# ==========================================
+# 🗄️ レースデータストア (特徴量・結果・オッズ)
+# ==========================================
+# 学習・バックテスト用の過去レースを保存する SQLite。
+# Bot 本体の race_data.db (購入履歴) とは別ファイルにしている。
+
+STORE_FILE = os.environ.get("RACE_STORE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "race_store.db")
+
+BOAT_COLS = ['pid', 'wr', 'mo', 'ex', 'f', 'st']
+RACE_COLS = ['wind', 'deadline_time'] + [f'{c}{i}' for i in range(1, 7) for c in BOAT_COLS]
+
+def connect(path=None):
+    conn = sqlite3.connect(path or STORE_FILE, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    boat_defs = ", ".join(f"{c}{i} {'INTEGER' if c in ('pid', 'f') else 'REAL'}" for i in range(1, 7) for c in BOAT_COLS)
+    conn.executescript(f"""
+        CREATE TABLE IF NOT EXISTS races (
+            date TEXT, jcd INTEGER, rno INTEGER,
+            wind REAL, deadline_time TEXT, {boat_defs},
+            PRIMARY KEY (date, jcd, rno)
+        );
+        CREATE TABLE IF NOT EXISTS results (
+            date TEXT, jcd INTEGER, rno INTEGER,
+            combo_3t TEXT, payout_3t INTEGER, combo_2t TEXT, payout_2t INTEGER,
+            PRIMARY KEY (date, jcd, rno)
+        );
+        CREATE TABLE IF NOT EXISTS odds (
+            date TEXT, jcd INTEGER, rno INTEGER, ticket_type TEXT,
+            odds_json TEXT,
+            PRIMARY KEY (date, jcd, rno, ticket_type)
+        );
+        -- 取り込み済みチェックポイント (status: OK / NO_RACE)
+        CREATE TABLE IF NOT EXISTS ingest_log (
+            date TEXT, jcd INTEGER, rno INTEGER, status TEXT, updated_at TEXT,
+            PRIMARY KEY (date, jcd, rno)
+        );
+    """)
+    return conn
+
+def done_keys(conn, date_from, date_to):
+    """取り込み済み (date, jcd, rno) の集合"""
+    rows = conn.execute("SELECT date, jcd, rno FROM ingest_log WHERE date BETWEEN ? AND ?", (date_from, date_to))
+    return {(d, j, r) for d, j, r in rows}
+
+def save_batch(conn, records):
+    """取り込み結果をまとめて1トランザクションで書き込む。
+    records: {'date','jcd','rno','status', 'raw', 'result', 'odds_3t', 'odds_2t'} のリスト"""
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    race_rows, result_rows, odds_rows, log_rows = [], [], [], []
+    for r in records:
+        key = (r['date'], r['jcd'], r['rno'])
+        log_rows.append(key + (r['status'], now))
+        if r['status'] != "OK": continue
+        raw = r.get('raw')
+        if raw:
+            # 読めなかった ST は既定値ではなく NULL で残す (選手別成績の平均STに混ぜない)
+            race_rows.append(key + tuple(parsed_value(raw, c) for c in RACE_COLS))
+        res = r.get('result')
+        if res:
+            result_rows.append(key + (res.get('combo_3t'), res.get('payout_3t', 0), res.get('combo_2t'), res.get('payout_2t', 0)))
+        for t_type in ('3t', '2t'):
+            o = r.get(f'odds_{t_type}')
+            if o: odds_rows.append(key + (t_type, json.dumps(o, separators=(",", ":"))))
+
+    ph = ",".join("?" * (3 + len(RACE_COLS)))
+    with conn:
+        conn.executemany(f"INSERT OR REPLACE INTO races (date, jcd, rno, {', '.join(RACE_COLS)}) VALUES ({ph})", race_rows)
+        conn.executemany("INSERT OR REPLACE INTO results VALUES (?,?,?,?,?,?,?)", result_rows)
+        conn.executemany("INSERT OR REPLACE INTO odds VALUES (?,?,?,?,?)", odds_rows)
+        conn.executemany("INSERT OR REPLACE INTO ingest_log VALUES (?,?,?,?,?)", log_rows)
+
+def iter_races(conn, date_from=None, date_to=None, venues=None, with_odds=False):
+    """保存済みレースを raw 辞書 (scrape_race_data と同じキー) + 結果 (+ オッズ) で返す"""
+    where, params = ["1=1"], []
+    if date_from: where.append("r.date >= ?"); params.append(date_from)
+    if date_to: where.append("r.date <= ?"); params.append(date_to)
+    if venues:
+        where.append(f"r.jcd IN ({','.join('?' * len(venues))})"); params.extend(venues)
+    cols = ", ".join(f"r.{c}" for c in RACE_COLS)
+    sql = f"""
+        SELECT r.date, r.jcd, r.rno, {cols},
+               x.combo_3t, x.payout_3t, x.combo_2t, x.payout_2t
+        FROM races r LEFT JOIN results x USING (date, jcd, rno)
+        WHERE {' AND '.join(where)}
+        ORDER BY r.date, r.jcd, r.rno
+    """
+    odds_cur = conn.cursor()
+    for row in conn.execute(sql, params):
+        date_str, jcd, rno = row[0], row[1], row[2]
+        raw = {'date': int(date_str), 'jcd': jcd, 'rno': rno}
+        raw.update(zip(RACE_COLS, row[3:3 + len(RACE_COLS)]))
+        rest = row[3 + len(RACE_COLS):]
+        rec = {
+            'date': date_str, 'jcd': jcd, 'rno': rno, 'raw': raw,
+            'result': {'combo_3t': rest[0], 'payout_3t': rest[1] or 0, 'combo_2t': rest[2], 'payout_2t': rest[3] or 0} if rest[0] or rest[2] else None,
+        }
+        if with_odds:
+            for t_type, js in odds_cur.execute("SELECT ticket_type, odds_json FROM odds WHERE date=? AND jcd=? AND rno=?", (date_str, jcd, rno)):
+                rec[f'odds_{t_type}'] = json.loads(js)
+        yield rec
@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import datetime
+
+import numpy as np
+
+from race_card import parsed_value
+
+# ==========================================
+# 🧑‍✈️ 選手別成績ストア (pid キー, 逐次更新)
+# ==========================================
+# レース確定のたびに該当6選手の集計値だけを更新する。参照は常駐辞書から O(1)。
+# 永続化は Bot と同じ SQLite (race_data.db) に行う。
+#
+# 集計内容 (選手ごと):
+#   - 直近 RECENT_N 走の着順 (1〜3着, 0=着外)
+#   - コース(枠番)別の出走数・1着数
+#   - 平均ST (出走表の値の累積平均。読めなかった ST は除く)
+#   - 会場別の出走数・1着数・3着内数
+# 直近 RECENT_N 走だけが移動窓で、出走数・1着数・コース別・会場別はいずれも通算 (窓なし) の累計。
+#
+# 結果待ちレースは締切 + SETTLE_DELAY_SEC を過ぎてからまとめて結果を取りに行き、
+# まだ出ていなければ SETTLE_RETRY_SEC から倍々に (上限 SETTLE_RETRY_MAX_SEC) 間隔を空ける。
+
+RECENT_N = 10
+SETTLE_DELAY_SEC = int(os.environ.get("RACER_SETTLE_DELAY_SEC") or 600)
+SETTLE_RETRY_SEC = 120
+SETTLE_RETRY_MAX_SEC = 1800
+_DEFAULT_ST = 0.20
+
+def _empty():
+    return {
+        'starts': 0, 'wins': 0, 'top2': 0, 'top3': 0,
+        'st_sum': 0.0, 'st_n': 0, 'recent': [],
+        'course_starts': [0] * 6, 'course_wins': [0] * 6,
+        'venues': {},  # jcd -> [starts, wins, top3]
+    }
+
+class RacerStats:
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.racers = {}      # pid -> 集計辞書
+        self.settled = set()  # 反映済み (date, jcd, rno)
+        if db_path:
+            self.init_db()
+            self._load()
+
+    # ------------------------------------------
+    # 永続化
+    # ------------------------------------------
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def init_db(self):
+        """テーブルを用意する (起動時に1回)"""
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS racer_stats (
+                pid INTEGER PRIMARY KEY, data TEXT, updated_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS racer_settled (
+                date TEXT, jcd INTEGER, rno INTEGER, PRIMARY KEY (date, jcd, rno)
+            );
+            -- 出走表は取得済みで、結果待ちのレース
+            CREATE TABLE IF NOT EXISTS racer_pending (
+                date TEXT, jcd INTEGER, rno INTEGER, entry TEXT,
+                next_try REAL, tries INTEGER, PRIMARY KEY (date, jcd, rno)
+            );
+        """)
+        # 結果取得の予定時刻を持たない古い racer_pending
+        have = {r[1] for r in conn.execute("PRAGMA table_info(racer_pending)")}
+        for col, typ in (("next_try", "REAL"), ("tries", "INTEGER")):
+            if col not in have:
+                with conn: conn.execute(f"ALTER TABLE racer_pending ADD COLUMN {col} {typ}")
+        conn.close()
+
+    def _load(self):
+        conn = self._connect()
+        for pid, data in conn.execute("SELECT pid, data FROM racer_stats"):
+            d = json.loads(data)
+            d['venues'] = {int(k): v for k, v in d['venues'].items()}
+            self.racers[pid] = d
+        self.settled = {tuple(r) for r in conn.execute("SELECT date, jcd, rno FROM racer_settled")}
+        conn.close()
+
+    def _save(self, conn, pids, key):
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        conn.executemany("INSERT OR REPLACE INTO racer_stats VALUES (?,?,?)",
+                         [(pid, json.dumps(self.racers[pid], separators=(",", ":")), now) for pid in pids])
+        conn.execute("INSERT OR IGNORE INTO racer_settled VALUES (?,?,?)", key)
+        conn.execute("DELETE FROM racer_pending WHERE date=? AND jcd=? AND rno=?", key)
+
+    # ------------------------------------------
+    # 更新
+    # ------------------------------------------
+    def update(self, date_str, jcd, rno, raw, combo_3t, persist=True):
+        """確定したレース1つ分を反映する (反映済みなら何もしない)。反映したら True"""
+        key = (str(date_str), int(jcd), int(rno))
+        try:
+            order = [int(x) for x in combo_3t.split('-')][:3]
+        except (AttributeError, ValueError):
+            return False
+        with self.lock:
+            if key in self.settled: return False
+            pids = []
+            for course in range(1, 7):
+                pid = int(raw.get(f'pid{course}') or 0)
+                if not pid: continue
+                finish = order.index(course) + 1 if course in order else 0
+                r = self.racers.setdefault(pid, _empty())
+                r['starts'] += 1
+                r['wins'] += finish == 1
+                r['top2'] += 1 <= finish <= 2
+                r['top3'] += 1 <= finish <= 3
+                st = raw.get(f'st{course}')
+                if st is not None and st != "": # 読めなかった ST だけ除く (0.20 も実測値としてあり得る)
+                    r['st_sum'] += float(st); r['st_n'] += 1
+                r['recent'] = (r['recent'] + [finish])[-RECENT_N:]
+                r['course_starts'][course - 1] += 1
+                r['course_wins'][course - 1] += finish == 1
+                v = r['venues'].setdefault(int(jcd), [0, 0, 0])
+                v[0] += 1; v[1] += finish == 1; v[2] += 1 <= finish <= 3
+                pids.append(pid)
+            self.settled.add(key)
+            if persist and self.db_path:
+                conn = self._connect()
+                with conn: self._save(conn, pids, key)
+                conn.close()
+        return True
+
+    def save_all(self):
+        """全件を書き直す (rebuild 用)"""
+        conn = self._connect()
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        with conn:
+            conn.execute("DELETE FROM racer_stats")
+            conn.execute("DELETE FROM racer_settled")
+            conn.executemany("INSERT INTO racer_stats VALUES (?,?,?)",
+                             [(pid, json.dumps(r, separators=(",", ":")), now) for pid, r in self.racers.items()])
+            conn.executemany("INSERT INTO racer_settled VALUES (?,?,?)", sorted(self.settled))
+        conn.close()
+
+    def register_pending(self, date_str, jcd, rno, raw, deadline_ts):
+        """結果待ちレースの出走選手を記録する (report_worker が締切 + SETTLE_DELAY_SEC 以降に update する)"""
+        if not self.db_path: return
+        key = (str(date_str), int(jcd), int(rno))
+        if key in self.settled: return
+        entry = {k: parsed_value(raw, k) for k in [f'{c}{i}' for i in range(1, 7) for c in ('pid', 'st')]}
+        conn = self._connect()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO racer_pending (date, jcd, rno, entry, next_try, tries) VALUES (?,?,?,?,?,0)",
+                         key + (json.dumps(entry), deadline_ts + SETTLE_DELAY_SEC))
+        conn.close()
+
+    def pending(self, now):
+        """結果を取りに行く時刻を過ぎたもの [(date, jcd, rno, entry辞書), ...]"""
+        if not self.db_path: return []
+        conn = self._connect()
+        rows = [(d, j, r, json.loads(e)) for d, j, r, e in conn.execute(
+            "SELECT date, jcd, rno, entry FROM racer_pending WHERE next_try IS NULL OR next_try <= ? ORDER BY next_try",
+            (now,))]
+        conn.close()
+        return rows
+
+    def defer_pending(self, keys, now):
+        """結果がまだ出ていないものの次回を、試行回数に応じて倍々に先送りする"""
+        if not self.db_path or not keys: return
+        conn = self._connect()
+        with conn:
+            for key in keys:
+                row = conn.execute("SELECT tries FROM racer_pending WHERE date=? AND jcd=? AND rno=?", key).fetchone()
+                if row is None: continue
+                tries = (row[0] or 0) + 1
+                wait = min(SETTLE_RETRY_SEC * 2 ** (tries - 1), SETTLE_RETRY_MAX_SEC)
+                conn.execute("UPDATE racer_pending SET next_try=?, tries=? WHERE date=? AND jcd=? AND rno=?",
+                             (now + wait, tries) + tuple(key))
+        conn.close()
+
+    def drop_pending_before(self, date_str):
+        """結果が取れないまま日付を越えたものを捨てる"""
+        if not self.db_path: return
+        conn = self._connect()
+        with conn: conn.execute("DELETE FROM racer_pending WHERE date < ?", (date_str,))
+        conn.close()
+
+    # ------------------------------------------
+    # 参照 (O(1))
+    # ------------------------------------------
+    def features(self, pid, course, jcd):
+        """RACER_FEATURES の順で値を返す (未知の選手は中立値)"""
+        r = self.racers.get(int(pid or 0))
+        if r is None or not r['starts']:
+            return [0.0, 0.0, 0.0, 0.0, _DEFAULT_ST]
+        recent = r['recent']
+        cs = r['course_starts'][course - 1]
+        v = r['venues'].get(int(jcd))
+        return [
+            float(r['starts']),
+            sum(1 for f in recent if f) / len(recent) if recent else 0.0,
+            r['course_wins'][course - 1] / cs if cs else 0.0,
+            v[1] / v[0] if v and v[0] else 0.0,
+            r['st_sum'] / r['st_n'] if r['st_n'] else _DEFAULT_ST,
+        ]
+
+    def feature_block(self, raw):
+        """1レース分 (6, len(RACER_FEATURES)) の配列"""
+        jcd = int(raw.get('jcd', 0))
+        return np.array([self.features(raw.get(f'pid{c}'), c, jcd) for c in range(1, 7)], dtype=np.float64)
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+def init_store(db_path):
+    """Bot 起動時に1回呼ぶ"""
+    global _STORE
+    with _STORE_LOCK:
+        _STORE = RacerStats(db_path)
+    return _STORE
+
+def get_store():
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None: _STORE = RacerStats()
+    return _STORE
+
+# ------------------------------------------
+# 過去データからの作り直し
+# ------------------------------------------
+def replay_store(conn, date_from=None, date_to=None, stats=None):
+    """race_store のレースを日付順に流し、(rec, 更新前の特徴量ブロック) を返しながら集計する。
+    学習時はこのブロックを使う (そのレース自身の結果を含まない時点の値)"""
+    import race_store
+    stats = stats or RacerStats()
+    for rec in race_store.iter_races(conn, date_from, date_to):
+        block = stats.feature_block(rec['raw'])
+        res = rec['result']
+        if res and res.get('combo_3t'):
+            stats.update(rec['date'], rec['jcd'], rec['rno'], rec['raw'], res['combo_3t'], persist=False)
+        yield rec, block
+
+def rebuild(db_path, store_path=None, date_from=None, date_to=None):
+    import race_store
+    stats = RacerStats()
+    conn = race_store.connect(store_path)
+    n = sum(1 for _ in replay_store(conn, date_from, date_to, stats))
+    conn.close()
+    stats.db_path = db_path
+    stats.init_db()
+    stats.save_all()
+    print(f"✅ 選手別成績を再構築: {n:,}R / {len(stats.racers):,}人 -> {db_path}")
+    return stats
+
+def main():
+    ap = argparse.ArgumentParser(description="選手別成績ストアの再構築 (race_store から)")
+    ap.add_argument("--db", default=os.environ.get("RACE_DB") or "race_data.db", help="書き込み先 (Bot の DB)")
+    ap.add_argument("--store", default=None, help="取り込み済みデータ (省略時は race_store の既定)")
+    ap.add_argument("--from", dest="date_from", default=None, help="開始日 YYYYMMDD")
+    ap.add_argument("--to", dest="date_to", default=None, help="終了日 YYYYMMDD")
+    args = ap.parse_args()
+    rebuild(args.db, args.store, args.date_from, args.date_to)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import sqlite3
+import threading
+import datetime
+
+# ==========================================
+# 📌 レース単位の進行状況 (再起動後の再開用)
+# ==========================================
+# (date, jcd, rno) ごとに締切時刻と状態を1行で持つ。状態が変わったものだけを
+# サイクルの終わりにまとめて書き込み、起動時に当日分を読み戻す。
+#
+# 状態:
+#   WAIT   締切15分前より前 (締切時刻は判明済み)
+#   ACTIVE 締切15分前〜締切 (予測・購入判定の対象)
+#   BET    1点以上購入済み
+#   CLOSED 締切を過ぎた
+
+WAIT, ACTIVE, BET, CLOSED = "WAIT", "ACTIVE", "BET", "CLOSED"
+
+class RunState:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.rows = {}      # (date, jcd, rno) -> [deadline, state]
+        self.dirty = set()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS run_state (
+                date TEXT, jcd INTEGER, rno INTEGER, deadline TEXT, state TEXT, updated_at TEXT,
+                PRIMARY KEY (date, jcd, rno)
+            )
+        """)
+        return conn
+
+    def load(self, date_str):
+        """当日分を読み込み、それより前の日付の行は消す。読み込んだ行数を返す"""
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM run_state WHERE date < ?", (date_str,))
+        rows = conn.execute("SELECT jcd, rno, deadline, state FROM run_state WHERE date=?", (date_str,)).fetchall()
+        conn.close()
+        with self.lock:
+            for jcd, rno, deadline, state in rows:
+                self.rows[(date_str, jcd, rno)] = [deadline, state]
+        return len(rows)
+
+    def get(self, date_str, jcd, rno):
+        """(締切 'HH:MM' or None, 状態 or None)"""
+        with self.lock:
+            row = self.rows.get((date_str, jcd, rno))
+            return tuple(row) if row else (None, None)
+
+    def races(self, date_str, states):
+        """指定状態の (jcd, rno) 一覧"""
+        with self.lock:
+            return [(j, r) for (d, j, r), (_, st) in self.rows.items() if d == date_str and st in states]
+
+    def mark(self, date_str, jcd, rno, state, deadline=None):
+        """状態を更新する (変化があったときだけ次の flush で書き込む)。BET は ACTIVE に戻さない"""
+        key = (date_str, jcd, rno)
+        with self.lock:
+            row = self.rows.get(key)
+            if row is None:
+                self.rows[key] = [deadline, state]
+                self.dirty.add(key)
+                return
+            if row[1] == BET and state == ACTIVE: state = BET
+            if deadline is None: deadline = row[0]
+            if row != [deadline, state]:
+                row[0], row[1] = deadline, state
+                self.dirty.add(key)
+
+    def flush(self):
+        """変化した行をまとめて書き込む。書いた行数を返す"""
+        with self.lock:
+            if not self.dirty: return 0
+            now = datetime.datetime.now().isoformat(timespec="seconds")
+            batch = [k + tuple(self.rows[k]) + (now,) for k in self.dirty]
+            self.dirty = set()
+        try:
+            conn = self._connect()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO run_state VALUES (?,?,?,?,?,?)", batch)
+            conn.close()
+        except Exception:
+            # 書けなかった分は次回に持ち越す
+            with self.lock:
+                self.dirty.update(b[:3] for b in batch)
+            raise
+        return len(batch)
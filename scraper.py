@@ -1,38 +1,127 @@
 from curl_cffi import requests
 from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
+import os
 import re
+import threading
 import unicodedata
 import warnings
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import metrics
+import http_archive
+import http_policy
+import drift_monitor
+from race_card import RaceCard
 
 warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
 
+# 取得先 (負荷試験時は mock_boatrace.py のURLに差し替える)
+BASE_URL = os.environ.get("BOATRACE_BASE_URL", "https://www.boatrace.jp/owpc/pc/race").rstrip("/")
+
 def clean_text(text):
     if not text: return ""
     text = unicodedata.normalize('NFKC', str(text))
     return text.replace("\n", "").replace("\r", "").replace("¥", "").replace(",", "").strip()
 
 def get_session():
+    # リプレイ中はアーカイブから応答する
+    if http_archive.is_replaying(): return http_archive.ReplaySession()
     # Chrome 120 の指紋を模倣
     return requests.Session(impersonate="chrome120")
 
-def get_soup(session, url):
+def fetch_html(session, url, timeout=15):
+    """HTML本文を1回だけ取得する: (bytes or None, ステータス)"""
     try:
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
             "Referer": "https://www.boatrace.jp/",
             "Accept-Language": "ja,en-US;q=0.9,en;q=0.8"
         }
-        res = session.get(url, headers=headers, timeout=15)
+        with metrics.timer("http"):
+            res = session.get(url, headers=headers, timeout=timeout)
+        if http_archive.is_recording():
+            http_archive.record(url, res.status_code, res.content)
+        metrics.inc("http_status_total", {"code": res.status_code})
         
-        if "データがありません" in res.text: return None, "NO_RACE"
-        if res.status_code == 404: return None, "NO_RACE"
-        if res.status_code != 200: return None, "HTTP_ERROR"
-        if len(res.content) < 500: return None, "SMALL_CONTENT"
+        if "データがありません" in res.text: return _outcome(None, "NO_RACE")
+        if res.status_code == 404: return _outcome(None, "NO_RACE")
+        if res.status_code != 200: return _outcome(None, "HTTP_ERROR")
+        if len(res.content) < 500: return _outcome(None, "SMALL_CONTENT")
         
-        return BeautifulSoup(res.content, 'lxml'), "OK"
+        return _outcome(res.content, "OK")
     except Exception as e:
+        metrics.inc("http_outcome_total", {"outcome": "EXCEPTION"})
         return None, f"EXCEPTION_{e}"
 
+def _outcome(body, status):
+    metrics.inc("http_outcome_total", {"outcome": status})
+    return body, status
+
+def make_soup(content):
+    with metrics.timer("parse_html"):
+        return BeautifulSoup(content, 'lxml')
+
+def _get_soup(session, url):
+    # 並列数制御・再試行・遮断は http_policy に任せる
+    content, status = http_policy.fetch(session, url, fetch_html)
+    if content is None: return None, status
+    return make_soup(content), status
+
+# ------------------------------------------
+# 同じURLの同時取得をまとめる
+# ------------------------------------------
+# 走査スレッド・結果確定・影モデルが同じページを同時に取りに行くことがあるので、
+# 取得中のURLには相乗りして、1回の取得・1回の解析の結果 (スープ) を共有する。
+# 取得できたページは COALESCE_TTL 秒だけ残し、ほぼ同時の重複も吸収する。
+# 相乗りは取得中のものが同じか上の優先レーンのときだけ (下のレーンの取得に待たされないように)。
+# スープは読むだけなので共有してよい (パーサで書き換えないこと)。
+COALESCE_TTL = float(os.environ.get("HTTP_COALESCE_TTL", "2") or 2)
+
+class _Flight:
+    __slots__ = ("done", "result", "rank")
+
+    def __init__(self, rank):
+        self.done = threading.Event()
+        self.result = (None, "EXCEPTION_取得中に失敗")
+        self.rank = rank
+
+_FLIGHTS = {} # 正規化URL -> 取得中の _Flight
+_RECENT = {}  # 正規化URL -> (取得時刻, (スープ, ステータス))
+_FLIGHT_LOCK = threading.Lock()
+
+def normalize_url(url):
+    """クエリの順番・ホストの大文字小文字・末尾の / の違いを吸収したキー"""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/") or "/", query, ""))
+
+def get_soup(session, url):
+    key = normalize_url(url)
+    rank = http_policy.LANES.index(http_policy.current_lane(http_policy.current_deadline()))
+    with _FLIGHT_LOCK:
+        hit = _RECENT.get(key)
+        if hit and http_archive.now() - hit[0] <= COALESCE_TTL:
+            metrics.inc("http_coalesced_total", {"kind": "recent"})
+            return hit[1]
+        flight = _FLIGHTS.get(key)
+        lead = flight is None or flight.rank > rank
+        if lead: flight = _FLIGHTS[key] = _Flight(rank)
+    if not lead:
+        metrics.inc("http_coalesced_total", {"kind": "inflight"})
+        flight.done.wait()
+        return flight.result
+
+    try:
+        flight.result = _get_soup(session, url)
+    finally:
+        with _FLIGHT_LOCK:
+            if _FLIGHTS.get(key) is flight: del _FLIGHTS[key]
+            if flight.result[0] is not None and COALESCE_TTL > 0:
+                now = http_archive.now()
+                for k in [k for k, (ts, _) in _RECENT.items() if now - ts > COALESCE_TTL]: del _RECENT[k]
+                _RECENT[key] = (now, flight.result)
+        flight.done.set()
+    return flight.result
+
 def extract_deadline(soup, rno):
     if not soup: return None
     try:
@@ -70,12 +159,10 @@ def extract_deadline(soup, rno):
     return None
 
 def scrape_race_data(session, jcd, rno, date_str):
-    base_url = "https://www.boatrace.jp/owpc/pc/race"
-    
-    url_before = f"{base_url}/beforeinfo?rno={rno}&jcd={jcd:02d}&hd={date_str}"
+    url_before = f"{BASE_URL}/beforeinfo?rno={rno}&jcd={jcd:02d}&hd={date_str}"
     soup_before, stat_b = get_soup(session, url_before)
     
-    url_list = f"{base_url}/racelist?rno={rno}&jcd={jcd:02d}&hd={date_str}"
+    url_list = f"{BASE_URL}/racelist?rno={rno}&jcd={jcd:02d}&hd={date_str}"
     soup_list, stat_l = get_soup(session, url_list)
 
     if stat_b == "NO_RACE" or stat_l == "NO_RACE":
@@ -84,22 +171,18 @@ def scrape_race_data(session, jcd, rno, date_str):
     if not soup_before and not soup_list: 
         return None, f"FETCH_ERR({stat_b}/{stat_l})"
 
-    row = {
-        'date': int(date_str), 'jcd': jcd, 'rno': rno, 'wind': 0.0,
-        'deadline_time': None
-    }
-    
-    for i in range(1, 7):
-        row[f'pid{i}'] = 0
-        row[f'wr{i}'] = 0.0
-        row[f'mo{i}'] = 0.0
-        row[f'ex{i}'] = 0.0
-        row[f'f{i}'] = 0
-        row[f'st{i}'] = 0.20
-
-    row['deadline_time'] = extract_deadline(soup_before, rno)
-    if not row['deadline_time']:
-        row['deadline_time'] = extract_deadline(soup_list, rno)
+    with metrics.timer("parse"):
+        row = parse_race_data(soup_before, soup_list, jcd, rno, date_str)
+    return row, "OK"
+
+def parse_race_data(soup_before, soup_list, jcd, rno, date_str):
+    """直前情報・出走表のスープから1レース分の RaceCard を作る"""
+    # 艇ごとの値は既定値 (pid=0, st=0.20, 他は0) で埋まった状態から始まる
+    row = RaceCard(int(date_str), jcd, rno)
+
+    row.deadline_time = extract_deadline(soup_before, rno)
+    if not row.deadline_time:
+        row.deadline_time = extract_deadline(soup_list, rno)
         
     if soup_before:
         try:
@@ -109,12 +192,13 @@ def scrape_race_data(session, jcd, rno, date_str):
                 if wind_data:
                     w_txt = clean_text(wind_data.text)
                     m = re.search(r"(\d+)", w_txt)
-                    if m: row['wind'] = float(m.group(1))
-            if row['wind'] == 0.0:
+                    if m: row.wind = float(m.group(1))
+            if row.wind == 0.0:
                  m = re.search(r"風.*?(\d+)m", soup_before.text)
-                 if m: row['wind'] = float(m.group(1))
+                 if m: row.wind = float(m.group(1))
         except: pass
 
+    found = dict.fromkeys(('pid', 'wr', 'mo', 'ex', 'st', 'f'), 0) # 取れた艇数 (監視用)
     for i in range(1, 7):
         if soup_before:
             try:
@@ -124,7 +208,8 @@ def scrape_race_data(session, jcd, rno, date_str):
                     if tr:
                         text_all = clean_text(tr.text)
                         matches = re.findall(r"(6\.\d{2}|7\.[0-4]\d)", text_all)
-                        if matches: row[f'ex{i}'] = float(matches[-1])
+                        if matches:
+                            row.set(i, 'ex', float(matches[-1])); found['ex'] += 1
             except: pass
             
         if soup_list:
@@ -135,37 +220,52 @@ def scrape_race_data(session, jcd, rno, date_str):
                     txt_all = clean_text(tbody.text)
                     
                     pid_match = re.search(r"([2-5]\d{3})", txt_all)
-                    if pid_match: row[f'pid{i}'] = int(pid_match.group(1))
+                    if pid_match:
+                        row.set(i, 'pid', int(pid_match.group(1))); found['pid'] += 1
                     
                     wr_matches = re.findall(r"(\d\.\d{2})", txt_all)
                     for val_str in wr_matches:
                         val = float(val_str)
                         if 1.0 <= val <= 9.99: 
-                            row[f'wr{i}'] = val
+                            row.set(i, 'wr', val); found['wr'] += 1
                             break
                             
                     mo_matches = re.findall(r"(\d{2}\.\d{2})", txt_all)
                     for m_val in mo_matches:
                         if 10.0 <= float(m_val) <= 99.9: 
-                            row[f'mo{i}'] = float(m_val)
+                            row.set(i, 'mo', float(m_val)); found['mo'] += 1
                             break
                             
                     st_match = re.search(r"(0\.\d{2})", txt_all)
-                    if st_match: row[f'st{i}'] = float(st_match.group(1))
+                    if st_match:
+                        row.set(i, 'st', float(st_match.group(1))); found['st'] += 1
                     
                     f_match = re.search(r"F(\d+)", txt_all)
-                    if f_match: row[f'f{i}'] = int(f_match.group(1))
+                    if f_match:
+                        row.set(i, 'f', int(f_match.group(1))); found['f'] += 1
             except: pass
-            
-    return row, "OK"
+
+    missing = {k: 6 - n for k, n in found.items()}
+    missing['deadline'] = 0 if row.deadline_time else 1
+    drift_monitor.record_parse(jcd, missing, str(date_str), row.deadline_time)
+    return row
 
 def get_odds_map(session, jcd, rno, date_str):
-    url = f"https://www.boatrace.jp/owpc/pc/race/odds3t?rno={rno}&jcd={jcd:02d}&hd={date_str}"
+    url = f"{BASE_URL}/odds3t?rno={rno}&jcd={jcd:02d}&hd={date_str}"
     soup, status = get_soup(session, url)
     if not soup:
         print(f"⚠️ [3T] スープ取得失敗 {jcd}場{rno}R: {status}")
         return {}
 
+    with metrics.timer("parse"):
+        odds_map = parse_odds_3t(soup)
+    if not odds_map:
+        print(f"⚠️ [3T] オッズマップが空です {jcd}場{rno}R (テーブル検出数: {len(soup.select('div.table1 table'))})")
+        
+    return odds_map
+
+def parse_odds_3t(soup):
+    """3連単オッズページのスープから {"1-2-3": オッズ} を作る"""
     odds_map = {}
     tables = soup.select("div.table1 table")
     
@@ -214,36 +314,58 @@ def get_odds_map(session, jcd, rno, date_str):
                         if odds_val > 0: odds_map[key] = odds_val
                 except: continue
     
-    if not odds_map:
-        print(f"⚠️ [3T] オッズマップが空です {jcd}場{rno}R (テーブル検出数: {len(tables)})")
-        
     return odds_map
 
-def get_odds_2t(session, jcd, rno, date_str):
-    url = f"https://www.boatrace.jp/owpc/pc/race/odds2tf?rno={rno}&jcd={jcd:02d}&hd={date_str}"
+def get_odds_2tf(session, jcd, rno, date_str):
+    """2連単/2連複オッズページ (1ページに両方載っている): ({"1-2": オッズ}, {"1=2": オッズ})"""
+    url = f"{BASE_URL}/odds2tf?rno={rno}&jcd={jcd:02d}&hd={date_str}"
     soup, status = get_soup(session, url)
     if not soup:
         print(f"⚠️ [2T] スープ取得失敗 {jcd}場{rno}R: {status}")
-        return {}
+        return {}, {}
     
-    odds_map = {}
+    with metrics.timer("parse"):
+        odds_2t, odds_2f = parse_odds_2tf(soup)
+    if not odds_2t:
+        print(f"⚠️ [2T] オッズマップが空です {jcd}場{rno}R")
+        
+    return odds_2t, odds_2f
+
+def get_odds_2t(session, jcd, rno, date_str):
+    return get_odds_2tf(session, jcd, rno, date_str)[0]
+
+def _odds_table_label(tbl):
+    """表の直前の見出しから "2連単" / "2連複" を読む (見出しが無ければ None)"""
+    node = tbl.find_previous(string=re.compile("2連[単複]"))
+    if node is None: return None
+    return "2連複" if "2連複" in node else "2連単"
+
+def parse_odds_2tf(soup):
+    """2連単/2連複オッズページのスープから ({"1-2": オッズ}, {"1=2": オッズ}) を作る"""
+    odds_2t, odds_2f = {}, {}
     # Use specific class if available, or fallback to all tables (usually .table1 table)
     tables = soup.select("div.table1 table")
     if not tables: tables = soup.select("table")
     
+    n_tables = 0
     for tbl in tables:
         # 簡易チェック: 数字アイコンやオッズっぽいセルがあるか
         if not tbl.select(".numberSet1_number") and not tbl.select(".oddsPoint"): 
             continue
 
+        # 見出しで区別する。見出しが無ければページ上の順 (2連単 -> 2連複)
+        label = _odds_table_label(tbl) or ("2連単" if n_tables == 0 else "2連複")
+        n_tables += 1
+        is_2f = label == "2連複"
+
         rows = tbl.select("tr")
         
         for tr in rows:
             tds = tr.select("td")
-            # 2連単オッズ表は横に6ペア(12セル)並んでいる想定
+            # オッズ表は横に6ペア(12セル)並んでいる想定
             if len(tds) < 12: continue 
             
-            # 各列が1着艇(1~6)に対応し、セル内が[2着艇, オッズ]
+            # 各列が1着艇(1~6)に対応し、セル内が[2着艇, オッズ] (2連複は空きセルあり)
             for i in range(6):
                 idx_boat = i * 2
                 idx_odd = i * 2 + 1
@@ -260,59 +382,57 @@ def get_odds_2t(session, jcd, rno, date_str):
                     
                     first = i + 1
                     
-                    if first != 0 and sec != 0:
-                        odds_map[f"{first}-{sec}"] = odd
+                    if first == sec or sec == 0: continue
+                    if is_2f:
+                        odds_2f[f"{min(first, sec)}={max(first, sec)}"] = odd
+                    else:
+                        odds_2t[f"{first}-{sec}"] = odd
                 except ValueError: 
                     pass
                 
-    if not odds_map:
-        print(f"⚠️ [2T] オッズマップが空です {jcd}場{rno}R (テーブル検出数: {len(tables)})")
-        
-    return odds_map
+    return odds_2t, odds_2f
+
+def parse_odds_2t(soup):
+    """2連単オッズページのスープから {"1-2": オッズ} を作る (同じページの2連複の表は読まない)"""
+    return parse_odds_2tf(soup)[0]
 
 def scrape_result(session, jcd, rno, date_str):
-    url = f"https://www.boatrace.jp/owpc/pc/race/raceresult?rno={rno}&jcd={jcd:02d}&hd={date_str}"
+    url = f"{BASE_URL}/raceresult?rno={rno}&jcd={jcd:02d}&hd={date_str}"
     soup, _ = get_soup(session, url)
     if not soup: return None
     
+    with metrics.timer("parse"):
+        return parse_result(soup)
+
+# 払戻の行: (キー, 勝式, 区切り)。連複は艇番を昇順に並べる
+RESULT_ROWS = (('3t', "3連単", "-"), ('3f', "3連複", "="), ('2t', "2連単", "-"), ('2f', "2連複", "="))
+
+def parse_result(soup):
+    """レース結果ページのスープから確定組番と払戻金を取り出す"""
     # 初期値の設定
-    res = {
-        'combo_3t': None, 'payout_3t': 0,
-        'combo_2t': None, 'payout_2t': 0
-    }
+    res = {}
+    for key, _, _ in RESULT_ROWS:
+        res[f'combo_{key}'] = None
+        res[f'payout_{key}'] = 0
     
     try:
         tables = soup.select("table.is-w495")
         for tbl in tables:
-            # 3連単
-            if "3連単" in tbl.text:
-                rows = tbl.select("tr")
-                for tr in rows:
-                    if "3連単" in tr.text:
-                        combo_node = tr.select(".numberSet1_number")
-                        if combo_node:
-                            nums = [c.text.strip() for c in combo_node]
-                            res['combo_3t'] = "-".join(nums)
-                        tds = tr.select("td")
-                        for td in reversed(tds):
-                            txt = clean_text(td.text).replace("¥","").replace(",","")
-                            if txt.isdigit() and int(txt) >= 100:
-                                res['payout_3t'] = int(txt); break
-            
-            # 2連単
-            if "2連単" in tbl.text:
+            for key, label, sep in RESULT_ROWS:
+                if label not in tbl.text: continue
                 rows = tbl.select("tr")
                 for tr in rows:
-                    if "2連単" in tr.text:
+                    if label in tr.text:
                         combo_node = tr.select(".numberSet1_number")
                         if combo_node:
                             nums = [c.text.strip() for c in combo_node]
-                            res['combo_2t'] = "-".join(nums)
+                            if sep == "=": nums.sort()
+                            res[f'combo_{key}'] = sep.join(nums)
                         tds = tr.select("td")
                         for td in reversed(tds):
                             txt = clean_text(td.text).replace("¥","").replace(",","")
                             if txt.isdigit() and int(txt) >= 100:
-                                res['payout_2t'] = int(txt); break
+                                res[f'payout_{key}'] = int(txt); break
 
     except Exception: pass
     return res
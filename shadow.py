@@ -0,0 +1,302 @@
+import os
+import sys
+import time
+import queue
+import hashlib
+import sqlite3
+import datetime
+import threading
+import argparse
+
+import metrics
+import http_archive
+import http_policy
+
+# ==========================================
+# 👥 影モデル (候補モデルの並行評価)
+# ==========================================
+# shadow_models/<名前>/ に本番と同じファイル名 (boatrace_model_2t.txt / boatrace_models_all.pkl) で
+# 候補モデルを置くと、本番と同じ特徴量行列で予測し、買い目と EV を shadow_history に記録する。
+# 通知はしない。結果は report_worker が本番の買い目と一緒に確定させる。
+#
+# 本番の予測は行列をキューに入れるだけで待たない。影の計算は専用スレッドで行い、
+#   - 影が使った CPU 時間が経過時間の SHADOW_CPU_SHARE を超えている間
+#   - 直前のスキャンが SHADOW_MAX_CYCLE 秒を超えた (サイクルが遅れている) 間
+#   - キューで SHADOW_MAX_LAG 秒以上待たされた
+# レースは評価せずに捨てる。
+# オッズは本番が取得したもの (share_odds) を使い、本番が取らなかったページだけ影が取り直す。
+#
+#   python shadow.py report [--from YYYYMMDD] [--to YYYYMMDD]   # 本番と影の成績比較
+
+SHADOW_DIR = os.environ.get("SHADOW_MODELS_DIR", "shadow_models")
+SHADOW_CPU_SHARE = float(os.environ.get("SHADOW_CPU_SHARE", "0.25") or 0.25)
+SHADOW_MAX_CYCLE = float(os.environ.get("SHADOW_MAX_CYCLE", "60") or 60) # スキャンの間隔 (これを超えたら次の周が遅れる)
+SHADOW_MAX_LAG = float(os.environ.get("SHADOW_MAX_LAG", "30") or 30)
+SHADOW_ODDS_WAIT = 10.0 # 本番のオッズ取得を待つ上限 (秒)。過ぎたら影が自分で取る
+CPU_BURST = 5.0  # 貯めておける CPU 時間 (秒)
+QUEUE_MAX = 64
+FILE_3T = "boatrace_models_all.pkl"
+FILE_2T = "boatrace_model_2t.txt"
+
+CANDIDATES = [] # [Candidate]
+_QUEUE = queue.Queue(maxsize=QUEUE_MAX)
+_STATE = {'last_cycle': 0.0, 'db': None}
+_WAITING = {} # (date, jcd, rno) -> 本番のオッズ待ちの _Job
+_WAITING_LOCK = threading.Lock()
+
+class _Job:
+    __slots__ = ('queued_at', 'raw', 'frame', 'odds', 'ready')
+
+    def __init__(self, raw, frame):
+        self.queued_at = time.monotonic()
+        self.raw, self.frame = raw, frame
+        self.odds = {}  # ページ ('2tf' / '3t') -> 本番が取得したオッズ
+        self.ready = threading.Event()
+
+def _race_key(raw):
+    return (str(raw.get('date')), int(raw.get('jcd')), int(raw.get('rno')))
+
+class Candidate:
+    def __init__(self, name, models_3t, model_2t, version):
+        self.name = name
+        self.models = (models_3t, model_2t)
+        self.version = version
+
+def _sha6(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:6]
+
+def _load_one(name, path):
+    import joblib
+    import lightgbm as lgb
+    import predict_boat
+    models_3t, model_2t, shas = {}, None, []
+    f3, f2 = os.path.join(path, FILE_3T), os.path.join(path, FILE_2T)
+    if os.path.exists(f3):
+        models_3t = joblib.load(f3)
+        shas.append(_sha6(f3))
+    if os.path.exists(f2):
+        model_2t = lgb.Booster(model_file=f2)
+        shas.append(_sha6(f2))
+    if not models_3t and model_2t is None: return None
+    predict_boat.validate_models(models_3t, model_2t)
+    return Candidate(name, models_3t, model_2t, f"shadow-{name}-{''.join(shas)}")
+
+def load_candidates(root=None):
+    """SHADOW_DIR 以下の候補モデルを読み込む。読み込めた数を返す"""
+    root = root or SHADOW_DIR
+    loaded = []
+    if os.path.isdir(root):
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name)
+            if not os.path.isdir(path): continue
+            try:
+                c = _load_one(name, path)
+            except Exception as e:
+                print(f"❌ 影モデル '{name}' の読み込みエラー: {e}")
+                continue
+            if c: loaded.append(c)
+    CANDIDATES[:] = loaded
+    return len(loaded)
+
+# ------------------------------------------
+# 本番側からの受け渡し (待たない)
+# ------------------------------------------
+def submit(raw, frame=None):
+    """本番と同じ入力・特徴量行列を影の評価キューに入れる (満杯なら捨てる)"""
+    if not CANDIDATES: return
+    job = _Job(raw, frame)
+    try:
+        _QUEUE.put_nowait(job)
+    except queue.Full:
+        metrics.inc("shadow_jobs_total", {"result": "dropped"})
+        return
+    with _WAITING_LOCK: _WAITING[_race_key(raw)] = job
+
+def share_odds(raw, odds):
+    """本番が取得したオッズ {'2tf': (2連単, 2連複), '3t': 3連単} を同じレースの影の評価に渡す。
+    何も取らなかったときも空の辞書で呼ぶ (影はそれ以上待たずに自分で取る)"""
+    if not CANDIDATES: return
+    with _WAITING_LOCK: job = _WAITING.pop(_race_key(raw), None)
+    if job is None: return
+    job.odds = dict(odds)
+    job.ready.set()
+
+def note_cycle(seconds):
+    """スキャン1周の所要時間 (遅れている間は影を止める)"""
+    _STATE['last_cycle'] = seconds
+
+def _deadline_ts(raw):
+    try:
+        h, m = map(int, raw.get('deadline_time').split(':'))
+        d = datetime.datetime.strptime(str(raw.get('date')), '%Y%m%d')
+    except (AttributeError, TypeError, ValueError):
+        return None
+    jst = datetime.timezone(datetime.timedelta(hours=9))
+    return d.replace(hour=h, minute=m, tzinfo=jst).timestamp()
+
+# ------------------------------------------
+# 影の評価スレッド
+# ------------------------------------------
+def worker(stop_event):
+    """supervisor から起動する評価ワーカー"""
+    import predict_boat
+    from scraper import get_session, get_odds_2tf, get_odds_map
+    db_path = _STATE['db']
+    sess = get_session()
+    http_policy.set_lane(http_policy.BACKGROUND) # 本番の締切間近の取得を優先する
+    tokens, last = CPU_BURST, time.monotonic()
+    while not stop_event.is_set():
+        try:
+            job = _QUEUE.get(timeout=1.0)
+        except queue.Empty:
+            continue
+        now = time.monotonic()
+        tokens = min(CPU_BURST, tokens + (now - last) * SHADOW_CPU_SHARE)
+        last = now
+        metrics.set_gauge("shadow_queue_depth", _QUEUE.qsize())
+        if now - job.queued_at > SHADOW_MAX_LAG: skip = "lag"
+        elif _STATE['last_cycle'] > SHADOW_MAX_CYCLE: skip = "behind"
+        elif tokens <= 0: skip = "budget"
+        else: skip = None
+        if skip:
+            metrics.inc("shadow_jobs_total", {"result": skip})
+            continue
+
+        # 本番のオッズ取得が終わるまで待つ (同じページを二重に取らない)
+        if not job.ready.wait(max(0.0, SHADOW_ODDS_WAIT - (time.monotonic() - job.queued_at))):
+            with _WAITING_LOCK:
+                if _WAITING.get(_race_key(job.raw)) is job: del _WAITING[_race_key(job.raw)]
+        cpu0 = time.thread_time()
+        try:
+            _evaluate(db_path, sess, job.raw, job.frame, job.odds, predict_boat, get_odds_2tf, get_odds_map)
+            metrics.inc("shadow_jobs_total", {"result": "scored"})
+        except Exception as e:
+            print(f"⚠️ 影モデル評価エラー: {e}")
+            metrics.inc("shadow_jobs_total", {"result": "error"})
+        cpu = time.thread_time() - cpu0
+        tokens -= cpu
+        metrics.inc("shadow_cpu_seconds_total", value=cpu)
+
+def _evaluate(db_path, sess, raw, frame, shared_odds, predict_boat, get_odds_2tf, get_odds_map):
+    if frame is None: frame = predict_boat.race_frame(raw)
+    date_str, jcd, rno = str(raw.get('date')), int(raw.get('jcd')), int(raw.get('rno'))
+    due = _deadline_ts(raw)
+    odds = dict(shared_odds)
+    def odds_for(page):
+        # 本番が取ったページはそのまま使い、取らなかったページだけ影の候補が出た券種の分を取る
+        if page not in odds:
+            with http_policy.deadline(due):
+                odds[page] = get_odds_2tf(sess, jcd, rno, date_str) if page == '2tf' else get_odds_map(sess, jcd, rno, date_str)
+            metrics.inc("shadow_odds_fetches_total", {"page": page})
+        return odds[page]
+
+    rows = []
+    for c in CANDIDATES:
+        res = predict_boat.score_frame(frame, c.models, monitor=False)[0]
+        candidates = predict_boat.candidates_from_probs(res, c.version)[0]
+        if not candidates: continue
+        if due is not None and http_archive.now() > due + 60: break # 本番も締切1分後まで (ここまでの分は書く)
+        pages = {predict_boat.ODDS_PAGES[x['type']] for x in candidates}
+        odds_2t, odds_2f = odds_for('2tf') if '2tf' in pages else ({}, {})
+        odds_3t = (odds_for('3t') or {}) if '3t' in pages else {}
+        bets = predict_boat.filter_and_sort_bets(candidates, odds_2t, odds_3t, jcd, odds_2f)[0]
+        for b in bets:
+            race_id = f"{date_str}_{jcd}_{rno}_{b['combo']}_{b['type']}"
+            rows.append((c.name, race_id, date_str, jcd, rno, b['combo'], b['type'], float(b['prob']),
+                         b['odds'], b['ev'], 'PENDING', 0, c.version))
+    if not rows: return
+    conn = _connect(db_path)
+    with conn:
+        for r in rows:
+            # 本番と同じく、同じ買い目は最初に条件を満たした時点のものだけ残す
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO shadow_history (shadow, race_id, date, jcd, race_no, predict_combo, ticket_type, "
+                "prob, odds, ev, status, profit, model_version) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", r)
+            if cur.rowcount: metrics.inc("shadow_bets_total", {"shadow": r[0], "type": r[6]})
+    conn.close()
+
+# ------------------------------------------
+# DB (shadow_history)
+# ------------------------------------------
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shadow_history (
+            shadow TEXT, race_id TEXT, date TEXT, jcd INTEGER, race_no INTEGER,
+            predict_combo TEXT, ticket_type TEXT, prob REAL, odds REAL, ev REAL,
+            status TEXT, profit INTEGER, model_version TEXT,
+            PRIMARY KEY (shadow, race_id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_shadow_pending ON shadow_history (status, date, jcd, race_no)")
+    return conn
+
+def init_db(db_path):
+    _STATE['db'] = db_path
+    _connect(db_path).close()
+
+def settle(db_path, sess, known=None):
+    """結果の出たレースの影の買い目を確定する。known: {(date, jcd, rno): 結果} (取得済みのもの)。確定した行数を返す"""
+    from scraper import scrape_result
+    known = known or {}
+    conn = _connect(db_path)
+    races = conn.execute("SELECT DISTINCT date, jcd, race_no FROM shadow_history WHERE status='PENDING'").fetchall()
+    done = 0
+    for date_str, jcd, rno in races:
+        res = known.get((date_str, jcd, rno)) or scrape_result(sess, jcd, rno, date_str)
+        if not res: continue
+        updates = []
+        for shadow_name, race_id, combo, t_type in conn.execute(
+                "SELECT shadow, race_id, predict_combo, ticket_type FROM shadow_history "
+                "WHERE status='PENDING' AND date=? AND jcd=? AND race_no=?", (date_str, jcd, rno)):
+            result_str = res.get(f'combo_{t_type}')
+            if result_str in (None, "未確定"): continue
+            payout = res.get(f'payout_{t_type}', 0)
+            profit = payout - 100 if result_str == combo else -100
+            updates.append((profit, shadow_name, race_id))
+            metrics.inc("shadow_settled_total", {"shadow": shadow_name})
+        if updates:
+            with conn:
+                conn.executemany("UPDATE shadow_history SET status='FINISHED', profit=? WHERE shadow=? AND race_id=?", updates)
+            done += len(updates)
+    conn.close()
+    return done
+
+# ------------------------------------------
+# 成績比較
+# ------------------------------------------
+def report(db_path, date_from=None, date_to=None, out=sys.stdout):
+    """影が評価した日付の範囲で、本番 (history) と影の成績を券種別に並べる"""
+    conn = _connect(db_path)
+    where, args = "status='FINISHED'", []
+    if date_from: where, args = where + " AND date>=?", args + [date_from]
+    if date_to: where, args = where + " AND date<=?", args + [date_to]
+    span = conn.execute(f"SELECT MIN(date), MAX(date) FROM shadow_history WHERE {where}", args).fetchone()
+    if not span[0]:
+        print("影モデルの確定済みの買い目はまだありません", file=out)
+        return
+    agg = ("COUNT(*), SUM(profit > 0), SUM(profit), AVG(ev)")
+    rows = conn.execute(f"SELECT '(本番)', ticket_type, {agg} FROM history WHERE status='FINISHED' AND date BETWEEN ? AND ? "
+                        "GROUP BY ticket_type", span).fetchall()
+    rows += conn.execute(f"SELECT shadow, ticket_type, {agg} FROM shadow_history WHERE {where} "
+                         "GROUP BY shadow, ticket_type ORDER BY shadow, ticket_type", args).fetchall()
+    conn.close()
+    print(f"📊 本番と影モデルの比較 ({span[0]}〜{span[1]})", file=out)
+    print(f"{'モデル':<20} {'券種':<4} {'点数':>6} {'的中':>5} {'的中率':>7} {'回収率':>7} {'収支':>9} {'平均EV':>7}", file=out)
+    for name, t_type, n, hits, profit, ev in rows:
+        hits, profit = hits or 0, profit or 0
+        print(f"{name:<20} {t_type:<4} {n:>6} {hits:>5} {hits / n:>7.1%} {(n * 100 + profit) / (n * 100):>7.1%} "
+              f"{profit:>+9,} {ev or 0:>7.2f}", file=out)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="影モデルの成績比較")
+    ap.add_argument("cmd", choices=["report"])
+    ap.add_argument("--db", default=os.environ.get("RACE_DB") or "race_data.db")
+    ap.add_argument("--from", dest="date_from")
+    ap.add_argument("--to", dest="date_to")
+    args = ap.parse_args(argv)
+    report(args.db, args.date_from, args.date_to)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import collections
+import sqlite3
+import threading
+import time
+import traceback
+
+import metrics
+
+# ==========================================
+# 🛡️ ワーカー監視 (プロセス内で再起動)
+# ==========================================
+# スキャナー・レポート・通知などのワーカーをスレッドで動かし、例外で落ちたら
+# バックオフ付きでそのスレッドだけ起動し直す。モデルやキャッシュはプロセスに残るので
+# 復帰はミリ秒単位。プロセスごと作り直すべきエラーのときだけ全体を止めて終了コード1を返す
+# (その場合はワークフロー側の while ループが python main.py を再起動する)。
+
+BACKOFF_MIN = 0.05  # 初回の再起動待ち (秒)
+BACKOFF_MAX = 30.0
+STABLE_SEC = 60.0   # これだけ動き続けたらバックオフを初期値に戻す
+CRASH_WINDOW = 300.0
+MAX_CRASHES = 20    # CRASH_WINDOW 秒以内にこれを超えて落ちたら致命的とみなす
+
+class FatalError(Exception):
+    """プロセスごと再起動すべきエラー"""
+
+def is_fatal(e):
+    """再起動しても直らないエラーか"""
+    if isinstance(e, (FatalError, MemoryError)): return True
+    # DB ファイル破損など (ロック待ちの OperationalError は一時的なので除く)
+    return type(e) is sqlite3.DatabaseError
+
+class Supervisor:
+    def __init__(self, log=print, error_log=print, stop_event=None):
+        self.log = log
+        self.error_log = error_log
+        self.stop_event = stop_event or threading.Event()
+        self.workers = []
+        self.threads = []
+        self.exit_code = 0
+
+    def add(self, name, target, essential=False):
+        """target(stop_event) を監視対象に加える。
+        essential=True のワーカーが正常に戻ったら (夜間停止など) 全体を終了する"""
+        self.workers.append({'name': name, 'target': target, 'essential': essential})
+
+    def stop(self, exit_code=0):
+        self.exit_code = max(self.exit_code, exit_code)
+        self.stop_event.set()
+
+    def _fatal(self, name, e):
+        self.error_log(f"FATAL: ワーカー '{name}' で致命的エラー: {e}")
+        metrics.inc("worker_fatal_total", {"worker": name})
+        self.stop(1)
+
+    def _run(self, w):
+        name = w['name']
+        backoff = BACKOFF_MIN
+        crashes = collections.deque()
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            try:
+                w['target'](self.stop_event)
+            except Exception as e:
+                if is_fatal(e):
+                    self._fatal(name, e)
+                    return
+                self.error_log(f"ワーカー '{name}' が異常終了: {e}")
+                self.error_log(traceback.format_exc())
+            else:
+                if w['essential']:
+                    self.stop(0)
+                return
+
+            now = time.monotonic()
+            if now - started >= STABLE_SEC: backoff = BACKOFF_MIN
+            crashes.append(now)
+            while crashes and now - crashes[0] > CRASH_WINDOW: crashes.popleft()
+            if len(crashes) > MAX_CRASHES:
+                self._fatal(name, FatalError(f"{CRASH_WINDOW:g}秒間に{len(crashes)}回異常終了"))
+                return
+
+            metrics.inc("worker_restarts_total", {"worker": name})
+            self.log(f"🛡️ ワーカー '{name}' を {backoff:.2f}秒後に再起動します")
+            if self.stop_event.wait(backoff): return
+            metrics.observe("worker_recovery_seconds", time.monotonic() - now, {"worker": name})
+            backoff = min(backoff * 2, BACKOFF_MAX)
+
+    def run(self, join_timeout=30.0):
+        """全ワーカーを起動し、終了まで待つ。戻り値は終了コード"""
+        for w in self.workers:
+            t = threading.Thread(target=self._run, args=(w,), daemon=True, name=f"worker-{w['name']}")
+            t.start()
+            self.threads.append(t)
+        try:
+            while not self.stop_event.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            self.log("⏹️ 中断を受け付けました。ワーカーを停止します")
+            self.stop(0)
+        deadline = time.monotonic() + join_timeout
+        for t in self.threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        return self.exit_code
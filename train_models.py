@@ -0,0 +1,289 @@
+import argparse
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import os
+import time
+
+import joblib
+import lightgbm as lgb
+import numpy as np
+
+import race_store
+import racer_stats
+from features import FEATURES, FEATURES_2T, RACER_FEATURES, add_racer_features, build_feature_frame, finish_labels
+from predict_boat import FILE_2T, FILE_3T
+
+# ==========================================
+# 🏋️ モデル再学習 (boatrace_model_2t.txt / boatrace_models_all.pkl)
+# ==========================================
+#   python train_models.py --from 20230101 --to 20251231
+#   python train_models.py --workers 8 --out-dir build/    # 別ディレクトリに出力
+#   python train_models.py --racer-features                 # 選手別成績 (racer_stats) の列も使う
+#
+# race_store (backfill.py で取り込んだデータ) から features.py の共通コードで
+# 特徴量を作り、2T全体モデルと会場別3Tモデル(24個)をプロセス並列で学習する。
+# LightGBM Dataset はバイナリでキャッシュし、同じデータなら再構築しない。
+
+MANIFEST_FILE = "models_manifest.json"
+CACHE_DIR = os.environ.get("TRAIN_CACHE_DIR", "train_cache")
+CACHE_VERSION = 1 # 特徴量やラベルの作り方を変えたら上げる
+
+N_CLASS_2T = 3   # 0=1着, 1=2着, 2=それ以外
+N_CLASS_3T = 4   # 0=1着, 1=2着, 2=3着, 3=それ以外
+
+PARAMS = {
+    'objective': 'multiclass',
+    'learning_rate': 0.05,
+    'num_leaves': 31,
+    'min_data_in_leaf': 50,
+    'feature_fraction': 0.9,
+    'bagging_fraction': 0.8,
+    'bagging_freq': 1,
+    'lambda_l2': 1.0,
+    'cat_smooth': 10,
+    'seed': 42,
+    'deterministic': True,
+    'force_row_wise': True,
+    'verbosity': -1,
+}
+NUM_BOOST_ROUND = 2000
+EARLY_STOPPING = 50
+
+# ------------------------------------------
+# データ
+# ------------------------------------------
+def feature_lists(racer_features):
+    """(2T の列, 3T の列)"""
+    extra = RACER_FEATURES if racer_features else []
+    return FEATURES_2T + extra, FEATURES + extra
+
+def load_training_frame(store_path, date_from, date_to, valid_frac, racer_features=False):
+    """ストアから学習用の特徴量・ラベル・分割を作る"""
+    conn = race_store.connect(store_path)
+    raws, combos, dates, blocks = [], [], [], []
+    # 選手別成績は日付順に流しながら「そのレース前」の値を取る (未来の結果が混ざらない)
+    recs = racer_stats.replay_store(conn, date_from, date_to) if racer_features else \
+        ((rec, None) for rec in race_store.iter_races(conn, date_from, date_to))
+    for rec, block in recs:
+        res = rec['result']
+        if not res or not res.get('combo_3t'): continue
+        raws.append(rec['raw']); combos.append(res['combo_3t']); dates.append(rec['date']); blocks.append(block)
+    conn.close()
+
+    df, valid = build_feature_frame(raws)
+    if racer_features:
+        sel = [b for b, v in zip(blocks, valid) if v]
+        add_racer_features(df, np.concatenate(sel) if sel else np.zeros((0, len(RACER_FEATURES))))
+    combos = [c for c, v in zip(combos, valid) if v]
+    dates = np.array([d for d, v in zip(dates, valid) if v])
+
+    y3, keep = [], []
+    for c in combos:
+        lab = finish_labels(c, N_CLASS_3T)
+        keep.append(lab is not None)
+        y3.append(lab if lab is not None else np.zeros(6, dtype=np.int64))
+    keep = np.repeat(np.array(keep, dtype=bool), 6)
+    y3 = np.concatenate(y3) if y3 else np.zeros(0, dtype=np.int64)
+    # 2T は 3着以下をまとめて「それ以外」にする
+    y2 = np.minimum(y3, N_CLASS_2T - 1)
+
+    # 日付で時系列分割 (末尾 valid_frac を検証用)
+    uniq = np.unique(dates)
+    cut = uniq[int(len(uniq) * (1 - valid_frac))] if len(uniq) > 1 and valid_frac > 0 else None
+    is_valid = np.repeat(dates >= cut, 6) if cut is not None else np.zeros(len(df), dtype=bool)
+
+    df = df[keep].reset_index(drop=True)
+    return df, y2[keep], y3[keep], is_valid[keep], (str(uniq[0]) if len(uniq) else None, str(uniq[-1]) if len(uniq) else None)
+
+def data_fingerprint(store_path, date_from, date_to, valid_frac, racer_features=False):
+    """キャッシュキー: ストアの取り込み状況 + 期間 + 特徴量定義"""
+    conn = race_store.connect(store_path)
+    stat = conn.execute(
+        "SELECT COUNT(*), MIN(date), MAX(date), MAX(updated_at) FROM ingest_log WHERE date BETWEEN ? AND ?",
+        (date_from or "00000000", date_to or "99999999")).fetchone()
+    conn.close()
+    key = json.dumps([CACHE_VERSION, stat, date_from, date_to, valid_frac, *feature_lists(racer_features), N_CLASS_2T, N_CLASS_3T])
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+# ------------------------------------------
+# 学習 (プロセスプール側)
+# ------------------------------------------
+def _cache_paths(cache_key, name):
+    base = os.path.join(CACHE_DIR, f"{cache_key}_{name}")
+    return base + "_train.bin", base + "_valid.bin", base + "_meta.json"
+
+def _train_task(spec):
+    """1モデル分の学習。spec['data'] が None ならキャッシュから Dataset を読む"""
+    t0 = time.time()
+    train_bin, valid_bin, meta_path = _cache_paths(spec['cache_key'], spec['name'])
+    params = dict(PARAMS, num_class=spec['num_class'], num_threads=spec['threads'])
+
+    if spec['data'] is None:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        dtrain = lgb.Dataset(train_bin, params=params)
+        dvalid = lgb.Dataset(valid_bin, reference=dtrain) if meta['has_valid'] else None
+        cached = True
+    else:
+        X, y, Xv, yv = spec['data']
+        dtrain = lgb.Dataset(X, label=y, params=params, free_raw_data=False).construct()
+        dvalid = lgb.Dataset(Xv, label=yv, reference=dtrain).construct() if len(yv) else None
+        meta = {'pandas_categorical': dtrain.pandas_categorical, 'has_valid': dvalid is not None}
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        dtrain.save_binary(train_bin)
+        if dvalid is not None: dvalid.save_binary(valid_bin)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        cached = False
+
+    if dvalid is not None:
+        booster = lgb.train(params, dtrain, NUM_BOOST_ROUND, valid_sets=[dvalid],
+                            callbacks=[lgb.early_stopping(EARLY_STOPPING, verbose=False)])
+        best_iter = booster.best_iteration
+        score = booster.best_score.get('valid_0', {}).get('multi_logloss')
+    else:
+        booster = lgb.train(params, dtrain, 300)
+        best_iter, score = 300, None
+    # バイナリから読んだ Dataset はカテゴリ対応表を持たないので付け直す
+    booster.pandas_categorical = meta['pandas_categorical']
+    return {
+        'name': spec['name'], 'jcd': spec.get('jcd'),
+        'model_str': booster.model_to_string(num_iteration=best_iter),
+        'best_iteration': best_iter, 'valid_logloss': score,
+        'rows': dtrain.num_data(), 'cached': cached, 'sec': round(time.time() - t0, 2),
+    }
+
+# ------------------------------------------
+# 全体の流れ
+# ------------------------------------------
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""): h.update(chunk)
+    return h.hexdigest()
+
+def train_all(store_path=None, date_from=None, date_to=None, out_dir=".", workers=None,
+              valid_frac=0.1, min_races=300, use_cache=True, racer_features=False):
+    cpu = os.cpu_count() or 1
+    feats_2t, feats_3t = feature_lists(racer_features)
+    workers = workers or min(cpu, 25)
+    threads = max(1, cpu // workers)
+    cache_key = data_fingerprint(store_path, date_from, date_to, valid_frac, racer_features)
+    cache_hit = use_cache and os.path.exists(_cache_paths(cache_key, "2t")[2])
+
+    specs = []
+    venue_rows = {}
+    span = (date_from, date_to)
+    if cache_hit:
+        print(f"♻️ Datasetキャッシュを使用: {cache_key}")
+        for name in sorted(os.listdir(CACHE_DIR)):
+            if name.startswith(cache_key + "_3t_") and name.endswith("_meta.json"):
+                jcd = int(name[len(cache_key) + 4:-len("_meta.json")])
+                specs.append({'name': f"3t_{jcd}", 'jcd': jcd, 'num_class': N_CLASS_3T})
+        specs.insert(0, {'name': "2t", 'num_class': N_CLASS_2T})
+        for s in specs: s['data'] = None
+        with open(os.path.join(CACHE_DIR, f"{cache_key}_info.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        span, venue_rows = tuple(info['span']), {int(k): v for k, v in info['venue_rows'].items()}
+    else:
+        t0 = time.time()
+        df, y2, y3, is_valid, span = load_training_frame(store_path, date_from, date_to, valid_frac, racer_features)
+        print(f"📊 学習データ: {len(df) // 6:,} レース ({span[0]}〜{span[1]}) / 特徴量作成 {time.time() - t0:.1f}秒")
+        if len(df) == 0:
+            raise RuntimeError("学習データがありません (backfill.py で取り込んでください)")
+
+        df2 = df.copy()
+        df2['jcd'] = df2['jcd'].astype('category')
+        tr, va = ~is_valid, is_valid
+        specs.append({'name': "2t", 'num_class': N_CLASS_2T,
+                      'data': (df2.loc[tr, feats_2t], y2[tr], df2.loc[va, feats_2t], y2[va])})
+        for jcd in range(1, 25):
+            m = (df['jcd'] == jcd).to_numpy()
+            venue_rows[jcd] = int(m.sum() // 6)
+            if venue_rows[jcd] < min_races:
+                continue
+            specs.append({'name': f"3t_{jcd}", 'jcd': jcd, 'num_class': N_CLASS_3T,
+                          'data': (df.loc[m & tr, feats_3t], y3[m & tr], df.loc[m & va, feats_3t], y3[m & va])})
+        skipped = [j for j, n in venue_rows.items() if n < min_races]
+        if skipped: print(f"⚠️ データ不足で3Tモデルを作らない会場: {skipped} (<{min_races}R)")
+        if use_cache:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(os.path.join(CACHE_DIR, f"{cache_key}_info.json"), "w", encoding="utf-8") as f:
+                json.dump({'span': span, 'venue_rows': venue_rows}, f)
+
+    for s in specs:
+        s['cache_key'] = cache_key
+        s['threads'] = threads
+
+    print(f"🏋️ 学習開始: {len(specs)} モデル / {workers} プロセス x {threads} スレッド")
+    t0 = time.time()
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as ex:
+        for res in ex.map(_train_task, specs):
+            results[res['name']] = res
+            print(f"  ✅ {res['name']:<6} iter={res['best_iteration']:<5} logloss={res['valid_logloss'] or float('nan'):.4f} "
+                  f"rows={res['rows']:,} {'(cache) ' if res['cached'] else ''}{res['sec']}秒")
+    print(f"⏱️ 学習完了: {time.time() - t0:.1f}秒")
+
+    return write_artifacts(results, out_dir, cache_key, span, threads, venue_rows, (feats_2t, feats_3t))
+
+def write_artifacts(results, out_dir, cache_key, span, threads, venue_rows, feats=(FEATURES_2T, FEATURES)):
+    """2つのモデルファイルとマニフェストを一時ファイル経由で置き換える。
+    3つとも書き終えてから置き換え、マニフェストを最後にする (Bot 側はマニフェストとハッシュが
+    一致したときだけ差し替えるので、途中の新旧混在の組は読まれない)"""
+    os.makedirs(out_dir, exist_ok=True)
+    path_2t = os.path.join(out_dir, FILE_2T)
+    path_3t = os.path.join(out_dir, FILE_3T)
+    path_manifest = os.path.join(out_dir, MANIFEST_FILE)
+
+    booster_2t = lgb.Booster(model_str=results['2t']['model_str'])
+    models_3t = {r['jcd']: lgb.Booster(model_str=r['model_str']) for r in results.values() if r['jcd']}
+
+    booster_2t.save_model(path_2t + ".tmp")
+    joblib.dump(models_3t, path_3t + ".tmp")
+
+    sha_2t, sha_3t = _sha256(path_2t + ".tmp"), _sha256(path_3t + ".tmp")
+    now = datetime.datetime.now()
+    manifest = {
+        'version': f"{now.strftime('%Y%m%d-%H%M%S')}-{sha_2t[:6]}{sha_3t[:6]}",
+        'created_at': now.isoformat(timespec="seconds"),
+        'lightgbm': lgb.__version__,
+        'data': {'date_from': span[0], 'date_to': span[1], 'cache_key': cache_key, 'venue_races': venue_rows},
+        'features': {'2t': feats[0], '3t': feats[1]},
+        'params': dict(PARAMS, num_threads=threads),
+        'models': {
+            '2t': {'file': FILE_2T, 'sha256': sha_2t, 'num_class': N_CLASS_2T,
+                   'best_iteration': results['2t']['best_iteration'], 'valid_logloss': results['2t']['valid_logloss']},
+            '3t': {'file': FILE_3T, 'sha256': sha_3t, 'num_class': N_CLASS_3T,
+                   'venues': {str(r['jcd']): {'best_iteration': r['best_iteration'], 'valid_logloss': r['valid_logloss']}
+                              for r in results.values() if r['jcd']}},
+        },
+    }
+    with open(path_manifest + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path_2t + ".tmp", path_2t)
+    os.replace(path_3t + ".tmp", path_3t)
+    os.replace(path_manifest + ".tmp", path_manifest)
+    print(f"💾 出力: {path_2t} / {path_3t} / {path_manifest} (version {manifest['version']})")
+    return manifest
+
+def main():
+    ap = argparse.ArgumentParser(description="2T/3T モデルの再学習")
+    ap.add_argument("--store", default=None, help=f"学習データ (省略時は {race_store.STORE_FILE})")
+    ap.add_argument("--from", dest="date_from", default=None, help="開始日 YYYYMMDD")
+    ap.add_argument("--to", dest="date_to", default=None, help="終了日 YYYYMMDD")
+    ap.add_argument("--out-dir", default=".", help="モデルの出力先")
+    ap.add_argument("--workers", type=int, default=None, help="学習プロセス数 (省略時はCPU数)")
+    ap.add_argument("--valid-frac", type=float, default=0.1, help="検証に使う末尾期間の割合")
+    ap.add_argument("--min-races", type=int, default=300, help="会場別3Tモデルに必要な最低レース数")
+    ap.add_argument("--no-cache", action="store_true", help="Datasetキャッシュを使わない")
+    ap.add_argument("--racer-features", action="store_true", help="選手別成績の列も特徴量に加える")
+    args = ap.parse_args()
+
+    train_all(args.store, args.date_from, args.date_to, args.out_dir, args.workers,
+              args.valid_frac, args.min_races, not args.no_cache, args.racer_features)
+
+if __name__ == "__main__":
+    main()